@@ -0,0 +1,186 @@
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from .manifest import MANIFEST_SUFFIX
+from .storage.base import ObjectChanged
+
+logger = logging.getLogger('afterchive')
+
+# One small index per storage path, next to the backups, so list and
+# restore --latest/--at take one request instead of a bucket listing
+CATALOG_NAME = "catalog.json"
+CATALOG_VERSION = 1
+
+DEFAULT_WORKERS = 8
+
+# Updates that lost to another process, re-read and applied again
+UPDATE_ATTEMPTS = 10
+
+# Manifest fields copied into the catalog
+ENTRY_FIELDS = ("backup", "database", "db_type", "started_at", "created_at", "format", "engine", "size", "checksums")
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Backups of several jobs can land in one storage path at the same
+# time; updates of one catalog are serialized within the process, and
+# written only if no other process stored it since it was read
+_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+
+
+def _lock(config):
+    key = (config.get('type'), config.get('bucket'), config.get('path'))
+    with _LOCKS_GUARD:
+        return _LOCKS.setdefault(key, threading.Lock())
+
+
+def catalog_entry(manifest):
+    entry = {field: manifest.get(field) for field in ENTRY_FIELDS}
+    entry["codec"] = (manifest.get("compression") or {}).get("codec")
+    return entry
+
+
+def load_catalog(storage, config):
+    """The catalog of a storage path, or None if it has none yet"""
+    try:
+        return _decode(storage.get_object(CATALOG_NAME, config))
+    except FileNotFoundError:
+        return None
+
+
+def _decode(data):
+    catalog = json.loads(data)
+    if catalog.get("version") != CATALOG_VERSION:
+        raise ValueError(f"Unsupported catalog version {catalog.get('version')}, rebuild it with `afterchive list --rebuild`")
+    return catalog
+
+
+def _encode(catalog):
+    catalog["updated_at"] = time.strftime(TIME_FORMAT, time.gmtime())
+    catalog["backups"].sort(key=lambda entry: (entry_time(entry), entry["backup"]))
+    return json.dumps(catalog, sort_keys=True).encode()
+
+
+def save_catalog(storage, catalog, config):
+    storage.put_object(CATALOG_NAME, _encode(catalog), config)
+
+
+def rebuild_catalog(storage, config):
+    """Recreate the catalog from the manifests stored next to the backups"""
+    catalog = _catalog_from_manifests(storage, config)
+    save_catalog(storage, catalog, config)
+    return catalog
+
+
+def _catalog_from_manifests(storage, config):
+    started = time.monotonic()
+    names = [
+        name for name in storage.list_objects("", config)
+        if name.endswith(MANIFEST_SUFFIX) and "/" not in name
+    ]
+
+    def read(name):
+        try:
+            return json.loads(storage.get_object(name, config))
+        except Exception as e:
+            logger.warning(f"Skipping unreadable manifest {name}: {e}")
+            return None
+
+    workers = int(config.get('workers') or DEFAULT_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        manifests = [manifest for manifest in pool.map(read, names) if manifest]
+
+    catalog = {"version": CATALOG_VERSION, "backups": [catalog_entry(manifest) for manifest in manifests]}
+    logger.info(f"Catalog rebuilt from {len(manifests)} manifests in {time.monotonic() - started:.1f}s")
+    return catalog
+
+
+def _update_catalog(storage, config, update):
+    """
+    Read the catalog, apply update(catalog) and write it back only if
+    no other process stored it in between; start over if one did.
+    """
+    with _lock(config):
+        for attempt in range(UPDATE_ATTEMPTS):
+            data, version = storage.get_object_version(CATALOG_NAME, config)
+            # First catalog of this path: pick up the backups made before it existed
+            catalog = _decode(data) if data is not None else _catalog_from_manifests(storage, config)
+            update(catalog)
+            try:
+                storage.put_object_if(CATALOG_NAME, _encode(catalog), version, config)
+                return catalog
+            except ObjectChanged:
+                logger.info("The catalog was updated by another process meanwhile, updating it again")
+                time.sleep(random.uniform(0, 0.1 * (attempt + 1)))
+    raise ValueError(f"The catalog kept changing, gave up updating it after {UPDATE_ATTEMPTS} attempts")
+
+
+def record_backup(storage, manifest, config):
+    """Add a stored backup to the catalog of its storage path"""
+    entry = catalog_entry(manifest)
+
+    def update(catalog):
+        # A catalog built from the manifests has the entry already
+        catalog["backups"] = [e for e in catalog["backups"] if e["backup"] != entry["backup"]]
+        catalog["backups"].append(entry)
+
+    _update_catalog(storage, config, update)
+
+
+def forget_backups(storage, backup_names, config):
+    """Drop backups from the catalog, before their objects are deleted"""
+    backup_names = set(backup_names)
+
+    def update(catalog):
+        catalog["backups"] = [e for e in catalog["backups"] if e["backup"] not in backup_names]
+
+    _update_catalog(storage, config, update)
+
+
+def read_catalog(storage, config):
+    """The catalog of a storage path, built from the manifests if missing"""
+    catalog = load_catalog(storage, config)
+    if catalog is None:
+        logger.info("No catalog in this storage location yet, building it from the manifests")
+        catalog = _update_catalog(storage, config, lambda catalog: None)
+    return catalog
+
+
+def parse_time(text):
+    """Parse an ISO 8601 time for --at; times without an offset are UTC"""
+    try:
+        parsed = datetime.fromisoformat(text.strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid time '{text}', expected ISO 8601 like 2024-05-01T13:30:00Z")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def entry_time(entry):
+    """When the backup's snapshot was taken (older manifests: when it finished)"""
+    value = entry.get("started_at") or entry.get("created_at")
+    return datetime.strptime(value, TIME_FORMAT).replace(tzinfo=timezone.utc) if value else datetime.min.replace(tzinfo=timezone.utc)
+
+
+def databases(catalog):
+    return sorted({entry.get("database") or "" for entry in catalog["backups"]})
+
+
+def find_backup(catalog, database, at=None):
+    """
+    The newest backup of `database`, or with `at` the newest one taken
+    at or before that time.
+    """
+    entries = [entry for entry in catalog["backups"] if entry.get("database") == database]
+    if not entries:
+        raise ValueError(f"No backups of database '{database}' in the catalog")
+    if at is not None:
+        entries = [entry for entry in entries if entry_time(entry) <= at]
+        if not entries:
+            raise ValueError(f"No backup of database '{database}' taken at or before {at.strftime(TIME_FORMAT)}")
+    return max(entries, key=lambda entry: (entry_time(entry), entry["backup"]))
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('afterchive')
+
+# GCS keeps resumable upload sessions for a week
+MAX_AGE = 7 * 24 * 3600
+
+
+def checkpoint_dir():
+    return os.getenv('AFTERCHIVE_CHECKPOINT_DIR') or os.path.join(os.path.expanduser('~'), '.afterchive', 'checkpoints')
+
+
+class Checkpoint:
+    """
+    Progress of one transfer, kept in a small JSON file so an interrupted
+    run can pick up where it stopped instead of starting from zero.
+
+    `identity` says what is transferred (object, local file, size...);
+    a checkpoint recorded for anything else, or older than `max_age`
+    seconds, is ignored. Saves are atomic and safe across threads.
+    """
+
+    def __init__(self, kind, identity, max_age=MAX_AGE):
+        key = hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:32]
+        self.path = os.path.join(checkpoint_dir(), f"{kind}-{key}.json")
+        self.identity = identity
+        self._lock = threading.Lock()
+        # State of a matching checkpoint that expired, for cleaning up after it
+        self.stale = {}
+        self.state = self._load(max_age)
+
+    def _load(self, max_age):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return {}
+        if data.get("identity") != self.identity:
+            return {}
+        if time.time() - data.get("updated", 0) > max_age:
+            self.stale = data.get("state") or {}
+            return {}
+        return data.get("state") or {}
+
+    def save(self, **state):
+        with self._lock:
+            self.state.update(state)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({"identity": self.identity, "state": self.state, "updated": time.time()}, f)
+            os.replace(temp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            self.state = {}
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -1,15 +1,13 @@
 import argparse
 import os
 import sys
-import yaml
 import logging
-from .storage import get_storage_strategy
-from .databases import get_strategy
-from .commands import backup_command, restore_command
-from .configs import parse_yaml_config
-from .utils import get_cleaned_conf_cli
+from . import __version__
+
+# Everything else is imported once a command actually runs, so `--help`,
+# `--version` and argument errors don't pay for yaml, the storage and
+# database backends or the streaming machinery.
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger('afterchive')
 
 def main():
@@ -32,6 +30,7 @@ def main():
                     prog='afterchive',
                     description='Database Backup Utility',
                     epilog='')
+    parser.add_argument('--version', action='version', version=f'%(prog)s {__version__}')
     
     # Create parent parser with common arguments
     parent_parser = argparse.ArgumentParser(add_help=False)
@@ -48,20 +47,117 @@ def main():
     parent_parser.add_argument('--region', help='Cloud storage region (if applicable)')
     parent_parser.add_argument('--credentials', help='Path to cloud provider credentials file')
     parent_parser.add_argument('--project', help='Project ID for Google Cloud Storage (optional)')
+    parent_parser.add_argument('--endpoint-url', help='S3-compatible endpoint, e.g. MinIO (default: AWS, or S3_ENDPOINT_URL)')
+    parent_parser.add_argument('--stream', action='store_true', help='Stream data between the database and storage without a local temp file')
+    parent_parser.add_argument('--format', choices=['plain', 'custom', 'directory'], help='Dump format (directory enables parallel dumps)')
+    parent_parser.add_argument('--jobs', type=int, help='Parallel jobs for directory-format dumps, the native engine and pg_restore')
+    parent_parser.add_argument('--engine', choices=['pg_dump', 'native', 'pg_basebackup'], help='Engine: pg_dump/psql (default), native parallel COPY over psycopg2, or pg_basebackup for a physical backup of the cluster')
+    parent_parser.add_argument('--load-setting', action='append', metavar='NAME=VALUE', help='Server setting for restore sessions, e.g. synchronous_commit=off (repeatable)')
+    parent_parser.add_argument('--compress', nargs='?', const='gzip', choices=['gzip', 'zstd'], help='Compress the backup (default codec: gzip)')
+    parent_parser.add_argument('--compression-level', type=int, help='Compression level for --compress')
+    parent_parser.add_argument('--dedup', action='store_true', help='Store the backup as deduplicated chunks, uploading only new ones')
+    parent_parser.add_argument('--throttle', action='store_true', help='Slow the dump and upload down while the server is busy (targets in options.throttle)')
+    parent_parser.add_argument('--encrypt', action='store_true', help='Encrypt the backup with AES-256-GCM')
+    parent_parser.add_argument('--encryption-key-file', help='File with the 32 byte encryption key (default: AFTERCHIVE_ENCRYPTION_KEY)')
+    parent_parser.add_argument('--report', help='Write a JSON run report with per-stage timings to this file')
+    parent_parser.add_argument('--prometheus-file', help='Write run metrics to this Prometheus textfile-collector file')
+
+    # Keep rules for backup (applied after it) and prune
+    retention_parser = argparse.ArgumentParser(add_help=False)
+    retention_parser.add_argument('--keep-days', type=int, help='Keep backups taken in the last N days')
+    retention_parser.add_argument('--keep-last', type=int, help='Keep at most the newest N backups')
+    retention_parser.add_argument('--keep-daily', type=int, help='Keep the newest backup of each of the last N days')
+    retention_parser.add_argument('--keep-weekly', type=int, help='Keep the newest backup of each of the last N weeks')
+    retention_parser.add_argument('--keep-monthly', type=int, help='Keep the newest backup of each of the last N months')
+
+    # Shared by every command
+    profile_parser = argparse.ArgumentParser(add_help=False)
+    profile_parser.add_argument('--profile', metavar='FILE', help='Run under cProfile and write the stats to FILE')
     
     subparsers = parser.add_subparsers(dest="command", required=True)
     
     # Create subparsers that inherit from parent
-    backup_parser = subparsers.add_parser('backup', parents=[parent_parser], help='Backup a database')
-    restore_parser = subparsers.add_parser('restore', parents=[parent_parser], help='Restore a database')
+    backup_parser = subparsers.add_parser('backup', parents=[parent_parser, retention_parser, profile_parser], help='Backup a database')
+    backup_parser.add_argument('--resume', action='store_true', help='Upload the dump a failed backup of the same job kept (within 24h) instead of dumping again')
+    restore_parser = subparsers.add_parser('restore', parents=[parent_parser, profile_parser], help='Restore a database')
     
     # Add restore-specific argument
-    restore_parser.add_argument('--backup-file', help='Path to the backup file for restoration')
+    backup_choice = restore_parser.add_mutually_exclusive_group()
+    backup_choice.add_argument('--backup-file', help='Path to the backup file for restoration')
+    backup_choice.add_argument('--latest', action='store_true', help='Restore the newest backup in the storage catalog')
+    backup_choice.add_argument('--at', metavar='TIME', help='Restore the newest backup taken at or before TIME (ISO 8601, UTC unless an offset is given)')
+    restore_parser.add_argument('--source-db', help='Database whose backups --latest/--at pick from (default: the restored database)')
+    restore_parser.add_argument('--table', action='append', metavar='NAME', help='Only restore this table, fetching just its part of a .dump/.dir backup (repeatable)')
+    restore_parser.add_argument('--schema', action='append', metavar='NAME', help='Only restore this schema (repeatable)')
+    restore_parser.add_argument('--data-dir', help='Empty data directory to restore a base backup (.base.tar) into')
+    restore_parser.add_argument('--target-time', metavar='TIME', help='Replay archived WAL up to TIME after restoring a base backup')
+
+    # PostgreSQL runs these as archive_command and restore_command
+    wal_push_parser = subparsers.add_parser('wal-push', parents=[parent_parser, profile_parser], help='Archive a WAL file (archive_command, %%p)')
+    wal_push_parser.add_argument('wal_path', help='Path of the WAL file to archive (%%p)')
+    wal_push_parser.add_argument('--wal-workers', type=int, help='WAL files uploaded at once, other ready files go along (default: 4)')
+    wal_fetch_parser = subparsers.add_parser('wal-fetch', parents=[parent_parser, profile_parser], help='Restore an archived WAL file (restore_command, %%f %%p)')
+    wal_fetch_parser.add_argument('wal_name', help='Name of the WAL file to restore (%%f)')
+    wal_fetch_parser.add_argument('destination', help='Where to copy it (%%p)')
+    wal_fetch_parser.add_argument('--wal-workers', type=int, help='WAL files downloaded at once, the next ones are prefetched (default: 4)')
+
+    list_parser = subparsers.add_parser('list', parents=[parent_parser, profile_parser], help='List the backups in a storage location')
+    list_parser.add_argument('--json', action='store_true', help='Print the catalog entries as JSON')
+    list_parser.add_argument('--rebuild', action='store_true', help='Rebuild the catalog from the stored manifests first')
+
+    verify_parser = subparsers.add_parser('verify', parents=[parent_parser, profile_parser], help='Check stored backups against their recorded size and checksums')
+    verify_parser.add_argument('--backup-file', help='Only verify this backup (default: every backup, or those of --db-name)')
+    verify_parser.add_argument('--deep', action='store_true', help='Download and hash the backups instead of checking object metadata')
+
+    prune_parser = subparsers.add_parser('prune', parents=[parent_parser, retention_parser, profile_parser], help='Delete the backups a retention policy no longer keeps')
+    prune_parser.add_argument('--dry-run', action='store_true', help='Only log what would be deleted')
+
+    jobs_parser = subparsers.add_parser('run-jobs', parents=[profile_parser], help='Run every backup job of a config file')
+    jobs_parser.add_argument('--config', required=True, help='Path to a config file with a jobs: list')
+    jobs_parser.add_argument('--workers', type=int, help='Jobs to run at once (default: concurrency.workers or 4)')
+    jobs_parser.add_argument('--per-host', type=int, help='Jobs to run at once against one database server (default: concurrency.per_host or 2)')
+    jobs_parser.add_argument('--job', action='append', dest='only', help='Only run the named job (repeatable)')
+
+    daemon_parser = subparsers.add_parser('daemon', parents=[profile_parser], help='Run the scheduled jobs of a config file until stopped')
+    daemon_parser.add_argument('--config', required=True, help='Path to a config file with scheduled jobs')
+    daemon_parser.add_argument('--workers', type=int, help='Jobs to run at once (default: concurrency.workers or 4)')
+    daemon_parser.add_argument('--per-host', type=int, help='Jobs to run at once against one database server (default: concurrency.per_host or 2)')
 
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+    if args.profile:
+        from .metrics import profile_call
+        profile_call(args.profile, run_command, parser, args)
+    else:
+        run_command(parser, args)
+
+
+def run_command(parser, args):
+    if args.command == 'run-jobs':
+        from .jobs import run_jobs_command
+        run_jobs_command(args.config, args.workers, args.per_host, args.only)
+        return
+    if args.command == 'daemon':
+        from .daemon import daemon_command
+        daemon_command(args.config, args.workers, args.per_host)
+        return
+
+    from .commands import (
+        backup_command, restore_command, resolve_backup_command, list_command, prune_command, verify_command,
+        wal_fetch_command, wal_push_command
+    )
+    from .configs import parse_yaml_config
+    from .utils import get_cleaned_conf_cli
+
     if args.config:
-        conf = parse_yaml_config(args.config, args.command)
+        # list and verify look at the storage that restores read from, prune at
+        # the one backups (and their retention policy) go to
+        section = {
+            'list': 'restore', 'verify': 'restore', 'prune': 'backup', 'wal-push': 'backup', 'wal-fetch': 'restore'
+        }.get(args.command, args.command)
+        conf = parse_yaml_config(args.config, section)
     else:
         conf = get_cleaned_conf_cli(args)
         db_password = args.db_pass or os.getenv('AFTERCHIVE_DB_PASSWORD')
@@ -74,16 +170,102 @@ def main():
         #         parser.print_help()
         #         sys.exit(1)
 
+    # CLI flags switch options on even when a config file is used
+    if args.stream:
+        conf['options']['stream'] = True
+    if args.format:
+        conf['options']['format'] = args.format
+    if args.jobs:
+        conf['options']['jobs'] = args.jobs
+    if args.engine:
+        conf['options']['engine'] = args.engine
+    if args.load_setting:
+        settings = dict(conf['options'].get('load_settings') or {})
+        for setting in args.load_setting:
+            name, separator, value = setting.partition('=')
+            if not separator or not name:
+                parser.error(f"--load-setting expects NAME=VALUE, got '{setting}'")
+            settings[name.strip()] = value.strip()
+        conf['options']['load_settings'] = settings
+    if args.compress:
+        conf['options']['compress'] = args.compress
+    if args.compression_level is not None:
+        conf['options']['compression_level'] = args.compression_level
+    if args.dedup:
+        conf['options']['dedup'] = True
+    if args.throttle:
+        conf['options']['throttle'] = conf['options'].get('throttle') or True
+    if args.encrypt:
+        conf['options']['encrypt'] = True
+    if args.encryption_key_file:
+        conf['options']['encryption_key_file'] = args.encryption_key_file
+    if args.report:
+        conf['options']['report'] = args.report
+    if args.prometheus_file:
+        conf['options']['prometheus_file'] = args.prometheus_file
+    retention_flags = {
+        'days': getattr(args, 'keep_days', None),
+        'max_backups': getattr(args, 'keep_last', None),
+        'keep_daily': getattr(args, 'keep_daily', None),
+        'keep_weekly': getattr(args, 'keep_weekly', None),
+        'keep_monthly': getattr(args, 'keep_monthly', None),
+    }
+    retention_flags = {key: value for key, value in retention_flags.items() if value is not None}
+    if retention_flags:
+        conf['options']['retention'] = {**(conf['options'].get('retention') or {}), **retention_flags}
+
     if args.command == 'backup':
-        backup_command(conf['databases'][0], conf['storage'][0])
+        if args.resume:
+            conf['options']['resume'] = True
+        # Every configured destination gets the same single dump
+        backup_command(conf['databases'][0], conf['storage'], conf['options'])
         
     elif args.command == 'restore':
 
-        if not args.backup_file:
-            logger.error("--backup-file is required for restore")
+        if not (args.backup_file or args.latest or args.at):
+            logger.error("--backup-file, --latest or --at is required for restore")
             sys.exit(1)
 
-        restore_command(conf['databases'][0], conf['storage'][0], args.backup_file)
+        if args.table:
+            conf['options']['tables'] = args.table
+        if args.schema:
+            conf['options']['schemas'] = args.schema
+        if args.data_dir:
+            conf['options']['data_directory'] = args.data_dir
+        if args.target_time:
+            conf['options']['recovery_target_time'] = args.target_time
+        if args.config:
+            # For the restore_command of a restored base backup
+            conf['options']['config_file'] = os.path.abspath(args.config)
+        if len(conf['storage']) > 1:
+            logger.info("Multiple storage destinations configured, restoring from the first one")
+        backup_file = args.backup_file or resolve_backup_command(
+            conf['databases'][0], conf['storage'][0], args.at, args.source_db
+        )
+        restore_command(conf['databases'][0], conf['storage'][0], backup_file, conf['options'])
+
+    elif args.command in ('wal-push', 'wal-fetch'):
+        if args.wal_workers:
+            conf['options']['wal_workers'] = args.wal_workers
+        if args.command == 'wal-push':
+            wal_push_command(conf['storage'], args.wal_path, conf['options'])
+        else:
+            if len(conf['storage']) > 1:
+                logger.info("Multiple storage destinations configured, fetching from the first one")
+            wal_fetch_command(conf['storage'][0], args.wal_name, args.destination, conf['options'])
+
+    elif args.command == 'prune':
+        prune_command(conf['storage'], conf['options'].get('retention'), conf['databases'][0].get('name'), args.dry_run)
+
+    elif args.command == 'verify':
+        if len(conf['storage']) > 1:
+            logger.info("Multiple storage destinations configured, verifying the first one")
+        verify_command(conf['storage'][0], args.db_name, args.backup_file, args.deep)
+
+    elif args.command == 'list':
+        if len(conf['storage']) > 1:
+            logger.info("Multiple storage destinations configured, listing the first one")
+        list_command(conf['storage'][0], args.db_name, args.json, args.rebuild)
 
     else:
         logger.error("Unknown command")
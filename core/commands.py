@@ -1,39 +1,425 @@
+import json
 import logging
 import os
+import shlex
+import shutil
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from .storage import get_storage_strategy
 from .databases import get_strategy
+from .compression import (
+    CODECS, get_codec, codec_from_name, strip_codec_suffix,
+    compress_stream, decompress_stream, compress_file, decompress_file
+)
+from .checkpoints import Checkpoint
+from .catalog import (
+    TIME_FORMAT, catalog_entry, databases, entry_time, find_backup, parse_time, read_catalog, rebuild_catalog,
+    record_backup
+)
+from .databases.pg_archive import BlockIndexer
+from .databases.pg_physical import is_base_backup
+from .dedup import ChunkStore, CHUNKS_SUFFIX, is_chunked
+from .encryption import (
+    ENCRYPTED_SUFFIX, DecryptingStorage, decrypt_file, decrypt_stream, encrypt_file, encrypt_stream, encryption_keys,
+    is_encrypted, key_id, strip_encryption_suffix
+)
+from .manifest import build_manifest, manifest_name, store_manifest
+from .metrics import RunReport, metered, stage
+from .retention import apply_retention, check_policy
+from .selective import fetch_selected
+from .streams import HashingReader, hash_file, tee_stream
+from .throttle import Throttle, check_throttle
+from .utils import remove_local_copy
+from .verify import verify_backups
+from .wal import fetch_wal, push_wal
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger('afterchive')
 
-def backup_command(db_conf, storage_conf):
+# A dump left by a failed upload can be uploaded by a `--resume` run within
+# this long; after that it is stale and the database is dumped again
+SPOOL_MAX_AGE = 24 * 3600
+
+def _db_config(db_conf, options=None):
+    options = options or {}
+    return {
+        "host": db_conf.get('host'),
+        "port": db_conf.get('port'),
+        "dbname": db_conf.get('name'),
+        "user": db_conf.get('user'),
+        "password": db_conf.get('password'),
+        "format": options.get('format'),
+        "jobs": options.get('jobs'),
+        "engine": options.get('engine'),
+        "load_settings": options.get('load_settings'),
+        "tables": options.get('tables'),
+        "schemas": options.get('schemas'),
+        "checkpoint": options.get('checkpoint'),
+        "data_directory": options.get('data_directory'),
+        "recovery_target_time": options.get('recovery_target_time'),
+        "restore_command": options.get('restore_command')
+    }
+
+
+def _local_size(path):
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(path)
+            for name in files
+        )
+    return os.path.getsize(path)
+
+
+def _describe_storage(storage_conf):
+    location = storage_conf.get('bucket') or ''
+    if storage_conf.get('path'):
+        location = f"{location}/{storage_conf.get('path')}" if location else storage_conf.get('path')
+    return f"{storage_conf.get('type')}:{location}"
+
+
+def _store_everywhere(targets, store_one):
+    """
+    Run store_one(storage, storage_conf) for every destination at once.
+
+    Returns the exception (or None) for each destination so one failing
+    target doesn't hide the result of the others.
+    """
+    if len(targets) == 1:
+        storage, conf = targets[0]
+        store_one(storage, conf)
+        return [None]
+
+    def run(target):
+        try:
+            store_one(*target)
+        except Exception as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        return list(pool.map(run, targets))
+
+
+def _stream_everywhere(stream, backup_name, targets):
+    """Send one stream to every destination, teeing it when there are several"""
+    if len(targets) == 1:
+        storage, conf = targets[0]
+        storage.store_stream(stream, backup_name, config=conf)
+        return [None]
+
+    consumers = [
+        lambda reader, storage=storage, conf=conf: storage.store_stream(reader, backup_name, config=conf)
+        for storage, conf in targets
+    ]
+    errors = tee_stream(stream, consumers)
+
+    # The same error on every target means the dump itself failed
+    if errors[0] is not None and all(error is errors[0] for error in errors):
+        raise errors[0]
+    return errors
+
+
+@contextmanager
+def _pacing(db, db_config, settings):
+    """A Throttle pacing the block by server load, or None without settings"""
+    if not settings:
+        yield None
+        return
+    with db.load_monitor(db_config) as sample, Throttle(settings, sample) as throttle:
+        yield throttle
+
+
+def _spool_checkpoint(db_conf, options, storage_confs):
+    return Checkpoint("spool", {
+        "database": [db_conf.get('type'), db_conf.get('host'), db_conf.get('port'), db_conf.get('name')],
+        "options": [options.get(key) for key in ('format', 'engine', 'compress', 'compression_level', 'dedup', 'encrypt')],
+        "storage": [_describe_storage(conf) for conf in storage_confs],
+    }, max_age=SPOOL_MAX_AGE)
+
+
+def _discard_spool(state, targets):
+    """Delete a kept dump and what its failed uploads left in storage"""
+    path = state.get("path")
+    if not path:
+        return
+    if os.path.exists(path):
+        stored = set(state.get("stored") or [])
+        for storage, conf in targets:
+            if _describe_storage(conf) in stored:
+                continue
+            try:
+                storage.discard_upload(path, conf)
+            except Exception as e:
+                logger.warning(f"Failed to clean up the interrupted upload to {_describe_storage(conf)}: {e}")
+    remove_local_copy(path)
+
+
+def _pending_spool(spool, targets, resume):
+    """
+    The dump an interrupted backup left behind, if it is still intact and
+    this run resumes it. Otherwise the dump is discarded, so a scheduled
+    run always backs up the database as it is now.
+    """
+    if spool.stale.get("path"):
+        _discard_spool(spool.stale, targets)
+    path = spool.state.get("path")
+    if path and os.path.exists(path) and _local_size(path) == spool.state.get("size"):
+        if resume:
+            return path
+        dumped_at = time.strftime(TIME_FORMAT, time.gmtime(spool.state.get("started_at") or 0))
+        logger.warning(
+            f"Discarding {os.path.basename(path)}, left by a backup that failed to upload "
+            f"(dumped at {dumped_at}); use --resume to upload it instead"
+        )
+    _discard_spool(spool.state, targets)
+    spool.clear()
+    return None
+
+
+def _report_destinations(targets, errors):
+    if len(targets) > 1:
+        for (_, conf), error in zip(targets, errors):
+            if error is None:
+                logger.info(f"✓ {_describe_storage(conf)}")
+            else:
+                logger.error(f"✗ {_describe_storage(conf)}: {error}")
+
+    failed = [error for error in errors if error is not None]
+    if failed:
+        raise ValueError(f"Backup failed for {len(failed)} of {len(targets)} destinations")
+
+
+def _run_reported(command, db_conf, options, run):
+    """
+    Run `run(report)` with a RunReport collecting its stages, then log
+    the stage summary and write the report files asked for in options.
+    """
+    report = RunReport(command, db_conf)
+    error = None
+    try:
+        with report.activate():
+            return run(report)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        report.finish(error)
+        logger.info(f"Stages: {report.summary()}")
+        report.write_outputs(options)
+
+
+def run_backup(db_conf, storage_conf, options=None):
+    """
+    Dump a database and store it.
+
+    storage_conf can be one destination or a list of them. The database
+    is dumped once and the output goes to every destination in parallel.
+    Raises on failure and returns the stored backup's name, size and run
+    report.
+    """
+    options = options or {}
+    return _run_reported("backup", db_conf, options, lambda report: _backup(db_conf, storage_conf, options, report))
+
+
+def _backup(db_conf, storage_conf, options, report):
+    storage_confs = storage_conf if isinstance(storage_conf, list) else [storage_conf]
     logger.info(
         f"Backing up database {db_conf.get('name')} "
         f"of type {db_conf.get('type')} "
-        f"to {storage_conf.get('type')} "
-        f"at path {storage_conf.get('path')}"
+        f"to {', '.join(_describe_storage(conf) for conf in storage_confs)}"
     )
     
-    try:
-        db = get_strategy(db_conf.get('type'))
-        storage = get_storage_strategy(storage_conf.get('type'))
+    db = get_strategy(db_conf.get('type'))
+    targets = [(get_storage_strategy(conf.get('type')), conf) for conf in storage_confs]
+
+    db_config = _db_config(db_conf, options)
+    started_at = report.started_at
+    retention = check_policy(options['retention']) if options.get('retention') else None
+
+    if options.get('stream') and options.get('format') == 'directory':
+        logger.warning("Directory-format dumps can't be streamed, using a local dump directory instead")
+        options = {**options, "stream": False}
+
+    codec = get_codec(options)
+    if codec and options.get('format') == 'directory':
+        logger.warning("Directory-format dumps are compressed by pg_dump itself, skipping the compression stage")
+        codec = None
+    level = options.get('compression_level')
+    threads = options.get('compression_threads')
+
+    encryption_key = None
+    if options.get('encrypt'):
+        if options.get('format') == 'directory':
+            raise ValueError("Directory-format dumps can't be encrypted, use the plain or custom format")
+        if options.get('dedup'):
+            raise ValueError("Encrypted backups can't be deduplicated, turn off one of encrypt and dedup")
+        keys = encryption_keys(options)
+        if not keys:
+            raise ValueError("encrypt needs a key: set encryption_key_file or AFTERCHIVE_ENCRYPTION_KEY")
+        encryption_key = keys[0]
+    threads_encrypt = options.get('encryption_threads')
+    throttle_settings = check_throttle(options['throttle']) if options.get('throttle') else None
+    if throttle_settings and options.get('format') == 'directory':
+        logger.warning("Throttling doesn't apply to directory-format dumps: pg_dump's workers write the files and they are uploaded unpaced")
+        throttle_settings = None
 
-        db_config = {
-            "host": db_conf.get('host'),
-            "port": db_conf.get('port'),
-            "dbname": db_conf.get('name'),
-            "user": db_conf.get('user'),
-            "password": db_conf.get('password')
-        }
+    dedup = options.get('dedup')
+    store_targets = targets
+    if dedup:
+        if options.get('format') == 'directory':
+            raise ValueError("Deduplicated backups need the plain or custom format")
+        if options.get('format') == 'custom':
+            logger.warning("Custom-format dumps are compressed by pg_dump, which defeats deduplication; use the plain format")
+        # Chunks are compressed one by one, compressing the whole
+        # stream would make every backup's bytes unique
+        store_targets = [(ChunkStore(storage, codec, level, db_conf.get('name')), conf) for storage, conf in targets]
 
-        db_file_path = db.backup(config=db_config)
+    if options.get('stream'):
+        # pg_dump output goes straight to storage, no temp file
+        # Stages overlap here: dump and compress record how long their
+        # reader waited on them, upload is the whole pipeline
+        with _pacing(db, db_config, throttle_settings) as throttle, \
+                db.backup_stream(config=db_config) as (backup_name, stream):
+            dump = stream = metered(stream, "dump")
+            if throttle:
+                # Reading pg_dump's pipe slower makes pg_dump itself wait
+                stream = throttle.reader(stream, "dump")
+            indexer = None
+            if backup_name.endswith('.dump') and not codec and not dedup:
+                # Streamed archives get no data offsets from pg_dump, the
+                # index lets --table restores fetch only what they need
+                stream = indexer = BlockIndexer(stream)
+            compressed = encrypted = None
+            if codec and not dedup:
+                compressed = compress_stream(stream, codec, level, threads)
+                # Compression is counted in uncompressed bytes, as for files
+                stream = metered(compressed, "compress", count_bytes=False)
+                backup_name += CODECS[codec]
+            if encryption_key:
+                encrypted = encrypt_stream(stream, encryption_key, threads_encrypt)
+                stream = metered(encrypted, "encrypt")
+                backup_name += ENCRYPTED_SUFFIX
+            # Checksums are computed on the way to storage, no second read
+            counter = HashingReader(stream)
+            try:
+                with stage("upload") as upload:
+                    upload_stream = throttle.reader(counter, "upload") if throttle else counter
+                    errors = _stream_everywhere(upload_stream, backup_name, store_targets)
+                    upload.add(counter.bytes_read)
+            finally:
+                if encrypted is not None:
+                    encrypted.close()
+                if compressed is not None:
+                    compressed.close()
+                    report.get_stage("compress").add(dump.bytes_read)
+        size = counter.bytes_read
+        checksums = counter.checksums()
+        blocks = indexer.blocks if indexer else None
+    else:
+        # A dump whose upload failed is kept; a --resume run uploads it
+        # (resuming the transfer) instead of dumping again
+        spool = _spool_checkpoint(db_conf, options, storage_confs)
+        db_file_path = _pending_spool(spool, targets, options.get('resume'))
+        resumed = db_file_path is not None
+        if resumed:
+            started_at = spool.state["started_at"]
+            logger.info(f"Uploading {os.path.basename(db_file_path)}, left by an interrupted backup, instead of dumping again")
+        else:
+            with stage("dump") as dump, _pacing(db, db_config, throttle_settings) as throttle:
+                pace = {"pace": lambda stream: throttle.reader(stream, "dump")} if throttle else {}
+                db_file_path = db.backup(config={**db_config, **pace})
+                dump.add(_local_size(db_file_path))
+        keep = False
+        try:
+            # A kept dump is compressed and encrypted already
+            if codec and not dedup and not resumed:
+                with stage("compress") as compress:
+                    compress.add(_local_size(db_file_path))
+                    db_file_path = compress_file(db_file_path, codec, level, threads)
+            if encryption_key and not resumed:
+                with stage("encrypt") as encrypt:
+                    encrypt.add(_local_size(db_file_path))
+                    db_file_path = encrypt_file(db_file_path, encryption_key, threads_encrypt)
+            backup_name = os.path.basename(db_file_path)
+            size = _local_size(db_file_path)
+            blocks = None
+            stored = set(spool.state.get("stored") or [])
+            spool.save(path=db_file_path, size=size, started_at=started_at, stored=sorted(stored))
 
-        storage.store(backup_path=db_file_path, config=storage_conf)
+            def store_one(storage, conf):
+                if _describe_storage(conf) in stored:
+                    logger.info(f"Already stored in {_describe_storage(conf)} by the interrupted backup")
+                    return
+                if upload_throttle is not None and not os.path.isdir(db_file_path):
+                    # Paced uploads go through the streaming path
+                    with open(db_file_path, 'rb') as f:
+                        storage.store_stream(upload_throttle.reader(f, "upload"), backup_name, config=conf)
+                    return
+                storage.store(backup_path=db_file_path, config=conf)
 
-        os.remove(db_file_path)
-        logger.info(f"Temporary backup file {db_file_path} removed.")
-        logger.info("Backup process completed successfully.")
+            with stage("upload") as upload, ThreadPoolExecutor(max_workers=1) as hasher, \
+                    _pacing(db, db_config, throttle_settings) as upload_throttle:
+                # The file is hashed while it uploads; directory dumps have no single checksum
+                hashing = None if os.path.isdir(db_file_path) else hasher.submit(hash_file, db_file_path)
+                keep = True
+                errors = _store_everywhere(store_targets, store_one)
+                checksums = hashing.result() if hashing else None
+                upload.add(size)
+            if any(error is not None for error in errors):
+                stored |= {_describe_storage(conf) for (_, conf), error in zip(targets, errors) if error is None}
+                spool.save(stored=sorted(stored))
+            else:
+                keep = False
+        finally:
+            if keep:
+                logger.info(f"Keeping {db_file_path}, `afterchive backup --resume` uploads it instead of dumping again")
+            else:
+                with stage("cleanup"):
+                    remove_local_copy(db_file_path)
+                spool.clear()
+                logger.info(f"Temporary backup file {db_file_path} removed.")
+
+    if dedup:
+        backup_name += CHUNKS_SUFFIX
+    report.info.update(backup=backup_name, size=size)
+
+    with stage("manifest"):
+        encryption = {"algorithm": "AES-256-GCM", "key_id": key_id(encryption_key).hex()} if encryption_key else None
+        manifest = build_manifest(backup_name, db_conf, options, codec, size, started_at, checksums, blocks, encryption)
+        for index, (storage, conf) in enumerate(targets):
+            if errors[index] is None:
+                try:
+                    store_manifest(storage, manifest, conf)
+                except Exception as e:
+                    errors[index] = e
+                    continue
+                try:
+                    record_backup(storage, manifest, conf)
+                except Exception as e:
+                    # The backup is usable, the catalog can be rebuilt from the manifests
+                    logger.warning(f"Failed to update the catalog of {_describe_storage(conf)}: {e}")
+
+    _report_destinations(targets, errors)
+
+    if retention:
+        with stage("retention"):
+            for storage, conf in targets:
+                try:
+                    apply_retention(storage, conf, retention, db_conf.get('name'))
+                except Exception as e:
+                    # The new backup is stored, old ones are pruned next time
+                    logger.warning(f"Retention failed for {_describe_storage(conf)}: {e}")
+
+    logger.info("Backup process completed successfully.")
+    return {"backup": backup_name, "size": size, "report": report.to_dict()}
+
+
+def backup_command(db_conf, storage_conf, options=None):
+    """Run a backup from the CLI, exiting non-zero on failure"""
+    try:
+        run_backup(db_conf, storage_conf, options)
     except ValueError as e:
         # User-facing errors (wrong password, missing db, etc)
         logger.error(str(e))
@@ -45,7 +431,13 @@ def backup_command(db_conf, storage_conf):
         sys.exit(1)
 
 
-def restore_command(db_conf, storage_conf, backup_file):
+def restore_command(db_conf, storage_conf, backup_file, options=None):
+    options = options or {}
+    _run_reported("restore", db_conf, options, lambda report: _restore(db_conf, storage_conf, backup_file, options, report))
+
+
+def _restore(db_conf, storage_conf, backup_file, options, report):
+    report.info.update(backup=backup_file)
     # Here you would add the logic to perform the restore
     db = get_strategy(db_conf.get('type'))
     storage = get_storage_strategy(storage_conf.get('type'))
@@ -59,18 +451,265 @@ def restore_command(db_conf, storage_conf, backup_file):
     #     "project": args.project
     # }
 
-    db_backup_path = storage.retrieve(backup_name= backup_file, config=storage_conf)
+    db_config = _db_config(db_conf, options)
 
-    db_config = {
-        "host": db_conf.get('host'),
-        "port": db_conf.get('port'),
-        "dbname": db_conf.get('name'),
-        "user": db_conf.get('user'),
-        "password": db_conf.get('password')
-    }
+    if is_base_backup(strip_codec_suffix(strip_encryption_suffix(backup_file))) and not db_config["restore_command"]:
+        # The restored cluster replays WAL that wal-push archived here
+        db_config["restore_command"] = _wal_fetch_command(storage_conf, options)
 
-    db.restore(config={**db_config, "backup_file": db_backup_path})
+    if options.get('stream') and backup_file.endswith('.dir'):
+        logger.warning("Directory-format backups can't be streamed, downloading them instead")
+        options = {**options, "stream": False}
 
-    os.remove(db_backup_path)
-    logger.info(f"Temporary backup file {db_backup_path} removed.")
-    logger.info("Restore process completed successfully.")
\ No newline at end of file
+    # Encrypted and compressed backups are detected by suffix and
+    # decrypted/decompressed on the fly
+    encrypted = is_encrypted(backup_file)
+    keys = encryption_keys(options) if encrypted else None
+    threads_decrypt = options.get('encryption_threads')
+    codec = codec_from_name(strip_encryption_suffix(backup_file))
+    source = storage
+    dump_name = strip_codec_suffix(strip_encryption_suffix(backup_file))
+
+    if is_chunked(backup_file):
+        # Deduplicated backups are reassembled from their chunks as a stream
+        source = ChunkStore(storage)
+        codec = None
+        dump_name = backup_file[:-len(CHUNKS_SUFFIX)]
+        options = {**options, "stream": True}
+
+    if options.get('tables') or options.get('schemas'):
+        if not (dump_name.endswith('.dump') or dump_name.endswith('.dir')):
+            raise ValueError("--table and --schema need a custom (.dump) or directory (.dir) backup")
+        if codec or source is not storage:
+            logger.warning("Compressed and deduplicated backups can't be read selectively, restoring from the whole backup")
+        elif encrypted:
+            # Only the chunks covering the TOC and the selected tables are decrypted
+            if _restore_selected(db, DecryptingStorage(storage, keys), storage_conf, backup_file, db_config, options, dump_name):
+                return
+        elif storage_conf.get('type') != 'local' and _restore_selected(db, storage, storage_conf, backup_file, db_config, options):
+            # Local backups are read in place, pg_restore seeks to the tables itself
+            return
+
+    if options.get('stream'):
+        # Object stream goes straight into psql/pg_restore, no local copy
+        with source.retrieve_stream(backup_file, config=storage_conf) as stream:
+            stream = metered(stream, "download")
+            decrypted = decompressed = None
+            if encrypted:
+                decrypted = decrypt_stream(stream, keys, threads_decrypt, backup_file)
+                stream = metered(decrypted, "decrypt")
+            if codec:
+                decompressed = decompress_stream(stream, codec)
+                stream = metered(decompressed, "decompress")
+            try:
+                with stage("restore") as restore:
+                    db.restore_stream(
+                        config={**db_config, "backup_name": dump_name},
+                        stream=stream
+                    )
+                    restore.add(getattr(stream, 'bytes_read', 0))
+            finally:
+                if decompressed is not None:
+                    decompressed.close()
+                if decrypted is not None:
+                    decrypted.close()
+        logger.info("Restore process completed successfully.")
+        return
+
+    with stage("download") as download:
+        db_backup_path = storage.retrieve(backup_name= backup_file, config=storage_conf)
+        download.add(_local_size(db_backup_path))
+    restore_path = decrypted_path = db_backup_path
+    try:
+        if encrypted:
+            with stage("decrypt") as decrypt:
+                restore_path = decrypted_path = decrypt_file(db_backup_path, keys, threads_decrypt)
+                decrypt.add(_local_size(decrypted_path))
+        if codec:
+            with stage("decompress") as decompress:
+                restore_path = decompress_file(decrypted_path)
+                decompress.add(_local_size(restore_path))
+
+        with stage("restore") as restore:
+            db.restore(config={**db_config, "backup_file": restore_path})
+            restore.add(_local_size(restore_path))
+    finally:
+        with stage("cleanup"):
+            for path in {restore_path, decrypted_path} - {db_backup_path}:
+                remove_local_copy(path)
+            # Removes temp downloads; backups read in place are left alone
+            storage.release(db_backup_path)
+
+    logger.info("Restore process completed successfully.")
+
+def _restore_selected(db, storage, storage_conf, backup_file, db_config, options, local_name=None):
+    """Restore --table/--schema from just their part of the archive"""
+    with stage("download") as download:
+        fetched = fetch_selected(
+            storage, storage_conf, backup_file, options.get('tables'), options.get('schemas'), local_name
+        )
+        if fetched is None:
+            return False
+        path, size = fetched
+        download.add(size)
+    try:
+        with stage("restore") as restore:
+            db.restore(config={**db_config, "backup_file": path})
+            restore.add(size)
+    finally:
+        with stage("cleanup"):
+            remove_local_copy(path)
+    logger.info("Restore process completed successfully.")
+    return True
+
+
+def _wal_fetch_command(storage_conf, options):
+    """restore_command fetching WAL from the storage a base backup is restored from"""
+    if options.get('config_file'):
+        args = ['--config', options['config_file']]
+    else:
+        args = ['--storage', storage_conf.get('type')]
+        for key in ('path', 'bucket', 'region', 'credentials', 'project', 'endpoint_url'):
+            if storage_conf.get(key):
+                args += [f"--{key.replace('_', '-')}", str(storage_conf.get(key))]
+        if isinstance(options.get('encryption_key_file'), str):
+            args += ['--encryption-key-file', os.path.abspath(os.path.expanduser(options['encryption_key_file']))]
+    program = shutil.which('afterchive') or 'afterchive'
+    return " ".join(shlex.quote(arg) for arg in [program, 'wal-fetch', *args]) + " %f %p"
+
+
+def wal_push_command(storage_confs, wal_path, options=None):
+    """archive_command: store a WAL file in every destination, exiting non-zero on failure"""
+    options = options or {}
+    try:
+        targets = [(get_storage_strategy(conf.get('type')), conf) for conf in storage_confs]
+        push_wal(targets, wal_path, options)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    except Exception as e:
+        logger.error(f"Archiving {os.path.basename(wal_path)} failed: {e}")
+        logger.debug("Full error:", exc_info=True)
+        sys.exit(1)
+
+
+def wal_fetch_command(storage_conf, wal_name, destination, options=None):
+    """restore_command: exits non-zero when the WAL file isn't archived, which ends recovery"""
+    options = options or {}
+    try:
+        storage = get_storage_strategy(storage_conf.get('type'))
+        found = fetch_wal(storage, storage_conf, wal_name, destination, options)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    except Exception as e:
+        logger.error(f"Fetching {wal_name} failed: {e}")
+        logger.debug("Full error:", exc_info=True)
+        sys.exit(1)
+    if not found:
+        logger.info(f"{wal_name} is not in the WAL archive of {_describe_storage(storage_conf)}")
+        sys.exit(1)
+
+
+def resolve_backup_command(db_conf, storage_conf, at=None, source_db=None):
+    """
+    Pick the backup for restore --latest/--at from the storage catalog.
+
+    Backups of `source_db` are searched, by default the database being
+    restored or the only database in the catalog.
+    """
+    try:
+        storage = get_storage_strategy(storage_conf.get('type'))
+        catalog = read_catalog(storage, storage_conf)
+        database = source_db
+        if not database:
+            names = databases(catalog)
+            if db_conf.get('name') in names:
+                database = db_conf.get('name')
+            elif len(names) == 1:
+                database = names[0]
+            elif not names:
+                raise ValueError(f"No backups in {_describe_storage(storage_conf)}")
+            else:
+                raise ValueError(f"Backups of several databases ({', '.join(names)}) are stored here, pick one with --source-db")
+        entry = find_backup(catalog, database, parse_time(at) if at else None)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    logger.info(f"Restoring {entry['backup']} of {database}, taken {entry_time(entry).strftime(TIME_FORMAT)}")
+    return entry['backup']
+
+
+def list_command(storage_conf, database=None, as_json=False, rebuild=False):
+    """Print the backups of a storage location from its catalog"""
+    try:
+        storage = get_storage_strategy(storage_conf.get('type'))
+        catalog = rebuild_catalog(storage, storage_conf) if rebuild else read_catalog(storage, storage_conf)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    entries = [entry for entry in catalog["backups"] if not database or entry.get("database") == database]
+    if as_json:
+        print(json.dumps(entries, indent=2))
+        return
+
+    if not entries:
+        logger.info(f"No backups in {_describe_storage(storage_conf)}")
+        return
+    rows = [("TAKEN (UTC)", "DATABASE", "SIZE", "FORMAT", "CODEC", "BACKUP")]
+    for entry in entries:
+        size = entry.get("size")
+        rows.append((
+            entry_time(entry).strftime(TIME_FORMAT),
+            entry.get("database") or "-",
+            f"{size / (1024 * 1024):.1f} MB" if size is not None else "-",
+            entry.get("format") or "-",
+            entry.get("codec") or "-",
+            entry["backup"],
+        ))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]) - 1)]
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)) + "  " + row[-1])
+
+
+def prune_command(storage_confs, policy, database=None, dry_run=False):
+    """Apply a retention policy to every destination, exiting non-zero on failure"""
+    failed = False
+    for storage_conf in storage_confs:
+        try:
+            storage = get_storage_strategy(storage_conf.get('type'))
+            apply_retention(storage, storage_conf, policy, database, dry_run)
+        except ValueError as e:
+            logger.error(f"{_describe_storage(storage_conf)}: {e}")
+            failed = True
+        except Exception as e:
+            logger.error(f"Pruning {_describe_storage(storage_conf)} failed: {e}")
+            logger.debug("Full error:", exc_info=True)
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+def verify_command(storage_conf, database=None, backup_file=None, deep=False):
+    """Verify stored backups against their manifests, exiting non-zero on a mismatch"""
+    try:
+        storage = get_storage_strategy(storage_conf.get('type'))
+        if backup_file:
+            try:
+                entries = [catalog_entry(json.loads(storage.get_object(manifest_name(backup_file), storage_conf)))]
+            except FileNotFoundError:
+                raise ValueError(f"No manifest for '{backup_file}', nothing to verify it against")
+        else:
+            catalog = read_catalog(storage, storage_conf)
+            entries = [entry for entry in catalog["backups"] if not database or entry.get("database") == database]
+            if not entries:
+                raise ValueError(f"No backups to verify in {_describe_storage(storage_conf)}")
+        results = verify_backups(storage, storage_conf, entries, deep)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    if any(problems for _, problems in results):
+        sys.exit(1)
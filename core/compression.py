@@ -0,0 +1,194 @@
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import zlib
+from .streams import PrefetchReader, STREAM_CHUNK_SIZE
+from .utils import remove_local_copy
+
+logger = logging.getLogger('afterchive')
+
+# Codec name -> suffix appended to the backup name
+CODECS = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+DEFAULT_CODEC = "gzip"
+DEFAULT_LEVELS = {
+    "gzip": 6,
+    "zstd": 3,
+}
+
+
+def get_codec(options):
+    """Return the codec selected in options, or None if compression is off"""
+    compress = options.get('compress')
+    if not compress:
+        return None
+
+    # `compress: true` uses the default codec, `compress: zstd` picks one
+    codec = compress if isinstance(compress, str) else options.get('compression') or DEFAULT_CODEC
+    if codec not in CODECS:
+        raise ValueError(f"Unsupported compression codec: {codec} (expected one of: {', '.join(CODECS)})")
+    return codec
+
+
+def codec_from_name(backup_name):
+    """Detect the codec of a stored backup from its suffix"""
+    for codec, suffix in CODECS.items():
+        if backup_name.endswith(suffix):
+            return codec
+    return None
+
+
+def strip_codec_suffix(backup_name):
+    codec = codec_from_name(backup_name)
+    if codec:
+        return backup_name[:-len(CODECS[codec])]
+    return backup_name
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "zstd support not installed. "
+            "Install with: pip install afterchive[zstd]"
+        )
+    return zstandard
+
+
+class _GzipCompressReader:
+    """Readable stream that gzips another stream as it is read"""
+
+    def __init__(self, source, level):
+        self._source = source
+        # wbits=31 writes a gzip header/trailer instead of raw zlib
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            data = self._source.read(STREAM_CHUNK_SIZE)
+            if data:
+                self._buffer += self._compressor.compress(data)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def compress_stream(stream, codec, level=None, threads=None):
+    """
+    Wrap a readable stream so reads return compressed data.
+
+    Compression runs on a background thread (and zstd on `threads`
+    worker threads of its own), so it overlaps with both the dump
+    feeding it and the upload consuming it.
+    """
+    level = level if level is not None else DEFAULT_LEVELS[codec]
+
+    if codec == "gzip":
+        reader = _GzipCompressReader(stream, level)
+    elif codec == "zstd":
+        zstandard = _zstandard()
+        # threads=-1 lets zstd use one worker per CPU
+        compressor = zstandard.ZstdCompressor(level=level, threads=threads if threads is not None else -1)
+        reader = compressor.stream_reader(stream, read_size=STREAM_CHUNK_SIZE)
+    else:
+        raise ValueError(f"Unsupported compression codec: {codec}")
+
+    return PrefetchReader(reader)
+
+
+def decompress_stream(stream, codec):
+    """Wrap a readable stream of compressed data so reads return plain data"""
+    if codec == "gzip":
+        reader = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif codec == "zstd":
+        zstandard = _zstandard()
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            stream, read_size=STREAM_CHUNK_SIZE, read_across_frames=True
+        )
+    else:
+        raise ValueError(f"Unsupported compression codec: {codec}")
+
+    return PrefetchReader(reader)
+
+
+def compress_bytes(data, codec, level=None):
+    """Compress one in-memory block, e.g. a dedup chunk"""
+    level = level if level is not None else DEFAULT_LEVELS[codec]
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=level)
+    if codec == "zstd":
+        return _zstandard().ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def decompress_bytes(data, codec):
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        return _zstandard().ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def compress_file(path, codec, level=None, threads=None):
+    """Compress a dump file next to itself and remove the original"""
+    compressed_path = f"{path}{CODECS[codec]}"
+    try:
+        with open(path, 'rb') as source, open(compressed_path, 'wb') as out:
+            stream = compress_stream(source, codec, level, threads)
+            try:
+                shutil.copyfileobj(stream, out, STREAM_CHUNK_SIZE)
+            finally:
+                stream.close()
+    except Exception:
+        if os.path.exists(compressed_path):
+            os.remove(compressed_path)
+        raise
+
+    logger.info(
+        f"Compressed {os.path.basename(path)} with {codec}: "
+        f"{os.path.getsize(path)} -> {os.path.getsize(compressed_path)} bytes"
+    )
+    os.remove(path)
+    return compressed_path
+
+
+def decompress_file(path):
+    """
+    Decompress a retrieved backup into a new temp directory.
+
+    The compressed file is left alone, it may be the stored backup itself.
+    """
+    codec = codec_from_name(path)
+    if not codec:
+        return path
+
+    plain_path = os.path.join(tempfile.mkdtemp(), strip_codec_suffix(os.path.basename(path)))
+    try:
+        with open(path, 'rb') as source, open(plain_path, 'wb') as out:
+            stream = decompress_stream(source, codec)
+            try:
+                shutil.copyfileobj(stream, out, STREAM_CHUNK_SIZE)
+            finally:
+                stream.close()
+    except Exception:
+        remove_local_copy(plain_path)
+        raise
+
+    return plain_path
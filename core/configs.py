@@ -3,7 +3,6 @@ import logging
 import re
 import os
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger('afterchive')
 
 def _read_yaml(file_path):
@@ -50,11 +49,83 @@ def parse_yaml_config(file_path, command):
     
     db_config = {key:value for key, value in config_dict.get("database").items()} 
 
-    storage_config = {key:value for key, value in config_dict.get("storage").items()}
+    # `storage:` can be a single destination or a list of them
+    storage_section = config_dict.get("storage")
+    if isinstance(storage_section, dict):
+        storage_section = [storage_section]
+    storage_config = [
+        {key:value for key, value in destination.items()}
+        for destination in storage_section
+    ]
+
+    options = dict(config_dict.get("options") or {})
+    # `retention:` sits next to options in the yaml
+    if config_dict.get("retention"):
+        options["retention"] = {**(options.get("retention") or {}), **config_dict["retention"]}
 
     clean_config = {
-        "storage": [storage_config], 
-        "databases": [db_config]
+        "storage": storage_config, 
+        "databases": [db_config],
+        "options": options
     }
 
-    return clean_config
\ No newline at end of file
+    return clean_config
+
+def _storage_list(storage_section):
+    if isinstance(storage_section, dict):
+        return [dict(storage_section)]
+    return [dict(destination) for destination in storage_section or []]
+
+
+def _schedule_dict(schedule_section):
+    if isinstance(schedule_section, str):
+        return {"cron": schedule_section}
+    return dict(schedule_section or {})
+
+
+def parse_jobs_config(file_path):
+    """
+    Read the `jobs:` list of a config file.
+
+    Top-level `storage:`, `options:`, `schedule:` and `retention:` are
+    defaults for every job; a job can override its storage and extend
+    the options, schedule and retention. A schedule is a cron string or a dict with `cron`,
+    `jitter_seconds` and `timezone`.
+    """
+    config_dict = _substitute_env_vars(_read_yaml(file_path) or {})
+
+    default_storage = _storage_list(config_dict.get("storage"))
+    default_options = dict(config_dict.get("options") or {})
+    default_schedule = _schedule_dict(config_dict.get("schedule"))
+    default_retention = dict(config_dict.get("retention") or {})
+
+    jobs = []
+    for index, job in enumerate(config_dict.get("jobs") or []):
+        database = job.get("database")
+        if not database:
+            raise ValueError(f"Job #{index + 1} has no database section")
+
+        storage = _storage_list(job.get("storage")) or default_storage
+        if not storage:
+            raise ValueError(f"Job '{job.get('name') or database.get('name')}' has no storage section")
+
+        options = {**default_options, **(job.get("options") or {})}
+        retention = {**default_retention, **(options.get("retention") or {}), **(job.get("retention") or {})}
+        if retention:
+            options["retention"] = retention
+
+        jobs.append({
+            "name": job.get("name") or database.get("name"),
+            "databases": [dict(database)],
+            "storage": storage,
+            "options": options,
+            "schedule": {**default_schedule, **_schedule_dict(job.get("schedule"))},
+        })
+
+    if not jobs:
+        raise ValueError(f"No jobs defined in {file_path}")
+
+    return {
+        "jobs": jobs,
+        "concurrency": dict(config_dict.get("concurrency") or {}),
+    }
@@ -0,0 +1,137 @@
+import datetime
+import logging
+import random
+import signal
+import sys
+import threading
+import time
+from .configs import parse_jobs_config
+from .jobs import JobPool
+from .schedule import CronSchedule
+
+logger = logging.getLogger('afterchive')
+
+# Longest the loop sleeps before looking at the clock and signals again
+TICK_SECONDS = 5
+
+
+def _timezone(name):
+    if not name:
+        return None
+    try:
+        from zoneinfo import ZoneInfo
+    except ImportError:
+        raise ValueError("Schedule timezones need Python 3.9+ (zoneinfo)")
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        raise ValueError(f"Unknown timezone: {name}")
+
+
+class ScheduledJob:
+    """A backup job, its cron schedule and the time of its next run"""
+
+    def __init__(self, job):
+        schedule = job["schedule"]
+        self.job = job
+        self.name = job["name"]
+        self.cron = CronSchedule(str(schedule["cron"]))
+        self.jitter = float(schedule.get("jitter_seconds") or 0)
+        self.timezone = _timezone(schedule.get("timezone"))
+        self.next_run = None
+
+    def plan(self, now):
+        """Pick the next run after `now` (epoch seconds), plus random jitter"""
+        moment = datetime.datetime.fromtimestamp(now, self.timezone)
+        fire_at = self.cron.next_after(moment).timestamp()
+        # Spread jobs sharing a schedule instead of starting them all at once
+        self.next_run = fire_at + random.uniform(0, self.jitter)
+        return self.next_run
+
+
+def _log_result(job, result):
+    if result["ok"]:
+        mb = (result["size"] or 0) / (1024 * 1024)
+        logger.info(f"Job {job['name']} finished: {result['backup']} ({mb:.1f} MB) in {result['duration']:.1f}s")
+    else:
+        logger.error(f"Job {job['name']} failed after {result['duration']:.1f}s: {result['error']}")
+
+
+def run_daemon(config_path, workers=None, per_host=None):
+    """
+    Run the scheduled jobs of a config file until SIGTERM/SIGINT.
+
+    Everything that doesn't change between runs (config, imported
+    backends, storage clients) is set up once. Due jobs go through a
+    JobPool, so the concurrency caps of run-jobs apply, and a job that is
+    still running when it comes due again is skipped rather than stacked.
+    """
+    config = parse_jobs_config(config_path)
+    concurrency = config["concurrency"]
+
+    scheduled = []
+    for job in config["jobs"]:
+        if job["schedule"].get("enabled", True) is False:
+            continue
+        if not job["schedule"].get("cron"):
+            logger.warning(f"Job {job['name']} has no schedule, skipping it")
+            continue
+        scheduled.append(ScheduledJob(job))
+    if not scheduled:
+        raise ValueError(f"No scheduled jobs in {config_path}")
+
+    pool = JobPool(workers or concurrency.get("workers"), per_host or concurrency.get("per_host"))
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}, stopping after running jobs finish")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    now = time.time()
+    for entry in scheduled:
+        entry.plan(now)
+        logger.info(
+            f"Scheduled {entry.name} ({entry.cron.expression}), next run at "
+            f"{datetime.datetime.fromtimestamp(entry.next_run, entry.timezone):%Y-%m-%d %H:%M:%S %Z}".rstrip()
+        )
+    logger.info(f"Daemon started with {len(scheduled)} jobs, {pool.workers} workers, at most {pool.per_host} per host")
+
+    try:
+        while not stop.is_set():
+            now = time.time()
+            for entry in scheduled:
+                if entry.next_run > now:
+                    continue
+                if pool.is_queued(entry.name):
+                    logger.warning(f"Job {entry.name} is still running, skipping this run")
+                else:
+                    logger.info(f"Starting job {entry.name}")
+                    pool.submit(entry.job)
+                entry.plan(now)
+
+            timeout = min(entry.next_run for entry in scheduled) - time.time()
+            timeout = min(max(timeout, 0), TICK_SECONDS)
+            if pool.busy:
+                for job, result in pool.wait(timeout):
+                    _log_result(job, result)
+            else:
+                stop.wait(timeout)
+    finally:
+        if pool.busy:
+            logger.info("Waiting for running jobs to finish")
+        pool.shutdown()
+        for job, result in pool.wait(0):
+            _log_result(job, result)
+
+    logger.info("Daemon stopped")
+
+
+def daemon_command(config_path, workers=None, per_host=None):
+    try:
+        run_daemon(config_path, workers, per_host)
+    except (ValueError, FileNotFoundError) as e:
+        logger.error(str(e))
+        sys.exit(1)
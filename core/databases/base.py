@@ -4,3 +4,9 @@ class BackupStrategy:
     
     def restore(self, config):
         raise NotImplementedError
+
+    def backup_stream(self, config):
+        raise NotImplementedError
+
+    def restore_stream(self, config, stream):
+        raise NotImplementedError
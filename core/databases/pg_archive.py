@@ -0,0 +1,351 @@
+"""
+Reading pg_dump custom (-Fc) and directory (-Fd) archives without
+pg_restore: the header and table of contents, and where each entry's
+data lives, so a selective restore can fetch only those bytes.
+
+Follows pg_backup_archiver.c (ReadHead, ReadToc) and the custom
+format's block layout in pg_backup_custom.c.
+"""
+import logging
+
+logger = logging.getLogger('afterchive')
+
+MAGIC = b"PGDMP"
+
+FORMAT_CUSTOM = 1
+FORMAT_DIRECTORY = 5
+
+# Custom format data blocks
+BLK_DATA = 1
+BLK_BLOBS = 3
+
+# State of an entry's data offset in a custom archive
+OFFSET_NOT_SET = 1
+OFFSET_SET = 2
+OFFSET_NO_DATA = 3
+
+
+def _version(major, minor, rev=0):
+    return (major * 256 + minor) * 256 + rev
+
+
+# Archive versions that changed the header or TOC layout
+K_VERS_1_4 = _version(1, 4)
+K_VERS_1_7 = _version(1, 7)
+K_VERS_1_8 = _version(1, 8)
+K_VERS_1_10 = _version(1, 10)
+K_VERS_1_11 = _version(1, 11)
+K_VERS_1_12 = _version(1, 12)
+K_VERS_1_14 = _version(1, 14)
+K_VERS_1_15 = _version(1, 15)
+K_VERS_1_16 = _version(1, 16)
+MAX_VERSION = _version(1, 16, 255)
+
+# Entries pg_restore -t selects by name
+TABLE_DESCS = frozenset({
+    "TABLE", "TABLE DATA", "VIEW", "FOREIGN TABLE", "MATERIALIZED VIEW",
+    "MATERIALIZED VIEW DATA", "SEQUENCE", "SEQUENCE SET",
+})
+
+
+class NeedMoreData(Exception):
+    """The buffer ends before the header and TOC do"""
+
+
+class _Reader:
+    def __init__(self, data, int_size=4, version=0):
+        self.data = data
+        self.pos = 0
+        self.int_size = int_size
+        self.version = version
+
+    def bytes(self, count):
+        if self.pos + count > len(self.data):
+            raise NeedMoreData()
+        chunk = bytes(self.data[self.pos:self.pos + count])
+        self.pos += count
+        return chunk
+
+    def byte(self):
+        return self.bytes(1)[0]
+
+    def int(self):
+        # A sign byte, then int_size bytes little-endian
+        sign = self.byte()
+        value = int.from_bytes(self.bytes(self.int_size), 'little')
+        return -value if sign else value
+
+    def str(self):
+        length = self.int()
+        if length < 0:
+            return None
+        return self.bytes(length).decode('utf-8', errors='replace')
+
+
+class TocEntry:
+    def __init__(self, dump_id):
+        self.dump_id = dump_id
+        self.had_dumper = False
+        self.tag = None
+        self.desc = None
+        self.namespace = None
+        self.data_state = None
+        self.data_pos = None
+        # Where the data offset is stored in the archive, for patching
+        self.offset_at = None
+        self.filename = None
+
+    @property
+    def has_data(self):
+        if self.filename is not None:
+            return True
+        return self.data_state in (OFFSET_SET, OFFSET_NOT_SET) and self.had_dumper
+
+    def __repr__(self):
+        return f"TocEntry({self.dump_id}, {self.desc!r}, {self.namespace!r}, {self.tag!r})"
+
+
+class Archive:
+    def __init__(self, version, int_size, off_size, archive_format, entries, toc_end):
+        self.version = version
+        self.int_size = int_size
+        self.off_size = off_size
+        self.format = archive_format
+        self.entries = entries
+        self.toc_end = toc_end
+
+    @property
+    def version_text(self):
+        return f"{self.version >> 16}.{(self.version >> 8) & 0xff}.{self.version & 0xff}"
+
+
+def read_toc(data):
+    """
+    Parse the header and TOC at the start of an archive (or of a
+    directory archive's toc.dat). Raises NeedMoreData if `data` stops
+    short and ValueError if it isn't a supported archive.
+    """
+    reader = _Reader(data)
+    if reader.bytes(5) != MAGIC:
+        raise ValueError("Not a pg_dump archive (no PGDMP header)")
+    major, minor = reader.byte(), reader.byte()
+    rev = reader.byte() if (major, minor) > (1, 0) else 0
+    version = _version(major, minor, rev)
+    if version < K_VERS_1_12 or version > MAX_VERSION:
+        raise ValueError(f"Unsupported archive version {major}.{minor}.{rev}")
+    reader.version = version
+    reader.int_size = reader.byte()
+    off_size = reader.byte()
+    archive_format = reader.byte()
+    if archive_format not in (FORMAT_CUSTOM, FORMAT_DIRECTORY):
+        raise ValueError(f"Unsupported archive format {archive_format}")
+
+    if version >= K_VERS_1_15:
+        reader.byte()  # compression algorithm
+    else:
+        reader.int()  # compression level
+    for _ in range(7):
+        reader.int()  # creation time, struct tm fields
+    reader.str()  # database name
+    reader.str()  # server version
+    reader.str()  # pg_dump version
+
+    entries = []
+    for _ in range(reader.int()):
+        entry = TocEntry(reader.int())
+        entry.had_dumper = bool(reader.int())
+        reader.str()  # table oid
+        reader.str()  # oid
+        entry.tag = reader.str()
+        entry.desc = reader.str()
+        reader.int()  # section
+        reader.str()  # definition
+        reader.str()  # drop statement
+        reader.str()  # copy statement
+        entry.namespace = reader.str()
+        reader.str()  # tablespace
+        if version >= K_VERS_1_14:
+            reader.str()  # table access method
+        if version >= K_VERS_1_16:
+            reader.int()  # relkind
+        reader.str()  # owner
+        reader.str()  # with oids
+        while reader.str() is not None:
+            pass  # dependencies, terminated by a NULL string
+        if archive_format == FORMAT_CUSTOM:
+            entry.offset_at = reader.pos
+            entry.data_state = reader.byte()
+            if entry.data_state not in (OFFSET_NOT_SET, OFFSET_SET, OFFSET_NO_DATA):
+                raise ValueError(f"Unexpected data offset flag {entry.data_state} in entry {entry.dump_id}")
+            entry.data_pos = int.from_bytes(reader.bytes(off_size), 'little')
+        else:
+            entry.filename = reader.str() or None
+        entries.append(entry)
+
+    return Archive(version, reader.int_size, off_size, archive_format, entries, reader.pos)
+
+
+def select_entries(archive, tables=(), schemas=()):
+    """The entries pg_restore -t/-n would restore"""
+    tables, schemas = set(tables or ()), set(schemas or ())
+    selected = []
+    for entry in archive.entries:
+        if schemas and entry.namespace not in schemas:
+            continue
+        if tables and not (entry.desc in TABLE_DESCS and entry.tag in tables):
+            continue
+        selected.append(entry)
+    return selected
+
+
+def data_ranges(archive, entries, size, blocks=None):
+    """
+    (entry, start, end) byte ranges of the entries' data in a custom
+    archive of `size` bytes, or None if their position is unknown.
+
+    pg_dump records offsets when it writes to a file; streamed dumps
+    have none, for those `blocks` ({dump_id: [start, end]}, as recorded
+    by BlockIndexer) is used.
+    """
+    if blocks is not None:
+        blocks = {int(dump_id): span for dump_id, span in blocks.items()}
+        if all(entry.dump_id in blocks for entry in entries):
+            return [(entry, *blocks[entry.dump_id]) for entry in entries]
+    if not all(entry.data_state == OFFSET_SET for entry in entries):
+        return None
+    # A block ends where the next one starts
+    starts = sorted({entry.data_pos for entry in archive.entries if entry.data_state == OFFSET_SET})
+    ranges = []
+    for entry in entries:
+        later = [start for start in starts if start > entry.data_pos]
+        ranges.append((entry, entry.data_pos, later[0] if later else size))
+    return ranges
+
+
+def offset_patch(archive, entry, start):
+    """(position, bytes) that mark the entry's data as stored at `start`"""
+    return entry.offset_at, bytes([OFFSET_SET]) + start.to_bytes(archive.off_size, 'little')
+
+
+class BlockIndexer:
+    """
+    Pass-through reader that records where each data block of a custom
+    archive starts and ends while it streams by.
+
+    pg_dump can only write data offsets into the TOC of a seekable file,
+    so a streamed dump has none; with this index a selective restore can
+    still fetch just the blocks it needs. Indexing stops (blocks is None)
+    on anything unexpected, the stream itself is never affected.
+    """
+
+    # Give up if the header and TOC are larger than this
+    MAX_TOC_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, source):
+        self._source = source
+        self._buffer = bytearray()
+        self._pos = 0  # archive offset of _buffer[0]
+        self._skip = 0
+        self._archive = None
+        self._state = "block"
+        self._current = None
+        self._in_blobs = False
+        self.blocks = {}
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        if data and self.blocks is not None:
+            try:
+                self._feed(data)
+            except Exception as e:
+                logger.debug(f"Not indexing archive blocks: {e}")
+                self.blocks = None
+                self._buffer = bytearray()
+        return data
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close:
+            close()
+
+    def _feed(self, data):
+        view = memoryview(data)
+        if self._skip:
+            taken = min(self._skip, len(view))
+            self._skip -= taken
+            self._pos += taken
+            view = view[taken:]
+        if not len(view):
+            return
+        self._buffer += view
+
+        if self._archive is None:
+            try:
+                self._archive = read_toc(self._buffer)
+            except NeedMoreData:
+                if len(self._buffer) > self.MAX_TOC_SIZE:
+                    raise ValueError("TOC too large")
+                return
+            if self._archive.format != FORMAT_CUSTOM:
+                raise ValueError("not a custom-format archive")
+            self._int = 1 + self._archive.int_size
+            del self._buffer[:self._archive.toc_end]
+            self._pos = self._archive.toc_end
+
+        self._scan()
+
+    def _scan(self):
+        buffer = self._buffer
+        at = 0
+        int_len = self._int
+        while True:
+            available = len(buffer) - at
+            if self._state == "block":
+                if available < 1 + int_len:
+                    break
+                kind = buffer[at]
+                dump_id = self._int_at(buffer, at + 1)
+                if kind not in (BLK_DATA, BLK_BLOBS):
+                    raise ValueError(f"unexpected block type {kind}")
+                self._current = (dump_id, self._pos + at)
+                self._in_blobs = kind == BLK_BLOBS
+                self._state = "oid" if self._in_blobs else "chunk"
+                at += 1 + int_len
+            else:
+                if available < int_len:
+                    break
+                value = self._int_at(buffer, at)
+                at += int_len
+                if self._state == "oid":
+                    # Each large object's chunks follow its oid, 0 ends the list
+                    if value == 0:
+                        self._end_block(at)
+                    else:
+                        self._state = "chunk"
+                elif value == 0:
+                    if self._in_blobs:
+                        self._state = "oid"
+                    else:
+                        self._end_block(at)
+                elif value < 0:
+                    raise ValueError("negative chunk length")
+                else:
+                    skipped = min(value, len(buffer) - at)
+                    at += skipped
+                    if skipped < value:
+                        self._skip = value - skipped
+                        break
+        del buffer[:at]
+        self._pos += at
+
+    def _end_block(self, at):
+        dump_id, start = self._current
+        self.blocks[dump_id] = [start, self._pos + at]
+        self._state = "block"
+
+    def _int_at(self, buffer, at):
+        value = int.from_bytes(buffer[at + 1:at + self._int], 'little')
+        return -value if buffer[at] else value
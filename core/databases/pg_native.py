@@ -0,0 +1,1020 @@
+import logging
+import queue
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ, encodings
+
+from ..metrics import stage
+from ..streams import QueueReader
+
+logger = logging.getLogger('afterchive')
+
+# Worker connections when the config doesn't set jobs
+DEFAULT_JOBS = 4
+
+# Tables bigger than this are dumped as several ctid ranges of about this size
+SPLIT_BYTES = 256 * 1024 * 1024
+
+# COPY output is cut into self-contained COPY blocks of about this size,
+# so blocks of different workers can share one output stream
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# TID range scans (PG14+) read only the pages of a range; older servers
+# would scan the whole table once per range
+MIN_SPLIT_VERSION = 140000
+
+MIN_SERVER_VERSION = 100000
+
+USER_SCHEMA = r"n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname !~ '^pg_(toast|temp_)'"
+
+
+def _not_extension_member(catalog, alias):
+    """SQL condition excluding objects created by an extension"""
+    return (
+        f"NOT EXISTS (SELECT 1 FROM pg_depend e WHERE e.classid = '{catalog}'::regclass "
+        f"AND e.objid = {alias}.oid AND e.deptype = 'e')"
+    )
+
+
+HEADER = """--
+-- PostgreSQL database dump of {dbname}, server version {version}
+-- Written by afterchive (native engine), restore with psql
+--
+
+SET statement_timeout = 0;
+SET lock_timeout = 0;
+SET client_encoding = '{encoding}';
+SET standard_conforming_strings = on;
+SELECT pg_catalog.set_config('search_path', '', false);
+SET check_function_bodies = false;
+SET client_min_messages = warning;
+
+"""
+
+UNSUPPORTED_QUERY = f"""
+    SELECT kind, name FROM (
+        SELECT CASE c.relkind WHEN 'm' THEN 'materialized view'
+                              WHEN 'p' THEN 'partitioned table'
+                              ELSE 'foreign table' END,
+               c.oid::regclass::text
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind IN ('m', 'p', 'f') AND {USER_SCHEMA} AND {_not_extension_member('pg_class', 'c')}
+        UNION ALL
+        SELECT 'inherited table', c.oid::regclass::text
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE {USER_SCHEMA} AND {_not_extension_member('pg_class', 'c')}
+        UNION ALL
+        SELECT CASE t.typtype WHEN 'd' THEN 'domain' WHEN 'r' THEN 'range type' ELSE 'composite type' END,
+               format_type(t.oid, NULL)
+        FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace
+        WHERE (t.typtype IN ('d', 'r')
+               OR (t.typtype = 'c' AND (SELECT relkind FROM pg_class WHERE oid = t.typrelid) = 'c'))
+          AND {USER_SCHEMA} AND {_not_extension_member('pg_type', 't')}
+        UNION ALL
+        SELECT 'aggregate', p.oid::regprocedure::text
+        FROM pg_proc p JOIN pg_namespace n ON n.oid = p.pronamespace
+        WHERE {{aggregate}} AND {USER_SCHEMA} AND {_not_extension_member('pg_proc', 'p')}
+        UNION ALL
+        SELECT 'row security policy', pol.polname || ' on ' || pol.polrelid::regclass::text
+        FROM pg_policy pol
+        UNION ALL
+        SELECT 'rule', r.rulename || ' on ' || r.ev_class::regclass::text
+        FROM pg_rewrite r
+        JOIN pg_class c ON c.oid = r.ev_class
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE r.rulename <> '_RETURN' AND {USER_SCHEMA}
+    ) unsupported (kind, name)
+    ORDER BY 1, 2
+"""
+
+SCHEMAS_QUERY = f"""
+    SELECT format('CREATE SCHEMA IF NOT EXISTS %I;', n.nspname)
+    FROM pg_namespace n
+    WHERE {USER_SCHEMA} AND {_not_extension_member('pg_namespace', 'n')}
+    ORDER BY n.nspname
+"""
+
+EXTENSIONS_QUERY = """
+    SELECT format('CREATE EXTENSION IF NOT EXISTS %I WITH SCHEMA %I;', x.extname, n.nspname)
+    FROM pg_extension x JOIN pg_namespace n ON n.oid = x.extnamespace
+    WHERE x.extname <> 'plpgsql'
+    ORDER BY x.extname
+"""
+
+ENUMS_QUERY = f"""
+    SELECT format('CREATE TYPE %s AS ENUM (%s);', format_type(t.oid, NULL),
+                  string_agg(quote_literal(e.enumlabel), ', ' ORDER BY e.enumsortorder))
+    FROM pg_type t
+    JOIN pg_namespace n ON n.oid = t.typnamespace
+    JOIN pg_enum e ON e.enumtypid = t.oid
+    WHERE {USER_SCHEMA} AND {_not_extension_member('pg_type', 't')}
+    GROUP BY t.oid
+    ORDER BY 1
+"""
+
+# Functions taking or returning the row type of a table or view must wait for it
+FUNCTIONS_QUERY = f"""
+    SELECT pg_get_functiondef(p.oid) || ';',
+           EXISTS (SELECT 1 FROM pg_depend d
+                   JOIN pg_class r ON r.reltype = d.refobjid AND r.relkind IN ('r', 'v')
+                   WHERE d.classid = 'pg_proc'::regclass AND d.objid = p.oid
+                     AND d.refclassid = 'pg_type'::regclass)
+    FROM pg_proc p JOIN pg_namespace n ON n.oid = p.pronamespace
+    WHERE {{function}} AND {USER_SCHEMA} AND {_not_extension_member('pg_proc', 'p')}
+    ORDER BY p.oid
+"""
+
+# Identity sequences are recreated by their column, only their value is dumped
+SEQUENCES_QUERY = f"""
+    SELECT c.oid::regclass::text,
+           format('CREATE SEQUENCE %s AS %s INCREMENT BY %s MINVALUE %s MAXVALUE %s START WITH %s CACHE %s%s;',
+                  c.oid::regclass, format_type(s.seqtypid, NULL), s.seqincrement, s.seqmin, s.seqmax,
+                  s.seqstart, s.seqcache, CASE WHEN s.seqcycle THEN ' CYCLE' ELSE '' END),
+           i.refobjid::regclass::text,
+           a.attname
+    FROM pg_sequence s
+    JOIN pg_class c ON c.oid = s.seqrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_depend i ON i.classid = 'pg_class'::regclass AND i.objid = c.oid AND i.deptype = 'i'
+    LEFT JOIN pg_attribute a ON a.attrelid = i.refobjid AND a.attnum = i.refobjsubid
+    WHERE {USER_SCHEMA} AND {_not_extension_member('pg_class', 'c')}
+    ORDER BY 1
+"""
+
+SEQUENCE_OWNERS_QUERY = f"""
+    SELECT format('ALTER SEQUENCE %s OWNED BY %s.%I;', c.oid::regclass, d.refobjid::regclass, a.attname)
+    FROM pg_depend d
+    JOIN pg_class c ON c.oid = d.objid AND c.relkind = 'S'
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+    WHERE d.classid = 'pg_class'::regclass AND d.refclassid = 'pg_class'::regclass
+      AND d.deptype = 'a' AND {USER_SCHEMA}
+    ORDER BY 1
+"""
+
+TABLES_QUERY = f"""
+    SELECT c.oid, c.oid::regclass::text, c.relpersistence = 'u', pg_relation_size(c.oid)
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'r' AND {USER_SCHEMA} AND {_not_extension_member('pg_class', 'c')}
+    ORDER BY n.nspname, c.relname
+"""
+
+COLUMNS_QUERY = """
+    SELECT a.attrelid, quote_ident(a.attname), format_type(a.atttypid, a.atttypmod), a.attnotnull,
+           pg_get_expr(ad.adbin, ad.adrelid), a.attidentity, {generated},
+           CASE WHEN a.attcollation <> t.typcollation AND co.oid IS NOT NULL
+                THEN format('%%I.%%I', cn.nspname, co.collname) END
+    FROM pg_attribute a
+    JOIN pg_type t ON t.oid = a.atttypid
+    LEFT JOIN pg_attrdef ad ON ad.adrelid = a.attrelid AND ad.adnum = a.attnum
+    LEFT JOIN pg_collation co ON co.oid = a.attcollation
+    LEFT JOIN pg_namespace cn ON cn.oid = co.collnamespace
+    WHERE a.attrelid = ANY(%s::oid[]) AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attrelid, a.attnum
+"""
+
+VIEWS_QUERY = f"""
+    SELECT 'CREATE VIEW ' || c.oid::regclass::text || ' AS' || E'\\n' || pg_get_viewdef(c.oid)
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'v' AND {USER_SCHEMA} AND {_not_extension_member('pg_class', 'c')}
+    ORDER BY c.oid
+"""
+
+# Foreign keys go last, once every key they point at exists
+CONSTRAINTS_QUERY = f"""
+    SELECT format('ALTER TABLE ONLY %s ADD CONSTRAINT %I %s;',
+                  con.conrelid::regclass, con.conname, pg_get_constraintdef(con.oid))
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE con.contype IN ('p', 'u', 'c', 'x', 'f') AND c.relkind = 'r'
+      AND {USER_SCHEMA} AND {_not_extension_member('pg_class', 'c')}
+    ORDER BY con.contype = 'f', con.conrelid::regclass::text, con.conname
+"""
+
+INDEXES_QUERY = f"""
+    SELECT pg_get_indexdef(i.indexrelid) || ';'
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'r' AND {USER_SCHEMA} AND {_not_extension_member('pg_class', 'c')}
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint con
+                      WHERE con.conindid = i.indexrelid AND con.conrelid = i.indrelid
+                        AND con.contype IN ('p', 'u', 'x'))
+    ORDER BY 1
+"""
+
+TRIGGERS_QUERY = f"""
+    SELECT pg_get_triggerdef(t.oid) || ';'
+    FROM pg_trigger t
+    JOIN pg_class c ON c.oid = t.tgrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE NOT t.tgisinternal AND c.relkind IN ('r', 'v')
+      AND {USER_SCHEMA} AND {_not_extension_member('pg_class', 'c')}
+    ORDER BY c.oid::regclass::text, t.tgname
+"""
+
+
+def _literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+class _Cancelled(Exception):
+    """The reader went away or another worker failed"""
+
+
+class _Table:
+    def __init__(self, oid, name, unlogged, size):
+        self.oid = oid
+        self.name = name
+        self.unlogged = unlogged
+        self.size = size
+        self.columns = []
+        self.copy_columns = []
+        self.units_left = 0
+        self.rows = 0
+        self.bytes = 0
+        self.started = None
+
+    def ddl(self):
+        kind = "UNLOGGED TABLE" if self.unlogged else "TABLE"
+        return f"CREATE {kind} {self.name} (\n" + ",\n".join(f"    {column}" for column in self.columns) + "\n);"
+
+
+class _CopyBlocks:
+    """
+    Write target for COPY TO STDOUT that cuts the rows into
+    `COPY ... FROM stdin` blocks at row boundaries and hands each one to
+    emit(). Every block restores on its own, so blocks of several tables
+    can be interleaved in one dump.
+    """
+
+    def __init__(self, header, emit):
+        self._header = header
+        self._emit = emit
+        self._buffer = bytearray()
+        self.rows = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= BLOCK_SIZE:
+            # COPY text rows end with a newline, embedded ones are escaped
+            end = self._buffer.rfind(b'\n') + 1
+            if end:
+                self._send(end)
+
+    def finish(self):
+        if self._buffer:
+            self._send(len(self._buffer))
+
+    def _send(self, end):
+        rows = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        self.rows += rows.count(b'\n')
+        self.bytes += len(rows)
+        self._emit(self._header + rows + b'\\.\n\n')
+
+
+class NativeDump:
+    """
+    Plain SQL dump written with psycopg2 instead of pg_dump.
+
+    A coordinator connection exports a snapshot, locks the tables and
+    reads the schema from the catalog. `jobs` worker connections import
+    the snapshot and COPY tables (big ones in ctid ranges) at the same
+    time, so the dump is consistent and parallel. Data blocks land in the
+    stream in the order they finish; constraints, indexes, triggers and
+    sequence values follow the data, as in pg_dump's plain output.
+    """
+
+    def __init__(self, connect, dbname, jobs=None):
+        self._connect = connect
+        self.dbname = dbname
+        self.jobs = max(int(jobs or DEFAULT_JOBS), 1)
+        self._workers = []
+        self._workers_lock = threading.Lock()
+        self._failed = threading.Event()
+
+    @contextmanager
+    def stream(self):
+        """Yield a reader over the dump, a plain SQL script"""
+        coordinator = self._connect()
+        try:
+            snapshot = self._read_catalog(coordinator)
+            reader = QueueReader(depth=self.jobs * 2)
+            producer = threading.Thread(target=self._produce, args=(reader, snapshot), daemon=True)
+            producer.start()
+            try:
+                yield reader
+            finally:
+                reader.close()
+                self._failed.set()
+                self._cancel_workers()
+                producer.join()
+        finally:
+            coordinator.close()
+
+    def _read_catalog(self, conn):
+        """Export the snapshot and build the schema sections inside it"""
+        started = time.monotonic()
+        conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_catalog.set_config('search_path', '', false)")
+            cursor.execute(
+                "SELECT current_setting('server_version_num')::int, current_setting('server_version'), "
+                "pg_encoding_to_char(encoding), current_setting('block_size')::int, pg_export_snapshot() "
+                "FROM pg_database WHERE datname = current_database()"
+            )
+            version_num, version, self.encoding, block_size, snapshot = cursor.fetchone()
+            if version_num < MIN_SERVER_VERSION:
+                raise ValueError(f"The native engine needs PostgreSQL 10 or newer, the server runs {version}")
+
+            def rows(query):
+                cursor.execute(query)
+                return cursor.fetchall()
+
+            aggregate = "p.prokind = 'a'" if version_num >= 110000 else "p.proisagg"
+            unsupported = rows(UNSUPPORTED_QUERY.format(aggregate=aggregate))
+            if unsupported:
+                names = ", ".join(f"{kind} {name}" for kind, name in unsupported[:10])
+                more = f" and {len(unsupported) - 10} more" if len(unsupported) > 10 else ""
+                raise ValueError(f"The native engine can't dump {names}{more}; use engine: pg_dump for this database")
+
+            tables = [_Table(*row) for row in rows(TABLES_QUERY)]
+            if tables:
+                # Keep the tables from being dropped or altered until we're done
+                cursor.execute(sql.SQL("LOCK TABLE {} IN ACCESS SHARE MODE").format(
+                    sql.SQL(", ").join(sql.SQL(table.name) for table in tables)
+                ))
+            self._read_columns(cursor, tables, version_num)
+
+            function = "p.prokind IN ('f', 'p')" if version_num >= 110000 else "NOT p.proisagg"
+            functions = rows(FUNCTIONS_QUERY.format(function=function))
+            sequences = rows(SEQUENCES_QUERY)
+
+            pre_data = [ddl for (ddl,) in rows(SCHEMAS_QUERY) + rows(EXTENSIONS_QUERY) + rows(ENUMS_QUERY)]
+            pre_data += [ddl for ddl, after_tables in functions if not after_tables]
+            pre_data += [ddl for _, ddl, identity_table, _ in sequences if identity_table is None]
+            pre_data += [table.ddl() for table in tables]
+            pre_data += [ddl for (ddl,) in rows(SEQUENCE_OWNERS_QUERY) + rows(VIEWS_QUERY)]
+            pre_data += [ddl for ddl, after_tables in functions if after_tables]
+
+            post_data = self._sequence_values(cursor, sequences)
+            post_data += [ddl for (ddl,) in rows(CONSTRAINTS_QUERY) + rows(INDEXES_QUERY) + rows(TRIGGERS_QUERY)]
+
+        header = HEADER.format(dbname=self.dbname, version=version, encoding=self.encoding)
+        self._pre_data = (header + "\n\n".join(pre_data) + "\n\n").encode(self._python_encoding())
+        self._post_data = ("\n\n".join(post_data) + "\n\n-- Dump complete\n").encode(self._python_encoding())
+        self._tables = tables
+        self._units = self._plan_units(tables, version_num, block_size)
+        logger.info(
+            f"Native dump of {self.dbname}: {len(tables)} tables in {len(self._units)} parts, "
+            f"{min(self.jobs, max(len(self._units), 1))} workers, "
+            f"catalog read in {(time.monotonic() - started) * 1000:.0f} ms"
+        )
+        return snapshot
+
+    def _read_columns(self, cursor, tables, version_num):
+        generated = "a.attgenerated" if version_num >= 120000 else "''"
+        by_oid = {table.oid: table for table in tables}
+        cursor.execute(COLUMNS_QUERY.format(generated=generated), ([table.oid for table in tables],))
+        for relid, name, type_name, not_null, default, identity, generated_kind, collation in cursor.fetchall():
+            column = f"{name} {type_name}"
+            if collation:
+                column += f" COLLATE {collation}"
+            if generated_kind == 's':
+                column += f" GENERATED ALWAYS AS ({default}) STORED"
+            elif generated_kind == 'v':
+                column += f" GENERATED ALWAYS AS ({default}) VIRTUAL"
+            elif identity:
+                column += f" GENERATED {'ALWAYS' if identity == 'a' else 'BY DEFAULT'} AS IDENTITY"
+            elif default is not None:
+                column += f" DEFAULT {default}"
+            if not_null:
+                column += " NOT NULL"
+            table = by_oid[relid]
+            table.columns.append(column)
+            if not generated_kind:
+                # Generated columns are computed again on restore
+                table.copy_columns.append(name)
+
+    def _sequence_values(self, cursor, sequences):
+        statements = []
+        for name, _, identity_table, identity_column in sequences:
+            cursor.execute(sql.SQL("SELECT last_value, is_called FROM {}").format(sql.SQL(name)))
+            last_value, is_called = cursor.fetchone()
+            if identity_table is not None:
+                # The restored identity sequence may get another name
+                target = f"pg_catalog.pg_get_serial_sequence({_literal(identity_table)}, {_literal(identity_column)})"
+            else:
+                target = _literal(name)
+            statements.append(f"SELECT pg_catalog.setval({target}, {last_value}, {'true' if is_called else 'false'});")
+        return statements
+
+    def _plan_units(self, tables, version_num, block_size):
+        """Split the tables into COPY statements, biggest first"""
+        units = []
+        pages_per_unit = max(SPLIT_BYTES // block_size, 1)
+        for table in tables:
+            if not table.copy_columns:
+                continue
+            columns = sql.SQL(", ").join(sql.SQL(column) for column in table.copy_columns)
+            relation = sql.SQL(table.name)
+            pages = table.size // block_size
+            if version_num < MIN_SPLIT_VERSION or pages <= pages_per_unit:
+                statement = sql.SQL("COPY {} ({}) TO STDOUT").format(relation, columns)
+                units.append((table.size, table, statement))
+                continue
+            for start in range(0, pages, pages_per_unit):
+                # The last range is open so pages added since the size was read count too
+                condition = f"ctid >= '({start},0)'::tid"
+                if start + pages_per_unit < pages:
+                    condition += f" AND ctid < '({start + pages_per_unit},0)'::tid"
+                statement = sql.SQL("COPY (SELECT {} FROM ONLY {} WHERE {}) TO STDOUT").format(
+                    columns, relation, sql.SQL(condition)
+                )
+                units.append((min(pages_per_unit, pages - start) * block_size, table, statement))
+
+        for _, table, _ in units:
+            table.units_left += 1
+        units.sort(key=lambda unit: unit[0], reverse=True)
+        return units
+
+    def _python_encoding(self):
+        return encodings.get(self.encoding, 'utf-8')
+
+    def _produce(self, reader, snapshot):
+        try:
+            if not reader.put(self._pre_data):
+                return
+            pending = queue.Queue()
+            for unit in self._units:
+                pending.put(unit)
+            workers = min(self.jobs, len(self._units))
+            if workers:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="native-dump") as pool:
+                    futures = [pool.submit(self._work, reader, snapshot, pending) for _ in range(workers)]
+                    errors = [future.exception() for future in futures]
+                failures = [error for error in errors if error and not isinstance(error, _Cancelled)]
+                if failures:
+                    raise failures[0]
+                if any(errors):
+                    return
+            reader.put(self._post_data)
+            reader.put(b'')
+        except Exception as e:
+            reader.put(e)
+
+    def _work(self, reader, snapshot, pending):
+        conn = self._connect()
+        with self._workers_lock:
+            self._workers.append(conn)
+        try:
+            conn.set_client_encoding(self.encoding)
+            conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+                cursor.execute("SET statement_timeout = 0")
+
+                def emit(block):
+                    if self._failed.is_set() or not reader.put(block):
+                        raise _Cancelled()
+
+                while not self._failed.is_set():
+                    try:
+                        _, table, statement = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    self._copy(cursor, table, statement, emit)
+            if self._failed.is_set():
+                raise _Cancelled()
+        except Exception:
+            # Stop the other workers too, the dump is incomplete anyway
+            self._failed.set()
+            raise
+        finally:
+            conn.close()
+
+    def _copy(self, cursor, table, statement, emit):
+        if table.started is None:
+            table.started = time.monotonic()
+        columns = ", ".join(table.copy_columns)
+        header = f"COPY {table.name} ({columns}) FROM stdin;\n".encode(self._python_encoding())
+        blocks = _CopyBlocks(header, emit)
+        cursor.copy_expert(statement, blocks, size=BLOCK_SIZE)
+        blocks.finish()
+
+        with self._workers_lock:
+            table.rows += blocks.rows
+            table.bytes += blocks.bytes
+            table.units_left -= 1
+            done = table.units_left == 0
+        if done:
+            logger.info(
+                f"Dumped {table.name}: {table.rows} rows, {table.bytes / (1024 * 1024):.1f} MB "
+                f"in {time.monotonic() - table.started:.1f}s"
+            )
+
+    def _cancel_workers(self):
+        """Interrupt COPYs still running when the consumer gives up"""
+        with self._workers_lock:
+            for conn in self._workers:
+                if not conn.closed:
+                    try:
+                        conn.cancel()
+                    except Exception:
+                        pass
+
+
+# Bytes read from a dump at a time while splitting it
+READ_SIZE = 1024 * 1024
+
+# COPY data waiting for a restore worker stays in memory up to this size,
+# bigger blocks spill to a temp file
+SPOOL_MEMORY = 64 * 1024 * 1024
+
+# Start of the next token that changes how `;` is read
+_TOKEN = re.compile(rb"""[;'"]|--|/\*|\$(?:[A-Za-z_\x80-\xff][A-Za-z0-9_\x80-\xff]*)?\$""")
+_LEADING_COMMENTS = re.compile(r"^(?:\s+|--[^\n]*(?:\n|$))*")
+
+_IDENT = r'(?:"(?:[^"]|"")*"|[^\s.("]+)'
+_QUALIFIED = rf'{_IDENT}(?:\.{_IDENT})?'
+_COPY_RE = re.compile(rf'COPY\s+({_QUALIFIED})[\s(].*\sFROM\s+stdin\s*;$', re.I | re.S)
+_SESSION_RE = re.compile(r'(?:SET|RESET)\s|SELECT\s+pg_catalog\.set_config\(', re.I)
+_ENCODING_RE = re.compile(r"SET\s+client_encoding\s*=\s*'([^']+)'", re.I)
+_INDEX_RE = re.compile(
+    rf'CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?{_IDENT}\s+ON\s+(?:ONLY\s+)?({_QUALIFIED})', re.I
+)
+_CONSTRAINT_RE = re.compile(
+    rf'ALTER\s+TABLE\s+(?:ONLY\s+)?({_QUALIFIED})\s+ADD\s+CONSTRAINT\s+{_IDENT}\s+'
+    rf'(PRIMARY\s+KEY|UNIQUE|CHECK|EXCLUDE|FOREIGN\s+KEY)', re.I
+)
+_REFERENCES_RE = re.compile(rf'\sREFERENCES\s+({_QUALIFIED})', re.I)
+
+
+class _ScriptReader:
+    """
+    Splits a plain SQL dump the way psql reads it: statements end at a
+    `;` outside quotes, comments and dollar quotes, `COPY ... FROM stdin`
+    is followed by data up to a `\\.` line, and backslash meta-commands
+    are skipped.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._buffer = bytearray()
+        self._eof = False
+        # Position in the dump of self._buffer[0]
+        self.offset = 0
+
+    def _more(self):
+        if self._eof:
+            return False
+        data = self._stream.read(READ_SIZE)
+        if not data:
+            self._eof = True
+            return False
+        self._buffer += data
+        return True
+
+    def _consume(self, count):
+        del self._buffer[:count]
+        self.offset += count
+
+    def _find(self, needle, start):
+        while True:
+            index = self._buffer.find(needle, start)
+            if index >= 0:
+                return index
+            start = max(start, len(self._buffer) - len(needle) + 1)
+            if not self._more():
+                return -1
+
+    def next_statement(self):
+        """Next statement as bytes, None at the end of the dump"""
+        while True:
+            self._skip_blank()
+            if not self._buffer:
+                return None
+            if self._buffer[:1] != b'\\':
+                return self._statement()
+            # psql meta-command (\connect, \restrict, ...), one line
+            end = self._find(b'\n', 0)
+            line = bytes(self._buffer[:end if end >= 0 else len(self._buffer)])
+            logger.debug(f"Skipping psql meta-command {line.decode(errors='replace').strip()}")
+            self._consume(end + 1 if end >= 0 else len(self._buffer))
+
+    def _skip_blank(self):
+        """Drop whitespace and -- comment lines before the next statement"""
+        while True:
+            start = 0
+            while start < len(self._buffer) and self._buffer[start] in b' \t\r\n':
+                start += 1
+            if start == len(self._buffer):
+                self._consume(start)
+                if self._more():
+                    continue
+                return
+            while len(self._buffer) < start + 2 and self._more():
+                pass
+            if self._buffer[start:start + 2] != b'--':
+                self._consume(start)
+                return
+            end = self._find(b'\n', start)
+            self._consume(end + 1 if end >= 0 else len(self._buffer))
+
+    def _statement(self):
+        position = 0
+        while True:
+            match = _TOKEN.search(self._buffer, position)
+            if match is None:
+                if self._more():
+                    continue
+                end = len(self._buffer)
+                break
+            token = match.group()
+            if token == b';':
+                end = match.end()
+                break
+            if token == b'--':
+                closing = b'\n'
+            elif token == b'/*':
+                closing = b'*/'
+            else:
+                # Quotes close with themselves, dollar quotes with their tag
+                closing = token
+            found = self._find(closing, match.end())
+            if found < 0:
+                end = len(self._buffer)
+                break
+            position = found + len(closing)
+
+        statement = bytes(self._buffer[:end])
+        self._consume(end)
+        return statement
+
+    def copy_data(self, write=None):
+        """
+        Read the data of the COPY statement just returned, passing it to
+        write() if given. Returns (offset, length) of the data in the dump.
+        """
+        # Data starts on the line after the COPY statement
+        end = self._find(b'\n', 0)
+        self._consume(end + 1 if end >= 0 else len(self._buffer))
+        start = self.offset
+        length = 0
+
+        while len(self._buffer) < 3 and self._more():
+            pass
+        if self._buffer[:2] == b'\\.' and self._buffer[2:3] in (b'\n', b'\r', b''):
+            data_end = 0
+        else:
+            searched = 0
+            while True:
+                data_end = self._buffer.find(b'\n\\.', searched)
+                if data_end >= 0:
+                    while len(self._buffer) < data_end + 4 and self._more():
+                        pass
+                    if self._buffer[data_end + 3:data_end + 4] in (b'\n', b'\r', b''):
+                        data_end += 1
+                        break
+                    searched = data_end + 1
+                    continue
+                # Pass on all but a possible start of the terminator
+                flush = len(self._buffer) - 2
+                if flush > 0:
+                    if write:
+                        write(bytes(self._buffer[:flush]))
+                    length += flush
+                    self._consume(flush)
+                searched = 0
+                if not self._more():
+                    raise ValueError("Backup ends inside COPY data, the dump is truncated")
+
+        if write and data_end:
+            write(bytes(self._buffer[:data_end]))
+        length += data_end
+        self._consume(data_end)
+        # Drop the \. line
+        end = self._find(b'\n', 0)
+        self._consume(end + 1 if end >= 0 else len(self._buffer))
+        return start, length
+
+
+class _FileRange:
+    """Reader over `length` bytes of a file from `offset`"""
+
+    def __init__(self, path, offset, length):
+        self._file = open(path, 'rb')
+        self._file.seek(offset)
+        self._left = length
+
+    def read(self, size=-1):
+        count = self._left if size is None or size < 0 else min(size, self._left)
+        data = self._file.read(count)
+        self._left -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class _Task:
+    """A post-data statement and the tables it locks"""
+
+    def __init__(self, statement, session, tables, exclusive):
+        self.statement = statement
+        self.session = session
+        self.tables = tables
+        self.exclusive = exclusive
+
+
+def _command(statement):
+    return _LEADING_COMMENTS.sub('', statement, count=1)
+
+
+def _summary(statement):
+    return " ".join(_command(statement).split())[:120]
+
+
+class NativeRestore:
+    """
+    Restore a plain SQL dump over psycopg2 instead of one psql session.
+
+    The schema runs first on one connection. COPY blocks are then loaded
+    by `jobs` connections at once; from a local file each worker reads its
+    own byte range, from a stream blocks are spooled until a worker is
+    free. Statements after the data (pg_dump's post-data) are held back
+    until everything is loaded: indexes and non-FK constraints are built
+    in parallel, never two on a table when one of them needs an exclusive
+    lock, then foreign keys, then the rest in dump order. Statement errors
+    are logged and skipped like psql does; a failed COPY fails the restore.
+    """
+
+    def __init__(self, connect, dbname, jobs=None, settings=None):
+        self._connect = connect
+        self.dbname = dbname
+        self.jobs = max(int(jobs or DEFAULT_JOBS), 1)
+        self.settings = dict(settings or {})
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._failed = threading.Event()
+        self._encoding = None
+        self._session = ()
+        # id(connection) -> the session statements it has run
+        self._applied = {}
+        self._table_bytes = {}
+        self.errors = 0
+
+    def restore_file(self, path):
+        with open(path, 'rb') as f:
+            self._restore(f, path)
+
+    def restore_stream(self, stream):
+        self._restore(stream, None)
+
+    def _restore(self, stream, path):
+        coordinator = self._open()
+        pool = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="native-restore")
+        try:
+            started = time.monotonic()
+            with stage("load"):
+                post_data = self._load(_ScriptReader(stream), path, coordinator, pool)
+            loaded = sum(self._table_bytes.values())
+            logger.info(
+                f"Loaded {len(self._table_bytes)} tables ({loaded / (1024 * 1024):.1f} MB) "
+                f"over {self.jobs} connections in {time.monotonic() - started:.1f}s"
+            )
+
+            tasks, foreign_keys, rest = self._plan_post_data(post_data)
+            with stage("indexes"):
+                self._run_tasks("indexes and constraints", tasks, pool)
+            with stage("foreign_keys"):
+                self._run_tasks("foreign keys", foreign_keys, pool)
+            with stage("post_data"):
+                for statement, session in rest:
+                    self._execute(coordinator, statement, session)
+        finally:
+            self._failed.set()
+            pool.shutdown(wait=True)
+            for conn in [coordinator] + self._connections:
+                conn.close()
+
+        if self.errors:
+            logger.warning(f"Restore of {self.dbname} finished with {self.errors} failed statements")
+
+    def _open(self):
+        """New autocommit connection set up like the dump's session"""
+        conn = self._connect()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for name, value in self.settings.items():
+                cursor.execute("SELECT pg_catalog.set_config(%s, %s, false)", (str(name), str(value)))
+        self._applied[id(conn)] = ()
+        return conn
+
+    def _worker_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _apply_session(self, conn, session):
+        applied = self._applied[id(conn)]
+        if applied == session:
+            return
+        # Sessions only grow, so usually just the new statements are missing
+        missing = session[len(applied):] if session[:len(applied)] == applied else session
+        encoding = None
+        with conn.cursor() as cursor:
+            for statement in missing:
+                match = _ENCODING_RE.match(statement)
+                if match:
+                    encoding = match.group(1)
+                else:
+                    cursor.execute(statement)
+        if encoding:
+            # Through psycopg2, so it decodes with the same encoding
+            conn.set_client_encoding(encoding)
+        self._applied[id(conn)] = session
+
+    def _decode(self, statement):
+        return statement.decode(encodings.get((self._encoding or 'UTF8').upper(), 'utf-8'))
+
+    def _execute(self, conn, statement, session):
+        """Run one statement, logging and counting errors like psql"""
+        self._apply_session(conn, session)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(statement)
+        except psycopg2.Error as e:
+            with self._lock:
+                self.errors += 1
+            error = (e.pgerror or str(e)).strip()
+            logger.warning(f"Statement failed: {_summary(statement)}: {error}")
+
+    def _load(self, script, path, coordinator, pool):
+        """Run the schema and load the data, returning the statements after it"""
+        slots = threading.Semaphore(self.jobs + 1)
+        loads = []
+        held = []
+        copied = False
+
+        def wait_for_loads():
+            for future in loads:
+                future.result()
+            loads.clear()
+
+        while True:
+            raw = script.next_statement()
+            if raw is None:
+                break
+            if self._failed.is_set():
+                wait_for_loads()
+            statement = self._decode(raw)
+            command = _command(statement)
+
+            if _SESSION_RE.match(command):
+                match = _ENCODING_RE.match(command)
+                if match:
+                    self._encoding = match.group(1)
+                self._session += (command,)
+                self._apply_session(coordinator, self._session)
+                continue
+
+            copy = _COPY_RE.match(command)
+            if not copy:
+                if copied:
+                    held.append((statement, self._session))
+                else:
+                    self._execute(coordinator, statement, self._session)
+                continue
+
+            if held:
+                # Statements between COPYs (large objects, ...) run once the
+                # data before them is in
+                wait_for_loads()
+                for held_statement, session in held:
+                    self._execute(coordinator, held_statement, session)
+                held.clear()
+            copied = True
+
+            while not slots.acquire(timeout=0.5):
+                if self._failed.is_set():
+                    wait_for_loads()
+            try:
+                if path:
+                    offset, length = script.copy_data()
+                    source = _FileRange(path, offset, length)
+                else:
+                    source = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+                    _, length = script.copy_data(source.write)
+                    source.seek(0)
+            except BaseException:
+                slots.release()
+                raise
+            table = copy.group(1)
+            loads.append(pool.submit(self._copy, command.rstrip().rstrip(';'), table, source, length, self._session, slots))
+
+        wait_for_loads()
+        return held
+
+    def _copy(self, statement, table, source, length, session, slots):
+        try:
+            conn = self._worker_connection()
+            self._apply_session(conn, session)
+            with conn.cursor() as cursor:
+                cursor.copy_expert(statement, source, size=READ_SIZE)
+            with self._lock:
+                self._table_bytes[table] = self._table_bytes.get(table, 0) + length
+        except Exception as e:
+            self._failed.set()
+            raise ValueError(f"Loading {table} failed: {getattr(e, 'pgerror', None) or e}".strip())
+        finally:
+            source.close()
+            slots.release()
+
+    def _plan_post_data(self, statements):
+        """Sort post-data into parallel tasks, foreign keys and the rest"""
+        tasks, foreign_keys, rest = [], [], []
+        for statement, session in statements:
+            command = _command(statement)
+            index = _INDEX_RE.match(command)
+            constraint = _CONSTRAINT_RE.match(command)
+            if index:
+                # Plain CREATE INDEX only blocks writes, several can share a table
+                tasks.append(_Task(statement, session, {index.group(1)}, exclusive=False))
+            elif constraint and constraint.group(2).upper().startswith("FOREIGN"):
+                tables = {constraint.group(1)}
+                references = _REFERENCES_RE.search(command)
+                if references:
+                    tables.add(references.group(1))
+                # Both tables are locked, two FKs on a table could deadlock
+                foreign_keys.append(_Task(statement, session, tables, exclusive=True))
+            elif constraint:
+                tasks.append(_Task(statement, session, {constraint.group(1)}, exclusive=True))
+            else:
+                rest.append((statement, session))
+
+        # Biggest tables first, their indexes take longest
+        tasks.sort(key=lambda task: -max(self._table_bytes.get(table, 0) for table in task.tables))
+        return tasks, foreign_keys, rest
+
+    def _run_tasks(self, description, tasks, pool):
+        if not tasks:
+            return
+        started = time.monotonic()
+        pending = list(tasks)
+        shared = {}
+        exclusive = set()
+        changed = threading.Condition()
+
+        def startable(task):
+            if any(table in exclusive for table in task.tables):
+                return False
+            return not task.exclusive or not any(shared.get(table) for table in task.tables)
+
+        def work():
+            conn = self._worker_connection()
+            while True:
+                with changed:
+                    while True:
+                        if not pending:
+                            return
+                        task = next((task for task in pending if startable(task)), None)
+                        if task is not None:
+                            break
+                        changed.wait()
+                    pending.remove(task)
+                    for table in task.tables:
+                        if task.exclusive:
+                            exclusive.add(table)
+                        else:
+                            shared[table] = shared.get(table, 0) + 1
+                try:
+                    self._execute(conn, task.statement, task.session)
+                finally:
+                    with changed:
+                        for table in task.tables:
+                            if task.exclusive:
+                                exclusive.discard(table)
+                            else:
+                                shared[table] -= 1
+                        changed.notify_all()
+
+        for future in [pool.submit(work) for _ in range(min(self.jobs, len(tasks)))]:
+            future.result()
+        logger.info(f"Built {len(tasks)} {description} in {time.monotonic() - started:.1f}s")
@@ -0,0 +1,80 @@
+"""
+Physical backups: a pg_basebackup of the whole cluster as one tar
+stream, and restoring it into a data directory set up to replay the
+WAL archived by `afterchive wal-push` up to a point in time.
+"""
+import logging
+import os
+import tarfile
+
+logger = logging.getLogger('afterchive')
+
+BASE_BACKUP_SUFFIX = ".base.tar"
+
+# Lines afterchive adds to postgresql.auto.conf start after this one
+RECOVERY_MARKER = "# Recovery settings added by afterchive restore"
+
+
+def is_base_backup(backup_name):
+    return backup_name.rstrip('/').endswith(BASE_BACKUP_SUFFIX)
+
+
+def base_backup_command(host, port, user, checkpoint=None):
+    """
+    pg_basebackup writing one tar to stdout.
+
+    -X fetch puts the WAL needed to make the backup consistent into the
+    tar, so it restores on its own even without an archive.
+    """
+    cmd = ["pg_basebackup", "-h", host, "-p", str(port), "-U", user, "-D", "-", "-Ft", "-X", "fetch", "--no-password"]
+    if checkpoint:
+        cmd += ["-c", checkpoint]
+    return cmd
+
+
+def _prepare_data_directory(data_directory):
+    if not data_directory:
+        raise ValueError("Restoring a base backup needs a data directory (--data-dir or options.data_directory)")
+    if os.path.isdir(data_directory) and os.listdir(data_directory):
+        raise ValueError(
+            f"Data directory {data_directory} is not empty; stop PostgreSQL and move the old "
+            f"cluster away before restoring a base backup into it"
+        )
+    os.makedirs(data_directory, mode=0o700, exist_ok=True)
+    # PostgreSQL refuses to start on a data directory others can read
+    os.chmod(data_directory, 0o700)
+
+
+def extract_base_backup(stream, data_directory):
+    """Unpack a base backup tar from a stream into an empty data directory"""
+    _prepare_data_directory(data_directory)
+    # Streaming mode: the tar is read once, front to back
+    with tarfile.open(fileobj=stream, mode='r|') as archive:
+        if hasattr(tarfile, 'tar_filter'):
+            # Keeps modes, refuses members that would land outside the directory
+            archive.extractall(data_directory, filter='tar')
+        else:
+            archive.extractall(data_directory)
+
+
+def configure_recovery(data_directory, restore_command=None, target_time=None):
+    """
+    Make the restored cluster replay archived WAL when it starts:
+    recovery.signal plus restore_command (and recovery_target_time) in
+    postgresql.auto.conf.
+    """
+    if not restore_command:
+        if target_time:
+            raise ValueError("--target-time needs the archived WAL, set a restore_command or storage to fetch it from")
+        return
+
+    def quote(value):
+        return "'" + str(value).replace("'", "''") + "'"
+
+    lines = [RECOVERY_MARKER, f"restore_command = {quote(restore_command)}"]
+    if target_time:
+        lines += [f"recovery_target_time = {quote(target_time)}", "recovery_target_action = 'promote'"]
+
+    with open(os.path.join(data_directory, "postgresql.auto.conf"), 'a') as f:
+        f.write("\n" + "\n".join(lines) + "\n")
+    open(os.path.join(data_directory, "recovery.signal"), 'w').close()
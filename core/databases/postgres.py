@@ -1,19 +1,92 @@
 from .base import BackupStrategy
+from ..streams import ProcessOutputStream, STREAM_CHUNK_SIZE
+from ..metrics import stage
+from .pg_physical import BASE_BACKUP_SUFFIX, base_backup_command, configure_recovery, extract_base_backup, is_base_backup
 import psycopg2
 from psycopg2 import sql
 import subprocess
 import os
 import tempfile
+import shutil
 import time
 import getpass
 import logging
 import re
+from contextlib import contextmanager
+from functools import lru_cache
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger('afterchive')
 
+# pg_dump output formats and the suffix their backups are stored under
+DUMP_FORMATS = {
+    "plain": ".sql",
+    "custom": ".dump",
+    "directory": ".dir",
+}
+
+# Dump engines: the pg_dump binary, COPY over psycopg2 (pg_native.py), or
+# a physical copy of the whole cluster with pg_basebackup (pg_physical.py)
+ENGINES = ("pg_dump", "native", "pg_basebackup")
+
+# Everything the preflight needs, from one connection to the maintenance DB.
+# pg_database_size needs CONNECT on the database, so it's guarded.
+PREFLIGHT_QUERY = """
+    SELECT current_setting('server_version_num')::int,
+           d.datname IS NOT NULL,
+           d.datname IS NOT NULL AND has_database_privilege(d.datname, 'CONNECT'),
+           d.datname IS NOT NULL AND has_database_privilege(d.datname, 'CREATE'),
+           CASE WHEN has_database_privilege(d.datname, 'CONNECT') THEN pg_database_size(d.datname) END,
+           r.rolsuper,
+           r.rolcreatedb
+    FROM pg_roles r
+    LEFT JOIN pg_database d ON d.datname = %s
+    WHERE r.rolname = current_user
+"""
+
+
+# Server load for the backup throttle, leaving out the backup's own sessions
+LOAD_QUERY = """
+    SELECT count(*) FILTER (WHERE state = 'active'),
+           count(*) FILTER (WHERE state = 'active' AND wait_event_type = 'IO'),
+           (SELECT COALESCE(EXTRACT(EPOCH FROM max(replay_lag)), 0) FROM pg_stat_replication)
+    FROM pg_stat_activity
+    WHERE backend_type = 'client backend'
+      AND pid <> pg_backend_pid()
+      AND application_name NOT IN ('pg_dump', 'pg_basebackup', 'afterchive')
+"""
+
+
+@lru_cache(maxsize=None)
+def _probe_tool_version(path, mtime):
+    """Major version printed by `<tool> --version`; mtime keys out upgrades"""
+    try:
+        result = subprocess.run([path, '--version'], capture_output=True, text=True)
+    except OSError:
+        return None
+    match = re.search(r'\(PostgreSQL\) (\d+)', result.stdout)
+    return int(match.group(1)) if match else None
+
+
+def tool_version(tool):
+    """
+    Major version of a PostgreSQL client tool, or None if unknown.
+
+    Probed once per binary path (and again if the binary changes), so a
+    daemon or a batch of jobs doesn't spawn `pg_dump --version` per run.
+    """
+    path = shutil.which(tool)
+    if not path:
+        return None
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    return _probe_tool_version(path, mtime)
+
+
 class PostgresBackup(BackupStrategy):
-    def backup(self, config):
+    def _prepare_backup(self, config, tool="pg_dump"):
+        """Validate config and check the server before any data moves"""
         host = config.get("host")
         port = config.get("port")
         dbname = config.get("dbname")
@@ -27,24 +100,41 @@ class PostgresBackup(BackupStrategy):
         # Prompt for password if not provided
         if not password:
             password = getpass.getpass(f"Enter password for PostgreSQL user '{user}': ")
-        
-        # Check version compatibility
-        self._check_version_compatibility(host, port, user, password, dbname)
 
-        # TEST CONNECTION FIRST (before creating any files)
-        logger.debug("Testing database connection...")
-        if not self.database_exists(dbname, user, password, host, port):
-            raise ValueError(f"Cannot connect to database '{dbname}' - check credentials and database name")
-        
-        logger.debug("Connection successful")
+        # Check the server BEFORE creating any files
+        with stage("preflight"):
+            self.preflight(host, port, dbname, user, password, tool=tool)
 
-        # NOW create temp file and backup
         env = os.environ.copy()
         env["PGPASSWORD"] = password
-        
+
+        return host, port, dbname, user, env
+
+    def backup(self, config):
+        dump_format = self._dump_format(config)
+        engine = self._engine(config, dump_format)
+        if engine == "native":
+            return self._native_backup(config)
+        if engine == "pg_basebackup":
+            return self._base_backup(config)
+        if config.get("pace") and dump_format != "directory":
+            # Paced through our hands instead of pg_dump writing the file
+            with self.backup_stream(config) as (backup_name, stream):
+                return self._stream_to_file(backup_name, config["pace"](stream), DUMP_FORMATS[dump_format])
+        if config.get("pace"):
+            logger.warning("Directory-format dumps can't be paced, pg_dump's workers write the files themselves")
+        jobs = int(config.get("jobs") or 1)
+        host, port, dbname, user, env = self._prepare_backup(config)
+
+        # NOW create temp file and backup
         timestamp = time.strftime("%Y%m%d-%H%M%S")
-        fd, the_temp_file = tempfile.mkstemp(suffix=".sql", prefix=f"{dbname}_{timestamp}_")
-        os.close(fd)
+        suffix = DUMP_FORMATS[dump_format]
+        if dump_format == "directory":
+            # pg_dump accepts an existing directory as long as it is empty
+            the_temp_file = tempfile.mkdtemp(suffix=suffix, prefix=f"{dbname}_{timestamp}_")
+        else:
+            fd, the_temp_file = tempfile.mkstemp(suffix=suffix, prefix=f"{dbname}_{timestamp}_")
+            os.close(fd)
 
         logger.debug(f"Backup file: {the_temp_file}")
 
@@ -55,7 +145,7 @@ class PostgresBackup(BackupStrategy):
             "-d", dbname,
             "-U", user,
             "-f", the_temp_file
-        ]
+        ] + self._format_args(dump_format, jobs)
 
         try:
             process = subprocess.Popen(
@@ -78,20 +168,178 @@ class PostgresBackup(BackupStrategy):
             
         except Exception as e:
             # Clean up temp file on any error
-            if os.path.exists(the_temp_file):
-                os.remove(the_temp_file)
+            self._cleanup_temp_file(the_temp_file)
             raise
     
-    def restore(self, config):
-        backup_file = config.get("backup_file", None)
+    @contextmanager
+    def backup_stream(self, config):
+        """
+        Run pg_dump with its output on a pipe instead of a temp file.
+
+        Yields (backup_name, stream) where stream is a file-like reader
+        over pg_dump's stdout. Disk use stays bounded and the consumer can
+        upload while the dump is still running.
+        """
+        dump_format = self._dump_format(config)
+        engine = self._engine(config, dump_format)
+        if engine == "native":
+            with self._native_stream(config) as (backup_name, stream):
+                logger.info(f"Streaming backup: {backup_name}")
+                yield backup_name, stream
+            return
+        if engine == "pg_basebackup":
+            with self._base_backup_stream(config) as (backup_name, stream):
+                logger.info(f"Streaming base backup: {backup_name}")
+                yield backup_name, stream
+            return
+        if dump_format == "directory":
+            raise ValueError("Directory-format dumps write many files and can't be streamed")
+
+        host, port, dbname, user, env = self._prepare_backup(config)
+
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        backup_name = f"{dbname}_{timestamp}{DUMP_FORMATS[dump_format]}"
+
+        cmd = [
+            "pg_dump",
+            "-h", host,
+            "-p", str(port),
+            "-d", dbname,
+            "-U", user
+        ] + self._format_args(dump_format, 1)
+
+        # stderr goes to a temp file so a chatty pg_dump can't fill the
+        # pipe and deadlock while we are busy reading stdout
+        stderr_file = tempfile.TemporaryFile()
+        process = subprocess.Popen(
+            cmd,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            bufsize=STREAM_CHUNK_SIZE
+        )
+        stream = ProcessOutputStream(process, "pg_dump", stderr_file)
+
+        logger.info(f"Streaming backup: {backup_name}")
+        try:
+            yield backup_name, stream
+        finally:
+            stream.close()
+
+    @contextmanager
+    def _native_stream(self, config):
+        """Yield (backup_name, stream) of a plain dump by the native engine"""
+        from .pg_native import NativeDump
+
+        # No client binary, so no client/server version to match
+        host, port, dbname, user, env = self._prepare_backup(config, tool=None)
+        password = env["PGPASSWORD"]
+
+        def connect():
+            conn = self.get_db_connection(dbname, user, password, host, port)
+            if conn is None:
+                raise ValueError(f"Could not connect to database '{dbname}'")
+            return conn
+
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        backup_name = f"{dbname}_{timestamp}{DUMP_FORMATS['plain']}"
+
+        with NativeDump(connect, dbname, config.get("jobs")).stream() as stream:
+            yield backup_name, stream
+
+    def _native_backup(self, config):
+        with self._native_stream(config) as (backup_name, stream):
+            if config.get("pace"):
+                stream = config["pace"](stream)
+            return self._stream_to_file(backup_name, stream, DUMP_FORMATS["plain"])
+
+    @contextmanager
+    def load_monitor(self, config):
+        """
+        Yield sample(), the server's current load over one psycopg2
+        connection: active sessions, those waiting on I/O, and the
+        replication lag of the slowest standby in seconds.
+        """
+        conn = None
+
+        def sample():
+            nonlocal conn
+            if conn is None or conn.closed:
+                conn = self.get_db_connection(
+                    config.get("dbname"), config.get("user"), config.get("password"), config.get("host"), config.get("port")
+                )
+                if conn is None:
+                    raise ValueError(f"Could not connect to database '{config.get('dbname')}'")
+                conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(LOAD_QUERY)
+                active, io_waits, lag = cursor.fetchone()
+            return {"active_sessions": active, "io_waits": io_waits, "replication_lag": float(lag or 0)}
+
+        try:
+            yield sample
+        finally:
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def _base_backup_stream(self, config):
+        """Yield (backup_name, stream) of a pg_basebackup tar of the cluster"""
+        host, port, dbname, user, env = self._prepare_backup(config, tool="pg_basebackup")
+
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        backup_name = f"{dbname}_{timestamp}{BASE_BACKUP_SUFFIX}"
+
+        stderr_file = tempfile.TemporaryFile()
+        process = subprocess.Popen(
+            base_backup_command(host, port, user, config.get("checkpoint")),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            bufsize=STREAM_CHUNK_SIZE
+        )
+        stream = ProcessOutputStream(process, "pg_basebackup", stderr_file)
+        try:
+            yield backup_name, stream
+        finally:
+            stream.close()
+
+    def _base_backup(self, config):
+        # Also through stdout, so the backup is the same single tar as when streaming
+        with self._base_backup_stream(config) as (backup_name, stream):
+            if config.get("pace"):
+                stream = config["pace"](stream)
+            return self._stream_to_file(backup_name, stream, BASE_BACKUP_SUFFIX)
+
+    def _stream_to_file(self, backup_name, stream, suffix):
+        fd, the_temp_file = tempfile.mkstemp(suffix=suffix, prefix=f"{backup_name[:-len(suffix)]}_")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(stream, f, STREAM_CHUNK_SIZE)
+        except Exception:
+            self._cleanup_temp_file(the_temp_file)
+            raise
+
+        logger.info(f"Backup created: {os.path.basename(the_temp_file)}")
+        return the_temp_file
+
+    def _restore_base_backup(self, config, stream, backup_name):
+        """Unpack a base backup into the configured data directory, ready for WAL replay"""
+        data_directory = config.get("data_directory")
+        extract_base_backup(stream, data_directory)
+        configure_recovery(data_directory, config.get("restore_command"), config.get("recovery_target_time"))
+        if config.get("restore_command"):
+            logger.info(f"Start PostgreSQL on {data_directory} to replay the archived WAL")
+        logger.info(f"Base backup {backup_name} restored into {data_directory}")
+
+    def _prepare_restore(self, config):
+        """Validate config and make sure the target database exists"""
         host = config.get("host", None)
         port = config.get("port", None)
         dbname = config.get("dbname", None)
         user = config.get("user", None)
         password = config.get("password", None)
-        if not backup_file or not os.path.exists(backup_file):
-            raise ValueError("Backup file does not exist")
-        
+
         # Prompt for password if not provided
         if not password:
             password = getpass.getpass(f"Enter password for PostgreSQL user '{user}': ")
@@ -99,12 +347,110 @@ class PostgresBackup(BackupStrategy):
         env = os.environ.copy()
         if password:
             env["PGPASSWORD"] = password
-        
-        if host and port and dbname and user:
-            if not self.database_exists(dbname, user, password, host, port):
-                logger.info("The given database does not exist. Creating it...")
-                self.create_database(dbname, user, password, host, port)
-            
+
+        if not (host and port and dbname and user):
+            raise ValueError("Missing required config parameters")
+
+        with stage("preflight"):
+            self.preflight(host, port, dbname, user, password, create=True)
+
+        settings = self._load_settings(config)
+        if settings:
+            # psql and pg_restore pass these to the server for their session
+            options = [env["PGOPTIONS"]] if env.get("PGOPTIONS") else []
+            for name, value in settings.items():
+                value = value.replace('\\', '\\\\').replace(' ', '\\ ')
+                options.append(f"-c {name}={value}")
+            env["PGOPTIONS"] = " ".join(options)
+
+        return host, port, dbname, user, env
+
+    def _native_restore(self, config, dbname, env, host, port, user):
+        from .pg_native import NativeRestore
+
+        password = env.get("PGPASSWORD")
+
+        def connect():
+            conn = self.get_db_connection(dbname, user, password, host, port)
+            if conn is None:
+                raise ValueError(f"Could not connect to database '{dbname}'")
+            return conn
+
+        return NativeRestore(connect, dbname, config.get("jobs"), self._load_settings(config))
+
+    def _load_settings(self, config):
+        """Server settings for the restore session, e.g. synchronous_commit"""
+        settings = {}
+        for name, value in (config.get("load_settings") or {}).items():
+            if isinstance(value, bool):
+                # YAML reads a bare `off` as False
+                value = "on" if value else "off"
+            settings[str(name)] = str(value)
+        return settings
+
+    def _restore_engine(self, config, backup_name):
+        engine = config.get("engine") or "pg_dump"
+        if engine not in ENGINES:
+            raise ValueError(f"Unsupported dump engine: {engine} (expected one of: {', '.join(ENGINES)})")
+        if engine == "pg_basebackup":
+            # Logical backups restored next to base backups load as usual
+            return "pg_dump"
+        if engine == "native" and (backup_name.endswith(".dump") or backup_name.endswith(".dir")):
+            logger.warning("The native engine restores plain SQL backups, using pg_restore for this one")
+            return "pg_dump"
+        return engine
+
+    def _selection_args(self, config, archive):
+        """pg_restore -t/-n arguments for a selective restore"""
+        tables, schemas = config.get("tables") or [], config.get("schemas") or []
+        if not (tables or schemas):
+            return []
+        if not archive:
+            raise ValueError("--table and --schema need a custom (.dump) or directory (.dir) backup")
+        args = []
+        for table in tables:
+            args += ["-t", table]
+        for schema in schemas:
+            args += ["-n", schema]
+        return args
+
+    def restore(self, config):
+        backup_file = config.get("backup_file", None)
+        if not backup_file or not os.path.exists(backup_file):
+            raise ValueError("Backup file does not exist")
+
+        if is_base_backup(backup_file):
+            # The server is stopped for a physical restore, so no preflight
+            with open(backup_file, 'rb') as stream:
+                self._restore_base_backup(config, stream, os.path.basename(backup_file))
+            return
+
+        archive = os.path.isdir(backup_file) or backup_file.endswith(".dump")
+        selection = self._selection_args(config, archive)
+        host, port, dbname, user, env = self._prepare_restore(config)
+
+        if self._restore_engine(config, backup_file.rstrip(os.sep)) == "native":
+            self._native_restore(config, dbname, env, host, port, user).restore_file(backup_file)
+            logger.info(f"Database {dbname} restored successfully from {backup_file}")
+            return
+
+        if archive:
+            # Archive formats go through pg_restore, which can load
+            # tables and build indexes with several jobs at once
+            tool = "pg_restore"
+            jobs = int(config.get("jobs") or 1)
+            cmd = [
+                "pg_restore",
+                "-h", host,
+                "-p", str(port),
+                "-d", dbname,
+                "-U", user,
+                "-j", str(jobs),
+                *selection,
+                backup_file
+            ]
+        else:
+            tool = "psql"
             cmd = [
                 "psql",
                 "-h", host,
@@ -113,46 +459,186 @@ class PostgresBackup(BackupStrategy):
                 "-U", user,
                 "-f", backup_file
             ]
-            process = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            _, error = process.communicate()
-            if process.returncode != 0:
-                raise Exception(f"psql restore failed: {error}")
-            logger.info(f"Database {dbname} restored successfully from {backup_file}")
+        process = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        _, error = process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"{tool} restore failed: {error}")
+        logger.info(f"Database {dbname} restored successfully from {backup_file}")
+
+    def restore_stream(self, config, stream):
+        """
+        Restore by piping a backup stream into psql or pg_restore stdin.
+
+        Plain SQL goes to psql, custom-format archives (.dump) go to
+        pg_restore. Nothing is written to local disk, and the load runs
+        while the stream is still being downloaded.
+        """
+        backup_name = config.get("backup_name", "")
+        if is_base_backup(backup_name):
+            self._restore_base_backup(config, stream, backup_name)
+            return
+
+        selection = self._selection_args(config, backup_name.endswith(".dump"))
+        host, port, dbname, user, env = self._prepare_restore(config)
+
+        if self._restore_engine(config, backup_name) == "native":
+            self._native_restore(config, dbname, env, host, port, user).restore_stream(stream)
+            logger.info(f"Database {dbname} restored successfully from {backup_name or 'stream'}")
+            return
+
+        if backup_name.endswith(".dump"):
+            tool = "pg_restore"
+            cmd = ["pg_restore", "-h", host, "-p", str(port), "-d", dbname, "-U", user, *selection]
         else:
-            raise ValueError("Missing required config parameters")
+            tool = "psql"
+            cmd = ["psql", "-h", host, "-p", str(port), "-d", dbname, "-U", user]
 
-    def database_exists(self, db_name, user, password, host, port):
+        stderr_file = tempfile.TemporaryFile()
+        process = subprocess.Popen(
+            cmd,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr_file
+        )
+
+        try:
+            try:
+                shutil.copyfileobj(stream, process.stdin, STREAM_CHUNK_SIZE)
+            except BrokenPipeError:
+                # The tool exited early; its exit status explains why
+                pass
+            except Exception:
+                process.kill()
+                raise
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+            if process.wait() != 0:
+                stderr_file.seek(0)
+                error = stderr_file.read().decode(errors='replace').strip()
+                raise Exception(f"{tool} restore failed: {error}")
+        finally:
+            process.wait()
+            stderr_file.close()
+
+        logger.info(f"Database {dbname} restored successfully from {backup_name or 'stream'}")
+
+    def preflight(self, host, port, dbname, user, password, tool=None, create=False):
         """
-        Checks if a PostgreSQL database with the given name exists.
+        Check the server before any data moves, over a single connection.
+
+        Reads the server version, whether the database exists, the
+        user's privileges on it and its size in one query, compares the
+        server version with `tool` (e.g. pg_dump) and, with `create`,
+        creates a missing database over the same connection. Logs how
+        long each step took. Raises ValueError with the reason on failure.
         """
+        timings = []
+        started = time.monotonic()
+
+        version = None
+        if tool:
+            version = tool_version(tool)
+            timings.append((f"{tool} version", time.monotonic() - started))
+
+        step = time.monotonic()
+        conn = self._maintenance_connection(host, port, dbname, user, password)
+        timings.append(("connect", time.monotonic() - step))
+
         try:
-            # Connect to a default database (e.g., 'postgres') to query pg_database
-            conn = self.get_db_connection("postgres", user, password, host, port)
-            if conn is None:
-                raise Exception("Failed to connect to PostgreSQL to check database existence")
-            
             conn.autocommit = True
-            cursor = conn.cursor()
+            step = time.monotonic()
+            with conn.cursor() as cursor:
+                cursor.execute(PREFLIGHT_QUERY, (dbname,))
+                row = cursor.fetchone()
+            timings.append(("checks", time.monotonic() - step))
 
-            # Query pg_database to check for the existence of the specified database
-            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (db_name,))
+            if row is None:
+                raise ValueError(f"Could not read the privileges of user '{user}'")
+            server_version_num, exists, can_connect, can_create, size, superuser, createdb = row
+            server_version = server_version_num // 10000
 
-            exists = cursor.fetchone() is not None
+            if version is not None and version < server_version:
+                raise ValueError(self._version_mismatch(tool, version, server_version))
 
-            cursor.close()
+            if not exists:
+                if not create:
+                    raise ValueError(f"Cannot connect to database '{dbname}' - check credentials and database name")
+                if not (superuser or createdb):
+                    raise ValueError(f"Database '{dbname}' does not exist and user '{user}' can't create it")
+                logger.info("The given database does not exist. Creating it...")
+                step = time.monotonic()
+                self.create_database(dbname, user, password, host, port, conn=conn)
+                timings.append(("create database", time.monotonic() - step))
+            elif not can_connect:
+                raise ValueError(f"User '{user}' is not allowed to connect to database '{dbname}'")
+            elif create and not (superuser or can_create):
+                logger.warning(f"User '{user}' lacks CREATE on '{dbname}', the restore may fail")
+        finally:
             conn.close()
-            return exists
-        except Exception as e:
-            logger.error(f"Error connecting to PostgreSQL: {e}")
-            return False
 
-    def create_database(self, db_name, user, password, host, port):
+        details = ", ".join(f"{name} {elapsed * 1000:.0f} ms" for name, elapsed in timings)
+        size_text = f", database {size / (1024 * 1024):.1f} MB" if exists and size is not None else ""
+        logger.info(
+            f"Preflight for {dbname}@{host}:{port} took {(time.monotonic() - started) * 1000:.0f} ms "
+            f"({details}); server {server_version}{size_text}"
+        )
+        return {
+            "server_version": server_version,
+            "exists": exists,
+            "size": size if exists else None,
+            "superuser": superuser,
+        }
+
+    def _maintenance_connection(self, host, port, dbname, user, password):
+        """
+        Connect to the `postgres` database for the preflight checks.
+
+        Users without access to `postgres` fall back to the target
+        database itself, which then obviously exists.
+        """
+        try:
+            conn = self.get_db_connection("postgres", user, password, host, port)
+        except ValueError as e:
+            # Auth and network errors would fail on the target database too
+            message = str(e)
+            if not (message.startswith("Database 'postgres'") or "permission denied for database" in message):
+                raise
+            conn = None
+        if conn is None:
+            conn = self.get_db_connection(dbname, user, password, host, port)
+        if conn is None:
+            raise ValueError(f"Could not connect to PostgreSQL at {host}:{port}")
+        return conn
+
+    def _version_mismatch(self, tool, tool_major, server_version):
+        return (
+            f"Version Mismatch Error\n\n"
+            f"Your {tool} (version {tool_major}) is too old for this database (version {server_version}).\n\n"
+            f"To fix this:\n"
+            f"  1. Upgrade PostgreSQL client tools to version {server_version}+\n"
+            f"  2. See: https://github.com/asemshaath/afterchive#postgresql-version-requirements\n\n"
+            f"Installation commands:\n"
+            f"  Ubuntu/Debian: sudo apt install postgresql-client-{server_version}\n"
+            f"  macOS: brew install postgresql@{server_version}\n"
+            f"  RHEL/CentOS: sudo yum install postgresql{server_version}\n"
+        )
+
+    def create_database(self, db_name, user, password, host, port, conn=None):
         """
         Creates a PostgreSQL database with the given name.
+
+        Reuses `conn` (left open) when given instead of connecting again.
         """
+        own_conn = conn is None
         try:
             # Connect to a default database (e.g., 'postgres') to create a new database
-            conn = self.get_db_connection("postgres", user, password, host, port)
+            if own_conn:
+                conn = self.get_db_connection("postgres", user, password, host, port)
             
             if conn is None:
                 raise Exception("Failed to connect to PostgreSQL to create database")
@@ -165,7 +651,8 @@ class PostgresBackup(BackupStrategy):
             )
 
             cursor.close()
-            conn.close()
+            if own_conn:
+                conn.close()
             logger.info(f"Database {db_name} created successfully.")
         except Exception as e:
             logger.info(f"Error creating database {db_name}: {e}")
@@ -178,7 +665,9 @@ class PostgresBackup(BackupStrategy):
                 user=user,
                 password=password,
                 host=host,
-                port=port
+                port=port,
+                # Tells the backup throttle these sessions are ours
+                application_name="afterchive"
             )            
             
             return conn
@@ -201,61 +690,42 @@ class PostgresBackup(BackupStrategy):
             logger.info(f"Error connecting to PostgreSQL: {e}")
             return None 
     
+    def _dump_format(self, config):
+        dump_format = config.get("format") or "plain"
+        if dump_format not in DUMP_FORMATS:
+            raise ValueError(
+                f"Unsupported dump format: {dump_format} "
+                f"(expected one of: {', '.join(DUMP_FORMATS)})"
+            )
+        return dump_format
+
+    def _engine(self, config, dump_format):
+        engine = config.get("engine") or "pg_dump"
+        if engine not in ENGINES:
+            raise ValueError(f"Unsupported dump engine: {engine} (expected one of: {', '.join(ENGINES)})")
+        if engine == "native" and dump_format != "plain":
+            raise ValueError("The native engine writes plain SQL dumps, use format: plain")
+        if engine == "pg_basebackup" and dump_format != "plain":
+            raise ValueError("pg_basebackup writes a tar of the whole cluster, leave the format unset")
+        return engine
+
+    def _format_args(self, dump_format, jobs):
+        """pg_dump flags for the requested output format"""
+        if dump_format == "custom":
+            return ["-Fc"]
+        if dump_format == "directory":
+            # Only the directory format can dump tables in parallel
+            return ["-Fd", "-j", str(jobs)]
+        return []
+
     def _cleanup_temp_file(self, filepath):
-        """Remove temporary file if it exists"""
+        """Remove temporary file (or dump directory) if it exists"""
         if filepath and os.path.exists(filepath):
             try:
-                os.remove(filepath)
+                if os.path.isdir(filepath):
+                    shutil.rmtree(filepath)
+                else:
+                    os.remove(filepath)
                 logger.debug(f"Cleaned up temp file: {filepath}")
             except Exception as e:
                 logger.warning(f"Failed to clean up temp file {filepath}: {e}")
-
-    def _check_version_compatibility(self, host, port, user, password, dbname):
-        """Check if pg_dump version is compatible with database version"""
-        
-        # Get pg_dump version
-        try:
-            result = subprocess.run(
-                ['pg_dump', '--version'],
-                capture_output=True,
-                text=True
-            )
-            dump_version_str = result.stdout.strip()
-            dump_match = re.search(r'pg_dump \(PostgreSQL\) (\d+)', dump_version_str)
-            if not dump_match:
-                return  # Can't parse, let pg_dump handle it
-            
-            dump_version = int(dump_match.group(1))
-        except Exception:
-            return  # Can't check, let pg_dump handle it
-        
-        # Get database version
-        try:
-            conn = self.get_db_connection(dbname, user, password, host, port)
-            cursor = conn.cursor()
-            cursor.execute("SHOW server_version;")
-            server_version_str = cursor.fetchone()[0]
-            cursor.close()
-            conn.close()
-            
-            server_match = re.search(r'^(\d+)', server_version_str)
-            if not server_match:
-                return
-            
-            server_version = int(server_match.group(1))
-        except Exception:
-            return  # Can't check, let pg_dump handle it
-        
-        # Check compatibility
-        if dump_version < server_version:
-            raise ValueError(
-                f"Version Mismatch Error\n\n"
-                f"Your pg_dump (version {dump_version}) is too old for this database (version {server_version}).\n\n"
-                f"To fix this:\n"
-                f"  1. Upgrade PostgreSQL client tools to version {server_version}+\n"
-                f"  2. See: https://github.com/asemshaath/afterchive#postgresql-version-requirements\n\n"
-                f"Installation commands:\n"
-                f"  Ubuntu/Debian: sudo apt install postgresql-client-{server_version}\n"
-                f"  macOS: brew install postgresql@{server_version}\n"
-                f"  RHEL/CentOS: sudo yum install postgresql{server_version}\n"
-            )
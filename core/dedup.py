@@ -0,0 +1,337 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from .catalog import load_catalog
+from .compression import CODECS, compress_bytes, decompress_bytes
+from .streams import parallel_fetch_reader, STREAM_CHUNK_SIZE
+
+logger = logging.getLogger('afterchive')
+
+# A deduplicated backup is stored as <backup_name>.chunks, a JSON index of
+# the content-addressed chunks under chunks/ that make up the dump
+CHUNKS_SUFFIX = ".chunks"
+CHUNK_PREFIX = "chunks/"
+INDEX_VERSION = 1
+
+MIN_CHUNK_SIZE = 512 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+# A line ending is a chunk boundary when the hash of the bytes before it
+# has these low bits clear, i.e. about one candidate in 4096
+BOUNDARY_MASK = (1 << 12) - 1
+BOUNDARY_WINDOW = 64
+
+DEFAULT_WORKERS = 8
+
+# Processes storing chunked backups or collecting chunks in a storage path
+# leave a lock object here. Chunk collection is skipped while a backup
+# holds one (it may rely on chunks no index refers to yet) and backups
+# wait for a running collection to finish before they start
+LOCK_PREFIX = "locks/dedup/"
+# Locks older than this were left by a process that died
+STORE_LOCK_MAX_AGE = 24 * 3600
+COLLECT_LOCK_MAX_AGE = 3600
+LOCK_POLL_SECONDS = 5
+
+
+def is_chunked(backup_name):
+    return backup_name.endswith(CHUNKS_SUFFIX)
+
+
+def chunk_name(digest, codec=None):
+    suffix = CODECS[codec] if codec else ""
+    return f"{CHUNK_PREFIX}{digest[:2]}/{digest}{suffix}"
+
+
+def _take_lock(storage, kind, config):
+    name = f"{LOCK_PREFIX}{kind}-{uuid.uuid4().hex}"
+    owner = {"taken_at": time.time(), "host": socket.gethostname(), "pid": os.getpid()}
+    storage.put_object(name, json.dumps(owner).encode(), config)
+    return name
+
+
+def _live_locks(storage, kind, config):
+    """Names of the `kind` locks (store or collect) of a storage path that haven't expired"""
+    max_age = STORE_LOCK_MAX_AGE if kind == "store" else COLLECT_LOCK_MAX_AGE
+    live = []
+    for name in storage.list_objects(LOCK_PREFIX, config):
+        if not name[len(LOCK_PREFIX):].startswith(f"{kind}-"):
+            continue
+        try:
+            owner = json.loads(storage.get_object(name, config))
+        except FileNotFoundError:
+            # Released since the listing
+            continue
+        if time.time() - owner.get("taken_at", 0) < max_age:
+            live.append(name)
+        else:
+            logger.warning(f"Removing the expired lock {name} of {owner.get('host')}:{owner.get('pid')}")
+            storage.delete_objects([name], config)
+    return live
+
+
+@contextmanager
+def _storing(storage, config):
+    """
+    Hold a store lock while a chunked backup is stored. Both sides take
+    their lock before looking for the other's, so a backup and a chunk
+    collection starting at the same time can't both go ahead.
+    """
+    name = _take_lock(storage, "store", config)
+    try:
+        waiting = False
+        while _live_locks(storage, "collect", config):
+            if not waiting:
+                logger.info("Waiting for another process to finish collecting chunks")
+                waiting = True
+            time.sleep(LOCK_POLL_SECONDS)
+        yield
+    finally:
+        storage.delete_objects([name], config)
+
+
+def collect_chunks(storage, config, dry_run=False, removed=()):
+    """
+    Delete the chunks no .chunks index of the storage path refers to,
+    counting the indexes in `removed` as gone. Returns the number of
+    chunks deleted (or that would be, with dry_run).
+    """
+    lock = None if dry_run else _take_lock(storage, "collect", config)
+    try:
+        if lock and _live_locks(storage, "store", config):
+            logger.info("A deduplicated backup is being stored here, skipping chunk cleanup")
+            return 0
+        return _collect_chunks(storage, config, dry_run, removed)
+    finally:
+        if lock:
+            storage.delete_objects([lock], config)
+
+
+def _collect_chunks(storage, config, dry_run, removed):
+    started = time.monotonic()
+    names = storage.list_objects("", config)
+    indexes = [name for name in names if is_chunked(name) and "/" not in name and name not in removed]
+    chunks = [name for name in names if name.startswith(CHUNK_PREFIX)]
+
+    def referenced(index_name):
+        try:
+            index = json.loads(storage.get_object(index_name, config))
+        except FileNotFoundError:
+            # Deleted since the listing
+            return set()
+        return {chunk_name(digest, index.get("codec")) for digest, _ in index["chunks"]}
+
+    workers = int(config.get('workers') or DEFAULT_WORKERS)
+    live = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # An unreadable index raises here, nothing is deleted then
+        for names_of_index in pool.map(referenced, indexes):
+            live |= names_of_index
+
+    garbage = [name for name in chunks if name not in live]
+    if dry_run:
+        logger.info(f"Would delete {len(garbage)} of {len(chunks)} chunks")
+        return len(garbage)
+    failed = storage.delete_objects(garbage, config) if garbage else []
+    logger.info(
+        f"Deleted {len(garbage) - len(failed)} of {len(chunks)} chunks, "
+        f"{len(indexes)} chunked backups left, in {time.monotonic() - started:.1f}s"
+    )
+    return len(garbage) - len(failed)
+
+
+def _find_boundary(buffer, min_size, max_size):
+    """
+    Offset of the first content-defined cut point in buffer, or None.
+
+    Cut points are line endings (dumps are line oriented: one row per
+    COPY line), chosen by a hash of the preceding window. They only
+    depend on nearby content, so an edit early in the dump shifts bytes
+    without moving the cut points after it and the remaining chunks
+    still match the previous backup.
+    """
+    limit = min(len(buffer), max_size)
+    with memoryview(buffer) as view:
+        position = min_size
+        while True:
+            newline = buffer.find(b'\n', position, limit)
+            if newline < 0:
+                return None
+            window = view[max(0, newline - BOUNDARY_WINDOW):newline]
+            if zlib.crc32(window) & BOUNDARY_MASK == 0:
+                return newline + 1
+            position = newline + 1
+
+
+def iter_chunks(stream, min_size=MIN_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """Split a readable stream into content-defined chunks"""
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < max_size:
+            data = stream.read(STREAM_CHUNK_SIZE)
+            if data:
+                buffer += data
+            else:
+                eof = True
+        if not buffer:
+            return
+
+        cut = _find_boundary(buffer, min_size, max_size)
+        if cut is None:
+            # No boundary within max_size (or the stream ended)
+            cut = min(len(buffer), max_size)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+class ChunkStore:
+    """
+    Deduplicating backup repository on top of a storage backend.
+
+    Dumps are split into content-defined chunks addressed by their
+    SHA-256. Only chunks the repository doesn't already hold are
+    uploaded, so a backup of a mostly unchanged database writes roughly
+    the changed data plus a small index.
+
+    Which chunks the repository holds comes from the index of the
+    previous backup of `database`; chunks it doesn't list are looked up
+    one by one, so a backup costs no listing of the whole chunks/ prefix.
+    """
+
+    def __init__(self, storage, codec=None, level=None, database=None):
+        self.storage = storage
+        self.codec = codec
+        self.level = level
+        self.database = database
+
+    def store_stream(self, stream, backup_name, config):
+        """Chunk a dump stream and store it as <backup_name>.chunks"""
+        with _storing(self.storage, config):
+            return self._store_stream(stream, backup_name, config)
+
+    def _previous_chunks(self, config):
+        """Chunk names of the newest catalogued .chunks backup of the database"""
+        if not self.database:
+            return set()
+        catalog = load_catalog(self.storage, config)
+        entries = [
+            entry for entry in (catalog or {}).get("backups", [])
+            if entry.get("database") == self.database and is_chunked(entry["backup"])
+        ]
+        if not entries:
+            return set()
+        # Catalog entries are kept sorted oldest first
+        previous = entries[-1]["backup"]
+        try:
+            index = json.loads(self.storage.get_object(previous, config))
+        except FileNotFoundError:
+            logger.info(f"Previous index {previous} is gone, looking up every chunk")
+            return set()
+        return {chunk_name(digest, index.get("codec")) for digest, _ in index["chunks"]}
+
+    def _exists(self, name, config):
+        try:
+            self.storage.stat_object(name, config)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _store_stream(self, stream, backup_name, config):
+        started = time.monotonic()
+        workers = int(config.get('workers') or DEFAULT_WORKERS)
+        # Chunks known to be stored, and those claimed by this backup
+        known = self._previous_chunks(config)
+        claimed = set()
+        lock = threading.Lock()
+        stats = {"new": 0, "new_bytes": 0, "stored_bytes": 0, "looked_up": 0}
+
+        def put(data):
+            digest = hashlib.sha256(data).hexdigest()
+            name = chunk_name(digest, self.codec)
+            with lock:
+                is_new = name not in known and name not in claimed
+                claimed.add(name)
+            if is_new:
+                with lock:
+                    stats["looked_up"] += 1
+                if self._exists(name, config):
+                    return [digest, len(data)]
+                payload = compress_bytes(data, self.codec, self.level) if self.codec else data
+                self.storage.put_object(name, payload, config)
+                with lock:
+                    stats["new"] += 1
+                    stats["new_bytes"] += len(data)
+                    stats["stored_bytes"] += len(payload)
+            return [digest, len(data)]
+
+        chunks = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for data in iter_chunks(stream):
+                pending.append(pool.submit(put, data))
+                # Bound the chunks held in memory while uploads catch up
+                while len(pending) >= workers * 2:
+                    chunks.append(pending.popleft().result())
+            for future in pending:
+                chunks.append(future.result())
+
+        size = sum(length for _, length in chunks)
+        index = {
+            "version": INDEX_VERSION,
+            "backup": backup_name,
+            "codec": self.codec,
+            "size": size,
+            "chunks": chunks,
+        }
+        index_name = f"{backup_name}{CHUNKS_SUFFIX}"
+        self.storage.put_object(index_name, json.dumps(index).encode(), config)
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        mb = 1024 * 1024
+        logger.info(
+            f"Stored {index_name}: {len(chunks)} chunks, {stats['new']} new, "
+            f"{stats['looked_up']} looked up; "
+            f"{stats['new_bytes'] / mb:.1f} of {size / mb:.1f} MB new, "
+            f"{stats['stored_bytes'] / mb:.1f} MB written in {elapsed:.1f}s"
+        )
+        return index_name
+
+    def store(self, backup_path, config):
+        with open(backup_path, 'rb') as stream:
+            return self.store_stream(stream, os.path.basename(backup_path), config)
+
+    @contextmanager
+    def retrieve_stream(self, index_name, config):
+        """Reassemble a chunked backup as a readable stream"""
+        try:
+            index = json.loads(self.storage.get_object(index_name, config))
+        except FileNotFoundError:
+            raise ValueError(f"Backup '{index_name}' does not exist.")
+
+        codec = index.get("codec")
+        workers = int(config.get('workers') or DEFAULT_WORKERS)
+
+        def fetch(digest, length):
+            payload = self.storage.get_object(chunk_name(digest, codec), config)
+            data = decompress_bytes(payload, codec) if codec else payload
+            if len(data) != length or hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError(f"Chunk {digest} of {index_name} is corrupt")
+            return data
+
+        fetches = [lambda digest=digest, length=length: fetch(digest, length) for digest, length in index["chunks"]]
+        logger.info(f"Restoring {index_name}: {len(fetches)} chunks, {index['size']} bytes")
+        # Chunks are fetched `workers` at a time, ahead of the consumer
+        reader = parallel_fetch_reader(fetches, workers)
+        try:
+            yield reader
+        finally:
+            reader.close()
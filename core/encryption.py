@@ -0,0 +1,299 @@
+"""
+Client-side AES-256-GCM encryption of backups.
+
+An encrypted backup is a header followed by fixed-size chunks that are
+each encrypted and authenticated on their own, so chunks are encrypted
+and decrypted on several cores at once and any byte range can be read
+by fetching and decrypting just the chunks that cover it:
+
+    header  magic "AFTENC", version, chunk size, key id, salt (51 bytes)
+    chunk i AES-256-GCM(chunk i of the plaintext) + 16 byte tag
+
+Every backup gets its own data key, derived from the configured key and
+the random salt with HKDF, so chunk nonces can simply count. A nonce
+also marks the last chunk and the header is authenticated with every
+chunk, so reordered, truncated or spliced backups fail to decrypt.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import shutil
+import struct
+import tempfile
+from .streams import STREAM_CHUNK_SIZE, parallel_chunk_reader, read_full
+from .utils import remove_local_copy
+
+logger = logging.getLogger('afterchive')
+
+ENCRYPTED_SUFFIX = ".enc"
+
+MAGIC = b"AFTENC"
+VERSION = 1
+# magic, version, chunk size, key id, salt
+HEADER = struct.Struct(">6sBI8s32s")
+TAG_SIZE = 16
+KEY_SIZE = 32
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+KEY_ENV = "AFTERCHIVE_ENCRYPTION_KEY"
+
+
+def _aesgcm():
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise ImportError(
+            "Encryption support not installed. "
+            "Install with: pip install afterchive[encryption]"
+        )
+    return AESGCM
+
+
+def is_encrypted(backup_name):
+    return backup_name.endswith(ENCRYPTED_SUFFIX)
+
+
+def strip_encryption_suffix(backup_name):
+    return backup_name[:-len(ENCRYPTED_SUFFIX)] if is_encrypted(backup_name) else backup_name
+
+
+def parse_key(text, source):
+    """A 32 byte key given raw, base64 or hex encoded"""
+    if len(text) == KEY_SIZE:
+        return bytes(text)
+    value = text.strip()
+    for decode in (base64.b64decode, binascii.unhexlify):
+        try:
+            key = decode(value)
+        except (binascii.Error, ValueError):
+            continue
+        if len(key) == KEY_SIZE:
+            return key
+    raise ValueError(
+        f"The encryption key in {source} must be 32 bytes, raw, base64 or hex "
+        f"encoded (create one with `openssl rand -base64 32`)"
+    )
+
+
+def encryption_keys(options):
+    """
+    Keys from `encryption_key_file` (a path or a list of paths) and
+    AFTERCHIVE_ENCRYPTION_KEY. The first one encrypts new backups, all
+    of them are tried by key id on restore, so old keys can stay listed
+    after a rotation.
+    """
+    keys = []
+    files = options.get('encryption_key_file') or []
+    for path in [files] if isinstance(files, str) else files:
+        path = os.path.expanduser(path)
+        if not os.path.exists(path):
+            raise ValueError(f"Encryption key file not found at {path}")
+        with open(path, 'rb') as f:
+            keys.append(parse_key(f.read(), path))
+    if os.getenv(KEY_ENV):
+        keys.append(parse_key(os.getenv(KEY_ENV).encode(), KEY_ENV))
+    return keys
+
+
+def key_id(key):
+    """Short fingerprint stored in the header, to pick the key on restore"""
+    return hashlib.sha256(b"afterchive key id" + key).digest()[:8]
+
+
+def _data_key(key, salt):
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    return HKDF(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=salt, info=b"afterchive backup v1").derive(key)
+
+
+def _nonce(index, last):
+    return struct.pack(">QB3x", index, 1 if last else 0)
+
+
+def _workers(threads):
+    return int(threads) if threads else (os.cpu_count() or 1)
+
+
+def encrypt_stream(stream, key, threads=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Wrap a readable stream so reads return it encrypted, `threads` chunks at a time"""
+    salt = os.urandom(32)
+    header = HEADER.pack(MAGIC, VERSION, chunk_size, key_id(key), salt)
+    cipher = _aesgcm()(_data_key(key, salt))
+
+    def encrypt(index, data, last):
+        return cipher.encrypt(_nonce(index, last), data, header)
+
+    return parallel_chunk_reader(stream, chunk_size, encrypt, _workers(threads), header=header)
+
+
+class _Header:
+    def __init__(self, data, keys, name):
+        if len(data) < HEADER.size:
+            raise ValueError(f"{name} is not an afterchive encrypted backup (too short)")
+        magic, version, self.chunk_size, self.key_id, self.salt = HEADER.unpack(data[:HEADER.size])
+        if magic != MAGIC:
+            raise ValueError(f"{name} is not an afterchive encrypted backup")
+        if version != VERSION:
+            raise ValueError(f"{name} uses encryption format version {version}, this afterchive reads {VERSION}")
+        if not keys:
+            raise ValueError(f"{name} is encrypted, set encryption_key_file or {KEY_ENV} to restore it")
+        key = next((key for key in keys if key_id(key) == self.key_id), None)
+        if key is None:
+            raise ValueError(
+                f"{name} was encrypted with key {self.key_id.hex()}, which isn't configured "
+                f"(encryption_key_file or {KEY_ENV})"
+            )
+        self.bytes = bytes(data[:HEADER.size])
+        self.cipher = _aesgcm()(_data_key(key, self.salt))
+
+    def decrypt(self, index, data, last):
+        from cryptography.exceptions import InvalidTag
+        try:
+            return self.cipher.decrypt(_nonce(index, last), data, self.bytes)
+        except InvalidTag:
+            raise ValueError(f"Encrypted backup is corrupt, truncated or was modified (chunk {index})")
+
+
+def decrypt_stream(stream, keys, threads=None, name="backup"):
+    """Wrap a readable stream of an encrypted backup so reads return the plaintext"""
+    header = _Header(read_full(stream, HEADER.size), keys, name)
+    return parallel_chunk_reader(stream, header.chunk_size + TAG_SIZE, header.decrypt, _workers(threads))
+
+
+def encrypt_bytes(data, key):
+    """Encrypt a small object (bytes) in the same format as a backup"""
+    stream = encrypt_stream(io.BytesIO(data), key, threads=1)
+    try:
+        return stream.read()
+    finally:
+        stream.close()
+
+
+def decrypt_bytes(data, keys, name="object"):
+    stream = decrypt_stream(io.BytesIO(data), keys, threads=1, name=name)
+    try:
+        return stream.read()
+    finally:
+        stream.close()
+
+
+def encrypt_file(path, key, threads=None):
+    """Encrypt a dump file next to itself and remove the original"""
+    encrypted_path = f"{path}{ENCRYPTED_SUFFIX}"
+    try:
+        with open(path, 'rb') as source, open(encrypted_path, 'wb') as out:
+            stream = encrypt_stream(source, key, threads)
+            try:
+                shutil.copyfileobj(stream, out, STREAM_CHUNK_SIZE)
+            finally:
+                stream.close()
+    except Exception:
+        if os.path.exists(encrypted_path):
+            os.remove(encrypted_path)
+        raise
+
+    logger.info(f"Encrypted {os.path.basename(path)} with AES-256-GCM (key {key_id(key).hex()})")
+    os.remove(path)
+    return encrypted_path
+
+
+def decrypt_file(path, keys, threads=None):
+    """
+    Decrypt a retrieved backup into a new temp directory.
+
+    The encrypted file is left alone, it may be the stored backup itself.
+    """
+    plain_path = os.path.join(tempfile.mkdtemp(), strip_encryption_suffix(os.path.basename(path)))
+    try:
+        with open(path, 'rb') as source, open(plain_path, 'wb') as out:
+            stream = decrypt_stream(source, keys, threads, os.path.basename(path))
+            try:
+                shutil.copyfileobj(stream, out, STREAM_CHUNK_SIZE)
+            finally:
+                stream.close()
+    except Exception:
+        remove_local_copy(plain_path)
+        raise
+
+    return plain_path
+
+
+def plaintext_size(size, chunk_size):
+    """Size of the plaintext of an encrypted backup of `size` bytes"""
+    body = size - HEADER.size
+    full, rest = divmod(body, chunk_size + TAG_SIZE)
+    return full * chunk_size + max(rest - TAG_SIZE, 0)
+
+
+class DecryptingStorage:
+    """
+    Ranged reads of the plaintext of encrypted objects, for selective
+    restores: a byte range costs the chunks that cover it.
+    """
+
+    def __init__(self, storage, keys):
+        self._storage = storage
+        self._keys = keys
+        self._headers = {}
+
+    def get_object(self, name, config):
+        return self._storage.get_object(name, config)
+
+    def list_objects(self, prefix, config):
+        return self._storage.list_objects(prefix, config)
+
+    def stat_object(self, name, config):
+        header, size = self._header(name, config)
+        return {"size": plaintext_size(size, header.chunk_size), "crc32c": None}
+
+    def retrieve_ranges(self, name, ranges, path, config):
+        """Fetch and decrypt the chunks covering `ranges` into the same offsets of `path`"""
+        header, size = self._header(name, config)
+        chunk, stored_chunk = header.chunk_size, header.chunk_size + TAG_SIZE
+        count = max(-(-(size - HEADER.size) // stored_chunk), 1)
+        indexes = sorted({
+            index
+            for start, end in ranges if end > start
+            for index in range(start // chunk, min((end - 1) // chunk, count - 1) + 1)
+        })
+        if not indexes:
+            return
+
+        # Neighbouring chunks are fetched as one range
+        spans = []
+        for index in indexes:
+            start = HEADER.size + index * stored_chunk
+            end = min(start + stored_chunk, size)
+            if spans and spans[-1][1] == start:
+                spans[-1][1] = end
+            else:
+                spans.append([start, end])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            encrypted_path = os.path.join(temp_dir, "ranges")
+            with open(encrypted_path, 'wb') as f:
+                f.truncate(size)
+            self._storage.retrieve_ranges(name, [tuple(span) for span in spans], encrypted_path, config)
+            with open(encrypted_path, 'rb') as source, open(path, 'r+b') as out:
+                for index in indexes:
+                    source.seek(HEADER.size + index * stored_chunk)
+                    data = source.read(stored_chunk)
+                    out.seek(index * chunk)
+                    out.write(header.decrypt(index, data, index == count - 1))
+
+    def _header(self, name, config):
+        if name in self._headers:
+            return self._headers[name]
+        size = self._storage.stat_object(name, config)["size"]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            header_path = os.path.join(temp_dir, "header")
+            with open(header_path, 'wb') as f:
+                f.truncate(min(HEADER.size, size))
+            self._storage.retrieve_ranges(name, [(0, min(HEADER.size, size))], header_path, config)
+            with open(header_path, 'rb') as f:
+                self._headers[name] = _Header(f.read(), self._keys, name), size
+        return self._headers[name]
@@ -0,0 +1,155 @@
+import logging
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .commands import run_backup
+from .configs import parse_jobs_config
+
+logger = logging.getLogger('afterchive')
+
+# Jobs running at once, overall and against a single database server
+DEFAULT_WORKERS = 4
+DEFAULT_PER_HOST = 2
+
+
+def _host_key(job):
+    database = job["databases"][0]
+    return (database.get("host") or "localhost", database.get("port") or 5432)
+
+
+def _run_job(job):
+    """Run one backup job, turning any failure into a result"""
+    started = time.monotonic()
+    result = {"name": job["name"], "ok": False, "error": None, "size": None}
+    try:
+        backup = run_backup(job["databases"][0], job["storage"], job["options"])
+        result.update(ok=True, backup=backup["backup"], size=backup["size"])
+    except (Exception, SystemExit) as e:
+        # One job must never end the whole batch
+        result["error"] = str(e) or e.__class__.__name__
+        logger.error(f"Job {job['name']} failed: {result['error']}")
+        logger.debug("Full error:", exc_info=True)
+    result["duration"] = time.monotonic() - started
+    return result
+
+
+class JobPool:
+    """
+    Thread pool for backup jobs with a per-database-server limit.
+
+    At most `workers` jobs run at once and at most `per_host` of them
+    against the same server. A job whose server is busy waits while jobs
+    for other servers start.
+    """
+
+    def __init__(self, workers=None, per_host=None):
+        self.workers = int(workers or DEFAULT_WORKERS)
+        self.per_host = int(per_host or DEFAULT_PER_HOST)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._waiting = []
+        self._running = {}
+        self._host_load = Counter()
+
+    @property
+    def busy(self):
+        return bool(self._waiting or self._running)
+
+    def is_queued(self, name):
+        """True while a job with this name is waiting or running"""
+        return any(job["name"] == name for job in self._waiting + list(self._running.values()))
+
+    def submit(self, job):
+        self._waiting.append(job)
+        self._dispatch()
+
+    def wait(self, timeout=None):
+        """Wait for running jobs, return (job, result) for those that finished"""
+        if not self._running:
+            return []
+        done, _ = wait(self._running, timeout=timeout, return_when=FIRST_COMPLETED)
+        finished = []
+        for future in done:
+            job = self._running.pop(future)
+            self._host_load[_host_key(job)] -= 1
+            finished.append((job, future.result()))
+        self._dispatch()
+        return finished
+
+    def shutdown(self):
+        self._waiting.clear()
+        self._pool.shutdown(wait=True)
+
+    def _dispatch(self):
+        for job in list(self._waiting):
+            if len(self._running) >= self.workers:
+                break
+            host = _host_key(job)
+            if self._host_load[host] >= self.per_host:
+                continue
+            self._waiting.remove(job)
+            self._host_load[host] += 1
+            self._running[self._pool.submit(_run_job, job)] = job
+
+
+def run_jobs(jobs, workers=None, per_host=None):
+    """Run backup jobs on a JobPool, return one result per job in order"""
+    pool = JobPool(workers, per_host)
+    logger.info(f"Running {len(jobs)} jobs with {pool.workers} workers, at most {pool.per_host} per host")
+
+    results = {}
+    try:
+        for job in jobs:
+            pool.submit(job)
+        while pool.busy:
+            for job, result in pool.wait():
+                results[id(job)] = result
+    finally:
+        pool.shutdown()
+
+    return [results[id(job)] for job in jobs]
+
+
+def log_summary(results, elapsed):
+    """Log per-job duration and throughput, return the number of failures"""
+    logger.info("Job summary:")
+    for result in results:
+        if result["ok"]:
+            mb = (result["size"] or 0) / (1024 * 1024)
+            logger.info(
+                f"  ✓ {result['name']}: {result['duration']:.1f}s, "
+                f"{mb:.1f} MB, {mb / max(result['duration'], 1e-6):.1f} MB/s"
+            )
+        else:
+            logger.info(f"  ✗ {result['name']}: {result['duration']:.1f}s, {result['error']}")
+
+    failed = sum(1 for result in results if not result["ok"])
+    logger.info(f"{len(results) - failed} of {len(results)} jobs succeeded in {elapsed:.1f}s")
+    return failed
+
+
+def run_jobs_command(config_path, workers=None, per_host=None, only=None):
+    """Run every job of a config file, exiting non-zero if any failed"""
+    try:
+        config = parse_jobs_config(config_path)
+    except (ValueError, FileNotFoundError) as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    jobs = config["jobs"]
+    if only:
+        jobs = [job for job in jobs if job["name"] in only]
+        missing = set(only) - {job["name"] for job in jobs}
+        if missing:
+            logger.error(f"Unknown job(s): {', '.join(sorted(missing))}")
+            sys.exit(1)
+
+    concurrency = config["concurrency"]
+    started = time.monotonic()
+    results = run_jobs(
+        jobs,
+        workers=workers or concurrency.get("workers"),
+        per_host=per_host or concurrency.get("per_host"),
+    )
+    if log_summary(results, time.monotonic() - started):
+        sys.exit(1)
@@ -0,0 +1,56 @@
+import io
+import json
+import logging
+import time
+from .compression import DEFAULT_LEVELS
+
+logger = logging.getLogger('afterchive')
+
+# Stored next to each backup as <backup_name>.manifest.json
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+
+
+def manifest_name(backup_name):
+    return f"{backup_name}{MANIFEST_SUFFIX}"
+
+
+def build_manifest(backup_name, db_conf, options, codec=None, size=None, started_at=None, checksums=None, blocks=None,
+                   encryption=None):
+    """Describe a finished backup so restores don't have to guess"""
+    started_at = started_at or time.time()
+    level = options.get('compression_level')
+    if codec and level is None:
+        level = DEFAULT_LEVELS[codec]
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "backup": backup_name,
+        "database": db_conf.get('name'),
+        "db_type": db_conf.get('type'),
+        # started_at is about when the dump's snapshot was taken
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started_at)),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        # pg_basebackup writes one tar whatever the dump format says
+        "format": 'tar' if options.get('engine') == 'pg_basebackup' else (options.get('format') or 'plain'),
+        "engine": options.get('engine') or 'pg_dump',
+        "compression": {
+            "codec": codec,
+            "level": level if codec else None,
+        },
+        "size": size,
+        "encryption": encryption,
+        # Of the stored bytes (of the reassembled dump for .chunks backups)
+        "checksums": checksums,
+    }
+    if blocks is not None:
+        # Where each table's data is in a streamed custom archive
+        manifest["blocks"] = {str(dump_id): span for dump_id, span in blocks.items()}
+    return manifest
+
+
+def store_manifest(storage, manifest, storage_conf):
+    data = json.dumps(manifest, indent=2, sort_keys=True).encode()
+    name = manifest_name(manifest["backup"])
+    storage.store_stream(io.BytesIO(data), name, config=storage_conf)
+    logger.debug(f"Manifest stored as {name}")
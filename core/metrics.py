@@ -0,0 +1,306 @@
+import contextvars
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger('afterchive')
+
+# The report of the run in progress on this thread, see RunReport.activate()
+_current = contextvars.ContextVar('afterchive_run_report', default=None)
+
+
+class Stage:
+    """Time and bytes spent in one stage of a run"""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes=0, seconds=0.0):
+        with self._lock:
+            self.bytes += nbytes
+            self.seconds += seconds
+
+    def to_dict(self):
+        mb_per_s = self.bytes / (1024 * 1024) / self.seconds if self.bytes and self.seconds > 0 else None
+        return {
+            "name": self.name,
+            "seconds": round(self.seconds, 3),
+            "bytes": self.bytes,
+            "mb_per_s": round(mb_per_s, 1) if mb_per_s is not None else None,
+        }
+
+
+class RunReport:
+    """
+    Per-stage metrics of one backup or restore run.
+
+    Sequential stages are timed with stage(); a stage nested inside
+    another (preflight inside dump) is subtracted from the outer one, so
+    stage times add up to the run time. Streaming stages run at the same
+    time; for those MeteredReader records how long the consumer waited
+    on each stage, which points at the bottleneck.
+    """
+
+    def __init__(self, command, db_conf=None):
+        db_conf = db_conf or {}
+        self.command = command
+        self.database = db_conf.get('name')
+        self.db_type = db_conf.get('type')
+        self.stages = {}
+        self.info = {}
+        self.status = None
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._started = time.monotonic()
+        self._duration = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_stage(self, name):
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = Stage(name)
+            return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as stage `name`, excluding stages nested inside it"""
+        stage = self.get_stage(name)
+        stack = self._local.__dict__.setdefault('stack', [])
+        entry = [stage, 0.0]
+        stack.append(entry)
+        started = time.monotonic()
+        try:
+            yield stage
+        finally:
+            elapsed = time.monotonic() - started
+            stack.pop()
+            stage.add(seconds=elapsed - entry[1])
+            if stack:
+                stack[-1][1] += elapsed
+
+    @contextmanager
+    def activate(self):
+        """Make this the report that module-level stage() records into"""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def finish(self, error=None):
+        self.finished_at = time.time()
+        self._duration = time.monotonic() - self._started
+        self.status = "failed" if error else "success"
+        self.error = str(error) if error else None
+
+    def _peak_rss(self):
+        if resource is None:
+            return None, None
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        scale = 1 if os.uname().sysname == "Darwin" else 1024
+        return (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+        )
+
+    def to_dict(self):
+        peak_rss, peak_child_rss = self._peak_rss()
+        return {
+            "command": self.command,
+            "database": self.database,
+            "db_type": self.db_type,
+            "host": socket.gethostname(),
+            "status": self.status,
+            "error": self.error,
+            "started_at": _iso(self.started_at),
+            "finished_at": _iso(self.finished_at) if self.finished_at else None,
+            "duration_seconds": round(self._duration, 3) if self._duration is not None else None,
+            "stages": [stage.to_dict() for stage in self.stages.values()],
+            "peak_rss_bytes": peak_rss,
+            "peak_child_rss_bytes": peak_child_rss,
+            **self.info,
+        }
+
+    def summary(self):
+        parts = []
+        for stage in self.stages.values():
+            data = stage.to_dict()
+            text = f"{stage.name} {data['seconds']:.1f}s"
+            if data["mb_per_s"] is not None:
+                text += f" ({data['mb_per_s']} MB/s)"
+            parts.append(text)
+        return ", ".join(parts)
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.to_dict(), indent=2) + "\n")
+        logger.info(f"Run report written to {path}")
+
+    def write_prometheus(self, path):
+        """Write the run as a node_exporter textfile-collector file"""
+        report = self.to_dict()
+        labels = f'command="{_escape(self.command)}",database="{_escape(self.database or "")}"'
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP afterchive_{name} {help_text}")
+            lines.append(f"# TYPE afterchive_{name} gauge")
+            for extra, value in samples:
+                if value is not None:
+                    lines.append(f"afterchive_{name}{{{labels}{extra}}} {value}")
+
+        metric("last_run_success", "1 if the last run succeeded, 0 if it failed",
+               [("", 1 if self.status == "success" else 0)])
+        metric("last_run_timestamp_seconds", "Unix time the last run finished",
+               [("", round(self.finished_at or time.time(), 3))])
+        metric("last_run_duration_seconds", "Wall time of the last run", [("", report["duration_seconds"])])
+        metric("stage_seconds", "Seconds spent in each stage of the last run",
+               [(f',stage="{stage["name"]}"', stage["seconds"]) for stage in report["stages"]])
+        metric("stage_bytes", "Bytes processed by each stage of the last run",
+               [(f',stage="{stage["name"]}"', stage["bytes"]) for stage in report["stages"]])
+        metric("stage_throughput_bytes_per_second", "Throughput of each stage of the last run",
+               [(f',stage="{stage["name"]}"', round(stage["bytes"] / stage["seconds"], 1))
+                for stage in report["stages"] if stage["bytes"] and stage["seconds"] > 0])
+        metric("peak_rss_bytes", "Peak resident memory of afterchive (and of its child tools)",
+               [(',process="afterchive"', report["peak_rss_bytes"]),
+                (',process="children"', report["peak_child_rss_bytes"])])
+        if "size" in self.info:
+            metric("backup_size_bytes", "Stored size of the last backup", [("", self.info["size"])])
+
+        _write_atomic(path, "\n".join(lines) + "\n")
+        logger.info(f"Prometheus metrics written to {path}")
+
+    def write_outputs(self, options):
+        """Write the report files requested in options; never fails the run"""
+        context = {"command": self.command, "database": self.database or "unknown"}
+        for key, writer in (("report", self.write_json), ("prometheus_file", self.write_prometheus)):
+            if options.get(key):
+                try:
+                    writer(str(options[key]).format(**context))
+                except Exception as e:
+                    logger.warning(f"Failed to write {key.replace('_', ' ')}: {e}")
+
+
+class MeteredReader:
+    """
+    Pass-through reader that adds the time spent waiting for data (and,
+    with count_bytes, the bytes read) to a stage.
+    """
+
+    def __init__(self, source, stage, count_bytes=True):
+        self._source = source
+        self._stage = stage
+        self._count_bytes = count_bytes
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        started = time.monotonic()
+        data = self._source.read(size)
+        self._stage.add(len(data) if self._count_bytes else 0, time.monotonic() - started)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close:
+            close()
+
+
+def current_report():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a stage of the active run report, if there is one"""
+    report = _current.get()
+    if report is None:
+        # Nothing is collecting, the caller can still record into it
+        yield Stage(name)
+        return
+    with report.stage(name) as active:
+        yield active
+
+
+def metered(stream, name, count_bytes=True):
+    """Wrap a stream in a MeteredReader for the active report, if any"""
+    report = _current.get()
+    if report is None:
+        return stream
+    return MeteredReader(stream, report.get_stage(name), count_bytes)
+
+
+def _iso(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path, content):
+    # The textfile collector may read at any moment, never show a partial file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    partial = f"{path}.partial"
+    with open(partial, 'w') as f:
+        f.write(content)
+    os.replace(partial, path)
+
+
+def profile_call(path, func, *args, **kwargs):
+    """
+    Run func under cProfile and dump the stats to `path`, also when it
+    fails. Threads started meanwhile (uploads, compression, job workers)
+    are profiled too and merged into the same file.
+    """
+    import cProfile
+    import pstats
+    import sys
+
+    thread_profilers = []
+
+    def start_thread_profiler(frame, event, arg):
+        # Installed by threading.setprofile() in every new thread, swaps
+        # itself for a real profiler on the thread's first call
+        profiler = cProfile.Profile()
+        thread_profilers.append(profiler)
+        profiler.enable()
+
+    # From 3.12 cProfile sees every thread on its own (sys.monitoring)
+    per_thread = sys.version_info < (3, 12)
+    profiler = cProfile.Profile()
+    if per_thread:
+        threading.setprofile(start_thread_profiler)
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        if per_thread:
+            threading.setprofile(None)
+        stats = pstats.Stats(profiler)
+        for thread_profiler in thread_profilers:
+            try:
+                stats.add(thread_profiler)
+            except TypeError:
+                # Thread still running or never made a call
+                pass
+        stats.dump_stats(path)
+        logger.info(f"Profile written to {path} (inspect with: python -m pstats {path})")
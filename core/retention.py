@@ -0,0 +1,132 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from .catalog import entry_time, forget_backups, read_catalog
+from .dedup import collect_chunks, is_chunked
+from .manifest import manifest_name
+
+logger = logging.getLogger('afterchive')
+
+# Keep rules, a backup is kept if any of them keeps it:
+#   days          backups taken in the last N days
+#   keep_daily    the newest backup of each of the last N days with one
+#   keep_weekly   ... of each of the last N ISO weeks
+#   keep_monthly  ... of each of the last N months
+# max_backups caps what is left at the newest N (alone: keep the last N).
+POLICY_KEYS = ("days", "max_backups", "keep_daily", "keep_weekly", "keep_monthly")
+
+PERIODS = {
+    "keep_daily": lambda taken: taken.strftime("%Y-%m-%d"),
+    "keep_weekly": lambda taken: "%d-W%02d" % taken.isocalendar()[:2],
+    "keep_monthly": lambda taken: taken.strftime("%Y-%m"),
+}
+
+
+def check_policy(policy):
+    policy = {key: value for key, value in (policy or {}).items() if value is not None}
+    unknown = set(policy) - set(POLICY_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown retention setting(s): {', '.join(sorted(unknown))}")
+    for key, value in policy.items():
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            raise ValueError(f"retention.{key} must be a positive whole number, got {value!r}")
+    if not policy:
+        raise ValueError(f"No retention policy, set one of: {', '.join(POLICY_KEYS)}")
+    return policy
+
+
+def select_expired(entries, policy, now=None):
+    """
+    Split the catalog entries of one database into (kept, expired).
+
+    The newest backup is always kept.
+    """
+    now = now or datetime.now(timezone.utc)
+    entries = sorted(entries, key=lambda entry: (entry_time(entry), entry["backup"]), reverse=True)
+    if not entries:
+        return [], []
+
+    keep = set()
+    rules = False
+    if policy.get("days"):
+        rules = True
+        cutoff = now - timedelta(days=policy["days"])
+        keep |= {entry["backup"] for entry in entries if entry_time(entry) >= cutoff}
+    for key, period_of in PERIODS.items():
+        count = policy.get(key)
+        if not count:
+            continue
+        rules = True
+        periods = set()
+        for entry in entries:
+            period = period_of(entry_time(entry))
+            if period not in periods:
+                if len(periods) == count:
+                    break
+                periods.add(period)
+                keep.add(entry["backup"])
+    if not rules:
+        keep = {entry["backup"] for entry in entries}
+    if policy.get("max_backups"):
+        keep = set([entry["backup"] for entry in entries if entry["backup"] in keep][:policy["max_backups"]])
+    keep.add(entries[0]["backup"])
+
+    kept = [entry for entry in entries if entry["backup"] in keep]
+    expired = [entry for entry in entries if entry["backup"] not in keep]
+    return kept, expired
+
+
+def _objects(backup_name):
+    # Directory-format backups are a prefix of objects
+    data = f"{backup_name}/" if backup_name.endswith(".dir") else backup_name
+    return [data, manifest_name(backup_name)]
+
+
+def apply_retention(storage, config, policy, database=None, dry_run=False):
+    """
+    Delete the backups of a storage path that the policy no longer keeps.
+
+    Works from the catalog, each database on its own (or only
+    `database`). The catalog is updated first, so restores never pick
+    a backup that is being deleted. Returns the expired entries.
+    """
+    policy = check_policy(policy)
+    started = time.monotonic()
+    catalog = read_catalog(storage, config)
+
+    by_database = {}
+    for entry in catalog["backups"]:
+        by_database.setdefault(entry.get("database"), []).append(entry)
+    if database is not None:
+        by_database = {database: by_database.get(database, [])}
+
+    expired = []
+    for name, entries in sorted(by_database.items(), key=lambda item: str(item[0])):
+        kept, expiring = select_expired(entries, policy)
+        size = sum(entry.get("size") or 0 for entry in expiring)
+        logger.info(
+            f"Retention for {name}: keeping {len(kept)}, "
+            f"{'would delete' if dry_run else 'deleting'} {len(expiring)} backups ({size / (1024 * 1024):.1f} MB)"
+        )
+        for entry in expiring:
+            logger.info(f"  {'would delete' if dry_run else 'delete'} {entry['backup']} (taken {entry_time(entry):%Y-%m-%d %H:%M})")
+        expired.extend(expiring)
+
+    chunked = [entry["backup"] for entry in expired if is_chunked(entry["backup"])]
+    if dry_run:
+        if chunked:
+            collect_chunks(storage, config, dry_run=True, removed=set(chunked))
+        return expired
+    if not expired:
+        return expired
+
+    names = [entry["backup"] for entry in expired]
+    forget_backups(storage, names, config)
+    failed = storage.delete_objects([name for backup in names for name in _objects(backup)], config)
+    if failed:
+        logger.warning(f"{len(failed)} objects could not be deleted and will be left behind: {', '.join(failed[:10])}")
+    if chunked:
+        collect_chunks(storage, config)
+
+    logger.info(f"Retention deleted {len(expired)} backups in {time.monotonic() - started:.1f}s")
+    return expired
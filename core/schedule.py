@@ -0,0 +1,131 @@
+import datetime
+
+# Standard 5-field cron: minute hour day-of-month month day-of-week
+FIELDS = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),
+]
+
+ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+NAMES = {
+    "month": {name: index + 1 for index, name in enumerate(
+        ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])},
+    "weekday": {name: index for index, name in enumerate(
+        ["sun", "mon", "tue", "wed", "thu", "fri", "sat"])},
+}
+
+# Give up looking for a matching minute after this many years (e.g. "0 0 30 2 *")
+SEARCH_YEARS = 5
+
+
+def _parse_value(value, field):
+    value = value.lower()
+    if value in NAMES.get(field, {}):
+        return NAMES[field][value]
+    return int(value)
+
+
+def _parse_field(text, field, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"Invalid step in cron {field} field: {text}")
+
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = _parse_value(start_text, field), _parse_value(end_text, field)
+        else:
+            start = _parse_value(part, field)
+            # "5/15" means every 15 starting at 5
+            end = high if step > 1 else start
+
+        if not (low <= start <= high and low <= end <= high) or start > end:
+            raise ValueError(f"Cron {field} value out of range ({low}-{high}): {text}")
+        values.update(range(start, end + 1, step))
+
+    if field == "weekday":
+        # Both 0 and 7 are Sunday
+        values = {value % 7 for value in values}
+    return values
+
+
+class CronSchedule:
+    """A cron expression and the times it fires at"""
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != len(FIELDS):
+            raise ValueError(f"Cron expression needs 5 fields (minute hour day month weekday): '{expression}'")
+
+        try:
+            parsed = [
+                _parse_field(text, name, low, high)
+                for text, (name, low, high) in zip(fields, FIELDS)
+            ]
+        except ValueError as e:
+            raise ValueError(f"Invalid cron expression '{expression}': {e}")
+
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        # Like cron: when both day fields are restricted, either may match
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        # Python counts Monday as 0, cron counts Sunday as 0
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def matches(self, moment):
+        return (
+            moment.minute in self.minutes
+            and moment.hour in self.hours
+            and moment.month in self.months
+            and self._day_matches(moment)
+        )
+
+    def next_after(self, moment):
+        """First time strictly after `moment` that the schedule fires"""
+        candidate = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = moment + datetime.timedelta(days=366 * SEARCH_YEARS)
+
+        while candidate <= limit:
+            if candidate.month not in self.months:
+                # Jump to the first day of the next month
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+            else:
+                return candidate
+
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+    def __repr__(self):
+        return f"CronSchedule({self.expression!r})"
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .databases.pg_archive import NeedMoreData, OFFSET_SET, data_ranges, offset_patch, read_toc, select_entries
+from .manifest import manifest_name
+from .utils import remove_local_copy
+
+logger = logging.getLogger('afterchive')
+
+# First read of a custom archive, grown until the whole TOC is in
+TOC_READ_SIZE = 1024 * 1024
+# Data files of a directory archive fetched at once
+FILE_WORKERS = 4
+# Suffixes pg_dump adds to a directory archive's data files
+DATA_FILE_SUFFIXES = ("", ".gz", ".lz4", ".zst")
+
+
+def fetch_selected(storage, config, backup_name, tables=(), schemas=(), local_name=None):
+    """
+    Fetch only what pg_restore -t/-n needs from a custom (.dump) or
+    directory (.dir) backup: the TOC plus the selected tables' data.
+
+    Returns (local path, bytes fetched), or None when the backup can't
+    be read selectively and has to be restored whole. The local copy is
+    named `local_name`, by default like the backup.
+    """
+    started = time.monotonic()
+    temp_dir = tempfile.mkdtemp()
+    path = os.path.join(temp_dir, local_name or backup_name)
+    try:
+        if backup_name.endswith('.dir'):
+            result = _fetch_directory(storage, config, backup_name, path, tables, schemas)
+        else:
+            result = _fetch_custom(storage, config, backup_name, path, tables, schemas)
+    except BaseException:
+        remove_local_copy(path)
+        raise
+    if result is None:
+        remove_local_copy(path)
+        return None
+
+    fetched, detail = result
+    logger.info(
+        f"Fetched {fetched / (1024 * 1024):.1f} MB {detail} of {backup_name} "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return path, fetched
+
+
+def _select(archive, backup_name, tables, schemas):
+    """The selected entries that have data to fetch"""
+    entries = select_entries(archive, tables, schemas)
+    if not entries:
+        wanted = ", ".join([f"table {name}" for name in tables or ()] + [f"schema {name}" for name in schemas or ()])
+        raise ValueError(f"Nothing matches {wanted} in {backup_name}")
+    return [entry for entry in entries if entry.has_data]
+
+
+def _fetch_custom(storage, config, backup_name, path, tables, schemas):
+    size = storage.stat_object(backup_name, config)["size"]
+    # A sparse copy: the TOC and the selected blocks at their own
+    # offsets, so pg_restore seeks exactly as in the full archive
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+    fetched = 0
+    length = min(size, TOC_READ_SIZE)
+    while True:
+        storage.retrieve_ranges(backup_name, [(fetched, length)], path, config)
+        fetched = length
+        with open(path, 'rb') as f:
+            head = f.read(length)
+        try:
+            archive = read_toc(head)
+            break
+        except NeedMoreData:
+            if length >= size:
+                raise ValueError(f"{backup_name} is truncated, its TOC is incomplete")
+            length = min(size, length * 4)
+        except ValueError as e:
+            logger.warning(f"Can't read the TOC of {backup_name} ({e}), restoring from the whole backup")
+            return None
+
+    entries = _select(archive, backup_name, tables, schemas)
+    ranges = data_ranges(archive, entries, size, _recorded_blocks(storage, config, backup_name))
+    if ranges is None:
+        logger.warning(
+            f"{backup_name} has no data offsets (streamed before afterchive indexed "
+            f"archive blocks), restoring from the whole backup"
+        )
+        return None
+
+    # Blocks that start inside the TOC read are already there
+    needed = [(max(start, fetched), end) for _, start, end in ranges if end > fetched]
+    if needed:
+        storage.retrieve_ranges(backup_name, needed, path, config)
+
+    with open(path, 'r+b') as f:
+        for entry, start, _ in ranges:
+            if entry.data_state != OFFSET_SET:
+                position, data = offset_patch(archive, entry, start)
+                f.seek(position)
+                f.write(data)
+
+    fetched += sum(end - start for start, end in needed)
+    return fetched, f"of {size / (1024 * 1024):.1f} MB for {len(entries)} table(s)"
+
+
+def _recorded_blocks(storage, config, backup_name):
+    try:
+        return json.loads(storage.get_object(manifest_name(backup_name), config)).get("blocks")
+    except FileNotFoundError:
+        return None
+
+
+def _fetch_directory(storage, config, backup_name, path, tables, schemas):
+    os.makedirs(path)
+    toc = storage.get_object(f"{backup_name}/toc.dat", config)
+    with open(os.path.join(path, "toc.dat"), 'wb') as f:
+        f.write(toc)
+    try:
+        archive = read_toc(toc)
+    except (NeedMoreData, ValueError) as e:
+        logger.warning(f"Can't read the TOC of {backup_name} ({e}), restoring from the whole backup")
+        return None
+
+    entries = _select(archive, backup_name, tables, schemas)
+    stored = set(storage.list_objects(f"{backup_name}/", config))
+    files = []
+    for entry in entries:
+        candidates = [f"{backup_name}/{entry.filename}{suffix}" for suffix in DATA_FILE_SUFFIXES]
+        name = next((candidate for candidate in candidates if candidate in stored), None)
+        if name is None:
+            raise ValueError(f"Data file {entry.filename} of {entry.tag} is missing from {backup_name}")
+        files.append(name)
+
+    def fetch(name):
+        size = storage.stat_object(name, config)["size"]
+        local_file = os.path.join(path, name[len(backup_name) + 1:])
+        with open(local_file, 'wb') as f:
+            f.truncate(size)
+        if size:
+            storage.retrieve_ranges(name, [(0, size)], local_file, config)
+        return size
+
+    with ThreadPoolExecutor(max_workers=FILE_WORKERS) as pool:
+        fetched = sum(pool.map(fetch, files))
+
+    return fetched + len(toc), f"in {len(files) + 1} of {len(stored)} files"
@@ -1,5 +1,55 @@
+from ..utils import remove_local_copy
+
+
+class ObjectChanged(Exception):
+    """Another writer stored the object since it was read"""
+
+
 class StorageStrategy:
     def store(self, backup_file, config):
         raise NotImplementedError("Store method must be implemented by subclasses.")
     def retrieve(self, backup_file, config):
         raise NotImplementedError("Retrieve method must be implemented by subclasses.")
+    def store_stream(self, stream, backup_name, config):
+        raise NotImplementedError("Streaming store is not supported by this storage backend.")
+    def retrieve_stream(self, backup_name, config):
+        raise NotImplementedError("Streaming retrieve is not supported by this storage backend.")
+    def put_object(self, name, data, config):
+        """Write a small object (bytes) at a path relative to the storage path"""
+        raise NotImplementedError("Object storage is not supported by this storage backend.")
+    def get_object(self, name, config):
+        raise NotImplementedError("Object storage is not supported by this storage backend.")
+    def get_object_version(self, name, config):
+        """An object's bytes and a version for put_object_if(), (None, None) if it does not exist"""
+        raise NotImplementedError("Conditional writes are not supported by this storage backend.")
+    def put_object_if(self, name, data, version, config):
+        """
+        Write an object only if it is still at `version` from
+        get_object_version() (None: only if it does not exist yet).
+        Raises ObjectChanged if another writer got there first.
+        """
+        raise NotImplementedError("Conditional writes are not supported by this storage backend.")
+    def list_objects(self, prefix, config):
+        """Names of the objects under prefix, relative to the storage path"""
+        raise NotImplementedError("Object listing is not supported by this storage backend.")
+    def retrieve_ranges(self, name, ranges, path, config):
+        """Copy [start, end) byte ranges of an object to the same offsets of an existing local file"""
+        raise NotImplementedError("Ranged reads are not supported by this storage backend.")
+    def stat_object(self, name, config):
+        """
+        Metadata of a stored object without reading it: {"size", "crc32c"}
+        (hex, None if the backend keeps none). Raises FileNotFoundError.
+        """
+        raise NotImplementedError("Object metadata is not supported by this storage backend.")
+    def delete_objects(self, names, config):
+        """
+        Delete objects relative to the storage path; a name ending in /
+        deletes everything under it. Missing objects are skipped. Returns
+        the names that could not be deleted.
+        """
+        raise NotImplementedError("Deleting is not supported by this storage backend.")
+    def discard_upload(self, backup_path, config):
+        """Delete what failed store() calls of backup_path left in storage to resume from"""
+    def release(self, path):
+        """Clean up a local path handed out by retrieve() once it has been restored"""
+        remove_local_copy(path)
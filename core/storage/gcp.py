@@ -1,25 +1,86 @@
 from google.cloud import storage
-from .base import StorageStrategy
+from .base import ObjectChanged, StorageStrategy
+import base64
+from ..checkpoints import Checkpoint
+from ..streams import CountingReader, FileSlice, PrefetchReader, parallel_range_reader, hash_file, STREAM_CHUNK_SIZE
 import os
-from google.api_core.exceptions import GoogleAPIError, NotFound, Forbidden
+import requests
+from google.api_core.exceptions import GoogleAPIError, NotFound, Forbidden, PreconditionFailed, ServerError, TooManyRequests, from_http_response
+import google.auth
 from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2 import service_account
 import traceback
 import tempfile
 import logging
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger('afterchive')
 
+# Concurrent transfers for multi-file backups and parallel (part) transfers
+DEFAULT_WORKERS = 8
+# Part size for parallel composite uploads and ranged downloads
+DEFAULT_PART_SIZE_MB = 64
+# GCS accepts at most 32 source objects per compose request
+COMPOSE_LIMIT = 32
+# Deletes sent in one batch request (GCS recommends at most 100)
+DELETE_BATCH_SIZE = 100
+# Resumable upload chunk when chunk_size_mb isn't set; the confirmed
+# offset is checkpointed after every chunk
+RESUMABLE_CHUNK_SIZE = 16 * 1024 * 1024
+# Times a transfer resumes after a dropped connection within one run
+TRANSFER_RETRIES = 5
+TRANSFER_TIMEOUT = 300
+
+# Failures worth resuming after, anything else is final
+_TRANSIENT_ERRORS = (
+    ConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError, ServerError, TooManyRequests,
+)
+
+# Clients by (emulator, project, credentials file), see _get_client()
+_CLIENTS = {}
+# HTTP sessions for resumable upload requests, by the same key, see _get_session()
+_SESSIONS = {}
+_CLIENTS_LOCK = threading.Lock()
+# Scope of the credentials behind the resumable upload sessions
+UPLOAD_SCOPE = "https://www.googleapis.com/auth/devstorage.read_write"
+
+
+class _CheckpointedWriter:
+    """File wrapper that records how far a download got every `every` bytes"""
+
+    def __init__(self, file, offset, checkpoint, every):
+        self._file = file
+        self._checkpoint = checkpoint
+        self._every = every
+        self.offset = self._saved = offset
+
+    def write(self, data):
+        written = self._file.write(data)
+        self.offset += len(data)
+        if self.offset - self._saved >= self._every:
+            self.sync()
+        return written
+
+    def sync(self):
+        # Only bytes that are on disk count as downloaded
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._checkpoint.save(offset=self.offset)
+        self._saved = self.offset
+
+
 class GoogleCloudStorage(StorageStrategy):
 
     def store(self, backup_path, config):
         try:
 
-            if config.get('credentials'):
-                cred_path = config.get('credentials')
-                if not os.path.exists(cred_path):
-                    raise FileNotFoundError(f"Credentials file not found at {cred_path}")
-                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred_path
+            self._check_credentials(config)
 
             # Initialize GCS client
             # client = storage.Client(project=config.get('project'))
@@ -37,15 +98,28 @@ class GoogleCloudStorage(StorageStrategy):
             else:
                 full_gcs_path = filename
 
-            blob = bucket.blob(full_gcs_path)
-
-            blob.upload_from_filename(backup_path)
+            if os.path.isdir(backup_path):
+                # Directory-format dump: one object per file, uploaded concurrently
+                self._store_directory(bucket, backup_path, full_gcs_path, config)
+            elif config.get('parallel') and os.path.getsize(backup_path) > self._part_size(config):
+                self._store_composite(bucket, backup_path, full_gcs_path, config)
+            elif os.path.getsize(backup_path) > self._resumable_chunk_size(config):
+                self._store_resumable(bucket, backup_path, full_gcs_path, config)
+            else:
+                started = time.monotonic()
+                blob = bucket.blob(full_gcs_path, chunk_size=self._chunk_size(config))
+                blob.upload_from_filename(backup_path)
+                self._log_transfer("Uploaded", os.path.getsize(backup_path), 1, 1, started)
             logger.info(f"Backup uploaded to gs://{bucket_name}/{full_gcs_path}")
             
+        # Every failure propagates: callers keep the dump and report the
+        # destination as failed instead of recording a missing object
         except FileNotFoundError as e:
             logger.error(f"File not found error: {e}")
+            raise ValueError(f"Failed to upload to GCS: {e}")
         except PermissionError as e:
             logger.error(f"Authentication or permission error: {e}")
+            raise ValueError(f"Failed to upload to GCS: {e}")
         except Forbidden as e:
             logger.error(f"Permission denied when accessing bucket '{config.get('bucket')}': {e}")
             raise ValueError(f"GCS permission denied. Check your credentials and bucket permissions.")
@@ -55,8 +129,10 @@ class GoogleCloudStorage(StorageStrategy):
 
         except ValueError as e:
             logger.error(f"Configuration error: {e}")
-        except ConnectionError as e:
+            raise
+        except _TRANSIENT_ERRORS as e:
             logger.error(f"Connection error: {e}")
+            raise ValueError(f"Failed to upload to GCS, connection lost: {e}")
         except GoogleAPIError as e:
             logger.error(f"Google API error: {e.message}")
             raise ValueError(f"Failed to upload to GCS: {e}")
@@ -68,11 +144,7 @@ class GoogleCloudStorage(StorageStrategy):
     def retrieve(self, backup_name, config):
         try:
             
-            if config.get('credentials'):
-                cred_path = config.get('credentials')
-                if not os.path.exists(cred_path):
-                    raise FileNotFoundError(f"Credentials file not found at {cred_path}")
-                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred_path
+            self._check_credentials(config)
 
             storage_client = client = self._get_client(config)
             bucket = storage_client.bucket(config.get('bucket'))
@@ -82,10 +154,28 @@ class GoogleCloudStorage(StorageStrategy):
                 else backup_name
             )
 
-            blob = bucket.blob(full_gcs_path)
-            temp_dir = tempfile.mkdtemp()
-            destination_file_name = os.path.join(temp_dir, backup_name)
-            blob.download_to_filename(destination_file_name)
+            if backup_name.endswith('.dir'):
+                destination_file_name = os.path.join(tempfile.mkdtemp(), backup_name)
+                self._retrieve_directory(storage_client, full_gcs_path, destination_file_name, config)
+            else:
+                blob = bucket.blob(full_gcs_path)
+                blob.reload()
+                checkpoint = Checkpoint("download", {
+                    "bucket": bucket.name, "object": full_gcs_path,
+                    "generation": blob.generation, "size": blob.size,
+                })
+                destination_file_name = self._download_path(checkpoint, backup_name)
+                parallel = config.get('parallel') and blob.size > self._part_size(config)
+                if parallel:
+                    self._retrieve_ranges(bucket, blob, destination_file_name, config, checkpoint)
+                else:
+                    started = time.monotonic()
+                    self._download_resumable(bucket, blob, destination_file_name, checkpoint, config)
+                    self._log_transfer("Downloaded", blob.size, 1, 1, started)
+                if checkpoint.state.get("resumed"):
+                    # The client only checks whole-object downloads
+                    self._check_download(blob, destination_file_name, checkpoint)
+                checkpoint.clear()
             logger.info(f"Backup '{backup_name}' downloaded to temporary location: {destination_file_name}")
             return destination_file_name
         except FileNotFoundError as e:
@@ -114,16 +204,702 @@ class GoogleCloudStorage(StorageStrategy):
             traceback.print_exc()
             raise e
 
-    def _get_client(self, config):
-        emulator_host = os.getenv("STORAGE_EMULATOR_HOST")
-        if emulator_host:
-            logger.info(f"Using GCS emulator at {emulator_host}")
-            client = storage.Client(
-                credentials=AnonymousCredentials(),
-                project="test-project-id",
-                client_options={"api_endpoint": emulator_host}
+    def store_stream(self, stream, backup_name, config):
+        """
+        Upload a backup from a readable stream as it is produced.
+
+        Setting a chunk size makes the client use a resumable upload that
+        reads the stream one chunk at a time, so nothing is buffered on
+        disk and the upload runs alongside the dump. If the stream raises
+        before EOF the upload is never finalized and no object is created.
+
+        With `parallel: true` the stream is cut into parts that are
+        uploaded concurrently and composed into the final object.
+        """
+        self._check_credentials(config)
+        with self._api_errors(backup_name, config, upload=True):
+            client = self._get_client(config)
+            bucket_name = config.get('bucket')
+            full_gcs_path = self._blob_path(backup_name, config)
+            bucket = client.bucket(bucket_name)
+
+            if config.get('parallel'):
+                self._store_stream_composite(bucket, stream, full_gcs_path, config)
+            else:
+                started = time.monotonic()
+                blob = bucket.blob(full_gcs_path, chunk_size=self._chunk_size(config) or STREAM_CHUNK_SIZE)
+                # The resumable upload tracks its offset with tell(), which
+                # pipes and queue-fed streams can't answer on their own
+                counter = CountingReader(stream)
+                blob.upload_from_file(counter, rewind=False)
+                self._log_transfer("Uploaded", counter.bytes_read, 1, 1, started)
+        logger.info(f"Backup streamed to gs://{bucket_name}/{full_gcs_path}")
+
+    @contextmanager
+    def retrieve_stream(self, backup_name, config):
+        """
+        Open a backup object as a readable stream.
+
+        Chunks are downloaded ahead on a background thread so the
+        consumer (psql/pg_restore) loads data while the next chunks are
+        still in flight. Nothing is written to local disk.
+        """
+        self._check_credentials(config)
+        with self._api_errors(backup_name, config):
+            client = self._get_client(config)
+            bucket_name = config.get('bucket')
+            full_gcs_path = self._blob_path(backup_name, config)
+
+            bucket = client.bucket(bucket_name)
+            chunk_size = self._chunk_size(config) or STREAM_CHUNK_SIZE
+            blob = bucket.blob(full_gcs_path, chunk_size=chunk_size)
+            # Fail fast on a missing object instead of halfway into psql
+            blob.reload()
+
+            part_size = self._part_size(config)
+            if config.get('parallel') and blob.size > part_size:
+                workers = self._workers(config)
+                reader = parallel_range_reader(
+                    self._range_fetcher(bucket, blob), blob.size, part_size, workers
+                )
+                logger.info(
+                    f"Downloading {-(-blob.size // part_size)} ranges of "
+                    f"{part_size // (1024 * 1024)} MB with {workers} workers"
+                )
+            else:
+                reader = blob.open('rb', chunk_size=chunk_size)
+
+        logger.info(f"Streaming backup from gs://{bucket_name}/{full_gcs_path} ({blob.size} bytes)")
+        stream = PrefetchReader(reader, chunk_size)
+        try:
+            yield stream
+        finally:
+            stream.close()
+            reader.close()
+
+    def put_object(self, name, data, config):
+        with self._api_errors(name, config):
+            self._bucket(config).blob(self._blob_path(name, config)).upload_from_string(data)
+
+    def get_object(self, name, config):
+        with self._api_errors(name, config):
+            try:
+                return self._bucket(config).blob(self._blob_path(name, config)).download_as_bytes()
+            except NotFound:
+                # Same as local storage, callers check for missing objects
+                raise FileNotFoundError(f"Object '{name}' does not exist.")
+
+    def get_object_version(self, name, config):
+        with self._api_errors(name, config):
+            blob = self._bucket(config).blob(self._blob_path(name, config))
+            try:
+                data = blob.download_as_bytes()
+            except NotFound:
+                return None, None
+            return data, blob.generation
+
+    def put_object_if(self, name, data, version, config):
+        with self._api_errors(name, config):
+            try:
+                # Generation 0 matches only a missing object
+                self._bucket(config).blob(self._blob_path(name, config)).upload_from_string(
+                    data, if_generation_match=version or 0)
+            except PreconditionFailed:
+                raise ObjectChanged(f"Object '{name}' changed since it was read.")
+
+    def list_objects(self, prefix, config):
+        root = self._blob_path('', config)
+        with self._api_errors(prefix, config):
+            blobs = self._bucket(config).client.list_blobs(
+                config.get('bucket'), prefix=self._blob_path(prefix, config)
             )
+            return [blob.name[len(root):] for blob in blobs]
+
+    def retrieve_ranges(self, name, ranges, path, config):
+        """Fetch byte ranges as part_size requests, `workers` at a time"""
+        started = time.monotonic()
+        part_size = self._part_size(config)
+        workers = self._workers(config)
+        pieces = [
+            (piece, min(piece + part_size, end))
+            for start, end in ranges
+            for piece in range(start, end, part_size)
+        ]
+        with self._api_errors(name, config):
+            bucket = self._bucket(config)
+            blob = bucket.blob(self._blob_path(name, config))
+            blob.reload()
+            self._download_ranges(bucket, blob, pieces, path, workers)
+        self._log_transfer("Downloaded", sum(end - start for start, end in pieces), len(pieces), workers, started)
+
+    def stat_object(self, name, config):
+        """Size and CRC32C GCS computed for the object, one metadata request"""
+        with self._api_errors(name, config):
+            blob = self._bucket(config).get_blob(self._blob_path(name, config))
+        if blob is None:
+            raise FileNotFoundError(f"Object '{name}' does not exist.")
+        return {
+            "size": blob.size,
+            # GCS reports it base64 encoded, big-endian
+            "crc32c": base64.b64decode(blob.crc32c).hex() if blob.crc32c else None,
+        }
+
+    def delete_objects(self, names, config):
+        """Delete objects in batch requests, `workers` batches at a time"""
+        started = time.monotonic()
+        bucket = self._bucket(config)
+        blob_names = []
+        with self._api_errors('', config):
+            for name in names:
+                if name.endswith('/'):
+                    prefix = self._blob_path(name, config)
+                    blob_names.extend(blob.name for blob in bucket.client.list_blobs(config.get('bucket'), prefix=prefix))
+                else:
+                    blob_names.append(self._blob_path(name, config))
+
+        def delete_batch(batch):
+            try:
+                with bucket.client.batch():
+                    for blob_name in batch:
+                        bucket.delete_blob(blob_name)
+                return []
+            except GoogleAPIError:
+                # A batch only raises its last error (often a harmless
+                # NotFound), redo it one by one to know what failed
+                return [blob_name for blob_name in batch if not self._delete_one(bucket, blob_name)]
+
+        batches = [blob_names[i:i + DELETE_BATCH_SIZE] for i in range(0, len(blob_names), DELETE_BATCH_SIZE)]
+        workers = self._workers(config)
+        failed = []
+        if batches:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for batch_failed in pool.map(delete_batch, batches):
+                    failed.extend(batch_failed)
+        logger.info(
+            f"Deleted {len(blob_names) - len(failed)} objects in {len(batches)} batch(es) "
+            f"with {workers} worker(s): {time.monotonic() - started:.1f}s"
+        )
+        root = self._blob_path('', config)
+        return [blob_name[len(root):] for blob_name in failed]
+
+    def _delete_one(self, bucket, blob_name):
+        try:
+            bucket.delete_blob(blob_name)
+        except NotFound:
+            pass
+        except GoogleAPIError as e:
+            logger.warning(f"Failed to delete gs://{bucket.name}/{blob_name}: {e}")
+            return False
+        return True
+
+    def discard_upload(self, backup_path, config):
+        """
+        Delete the parts and cancel the upload session that failed
+        uploads of a file left for resuming, and forget their checkpoints.
+        """
+        if os.path.isdir(backup_path):
+            return
+        bucket = self._bucket(config)
+        full_gcs_path = self._blob_path(os.path.basename(backup_path), config)
+
+        upload = Checkpoint("upload", self._file_identity(bucket, full_gcs_path, backup_path, self._resumable_chunk_size(config)))
+        session = upload.state.get("session") or upload.stale.get("session")
+        if session:
+            try:
+                # GCS answers a cancelled session with 499
+                self._get_session(config).delete(session, timeout=TRANSFER_TIMEOUT)
+            except _TRANSIENT_ERRORS as e:
+                logger.debug(f"Cancelling the upload session of {full_gcs_path} failed: {e}")
+        upload.clear()
+
+        # Parts of composite uploads, including ones of another part size
+        parts = f"{os.path.basename(backup_path)}.parts/"
+        failed = self.delete_objects([parts], config)
+        if failed:
+            logger.warning(f"Failed to delete the parts under gs://{bucket.name}/{full_gcs_path}.parts/")
+        Checkpoint("parts", self._file_identity(bucket, full_gcs_path, backup_path, self._part_size(config))).clear()
+        logger.info(f"Discarded the interrupted upload of gs://{bucket.name}/{full_gcs_path}")
+
+    def _bucket(self, config):
+        self._check_credentials(config)
+        return self._get_client(config).bucket(config.get('bucket'))
+
+    @contextmanager
+    def _api_errors(self, name, config, upload=False):
+        try:
+            yield
+        except Forbidden as e:
+            logger.error(f"Permission denied when accessing bucket '{config.get('bucket')}': {e}")
+            raise ValueError("GCS permission denied. Check your credentials and bucket permissions.")
+        except NotFound as e:
+            if upload:
+                # Writing an object only fails this way without its bucket
+                logger.error(f"Bucket not found: {e}")
+                raise ValueError(f"GCS bucket '{config.get('bucket')}' does not exist.")
+            raise ValueError(f"Object 'gs://{config.get('bucket')}/{self._blob_path(name, config)}' does not exist.")
+        except GoogleAPIError as e:
+            logger.error(f"Google API error: {e.message}")
+            raise ValueError(f"GCS request failed for {name}: {e}")
+
+    def _store_composite(self, bucket, backup_path, full_gcs_path, config):
+        """
+        Upload a file as parallel parts and compose them into one object.
+
+        Stored parts are checkpointed and left in place if the upload
+        fails, so the next attempt only uploads the missing ones.
+        """
+        started = time.monotonic()
+        size = os.path.getsize(backup_path)
+        part_size = self._part_size(config)
+        workers = self._workers(config)
+        ranges = [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+        part_names = [self._part_name(full_gcs_path, index) for index in range(len(ranges))]
+
+        checkpoint = Checkpoint("parts", self._file_identity(bucket, full_gcs_path, backup_path, part_size))
+        if checkpoint.stale.get("parts"):
+            # Parts of an attempt too old to resume
+            self._delete_quietly(bucket, [part_names[index] for index in checkpoint.stale["parts"]], workers)
+        stored = set(checkpoint.state.get("parts") or [])
+        if stored:
+            logger.info(f"Resuming upload of {full_gcs_path}: {len(stored)} of {len(ranges)} parts already stored")
+        uploaded = size - sum(ranges[index][1] - ranges[index][0] for index in stored)
+
+        def upload(index):
+            if index in stored:
+                return
+            start, end = ranges[index]
+            with FileSlice(backup_path, start, end) as part:
+                bucket.blob(part_names[index]).upload_from_file(part, size=end - start, rewind=False)
+            stored.add(index)
+            checkpoint.save(parts=sorted(stored))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(upload, range(len(ranges))))
+        try:
+            self._compose(bucket, part_names, full_gcs_path, workers)
+        except NotFound:
+            # A part stored by an earlier attempt is gone, start over next time
+            checkpoint.clear()
+            raise
+        self._delete_quietly(bucket, part_names, workers)
+        checkpoint.clear()
+
+        self._log_transfer("Uploaded", uploaded, len(ranges), workers, started)
+
+    def _store_stream_composite(self, bucket, stream, full_gcs_path, config):
+        """
+        Cut a stream into parts, upload them concurrently and compose.
+
+        At most `workers` parts are held in memory at once, so a slow
+        upload slows down reading from the stream instead of growing
+        memory.
+        """
+        started = time.monotonic()
+        part_size = self._part_size(config)
+        workers = self._workers(config)
+        part_names = []
+        total = 0
+
+        data = stream.read(part_size)
+        if len(data) < part_size:
+            # Small enough for a single request, nothing to compose
+            bucket.blob(full_gcs_path).upload_from_string(data)
+            self._log_transfer("Uploaded", len(data), 1, 1, started)
+            return
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                while data:
+                    name = self._part_name(full_gcs_path, len(part_names))
+                    part_names.append(name)
+                    pending.append(pool.submit(bucket.blob(name).upload_from_string, data))
+                    total += len(data)
+                    while len(pending) >= workers:
+                        pending.popleft().result()
+                    data = stream.read(part_size)
+                for future in pending:
+                    future.result()
+
+            self._compose(bucket, part_names, full_gcs_path, workers)
+        finally:
+            self._delete_quietly(bucket, part_names, workers)
+
+        self._log_transfer("Uploaded", total, len(part_names), workers, started)
+
+    def _compose(self, bucket, part_names, destination, workers):
+        """Compose parts into destination, in rounds of COMPOSE_LIMIT sources"""
+        sources = part_names
+        intermediates = []
+        level = 0
+        try:
+            while len(sources) > COMPOSE_LIMIT:
+                groups = [sources[i:i + COMPOSE_LIMIT] for i in range(0, len(sources), COMPOSE_LIMIT)]
+                names = [f"{destination}.parts/compose-{level}-{index:05d}" for index in range(len(groups))]
+                intermediates.extend(names)
+
+                def compose_group(index):
+                    bucket.blob(names[index]).compose([bucket.blob(name) for name in groups[index]])
+
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    list(pool.map(compose_group, range(len(groups))))
+                sources = names
+                level += 1
+
+            bucket.blob(destination).compose([bucket.blob(name) for name in sources])
+        finally:
+            self._delete_quietly(bucket, intermediates, workers)
+
+    def _retrieve_ranges(self, bucket, blob, destination_file_name, config, checkpoint=None):
+        """
+        Download an object as concurrent byte ranges into a preallocated
+        file. With a checkpoint, finished ranges are recorded and skipped
+        when an interrupted download is resumed.
+        """
+        started = time.monotonic()
+        size = blob.size
+        part_size = self._part_size(config)
+        workers = self._workers(config)
+        ranges = [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+
+        done = set()
+        if checkpoint is not None and checkpoint.state.get("part_size") == part_size:
+            done = set(checkpoint.state.get("ranges") or [])
+        if done and os.path.exists(destination_file_name):
+            logger.info(f"Resuming download of {blob.name}: {len(done)} of {len(ranges)} ranges already downloaded")
+            checkpoint.save(resumed=True)
         else:
-            # Use default authentication for production
-            client = storage.Client(project=config.get('project'))
+            done = set()
+            with open(destination_file_name, 'wb') as f:
+                f.truncate(size)
+            if checkpoint is not None:
+                checkpoint.save(part_size=part_size, ranges=[])
+
+        lock = threading.Lock()
+
+        def finished(start, end):
+            if checkpoint is not None:
+                with lock:
+                    done.add(start)
+                    checkpoint.save(ranges=sorted(done))
+
+        pending = [(start, end) for start, end in ranges if start not in done]
+        self._download_ranges(bucket, blob, pending, destination_file_name, workers, finished)
+        self._log_transfer("Downloaded", sum(end - start for start, end in pending), len(ranges), workers, started)
+
+    def _download_ranges(self, bucket, blob, ranges, destination_file_name, workers, finished=None):
+        """Download byte ranges concurrently into the same offsets of a local file"""
+        def download(item):
+            start, end = item
+            # Pin the generation so every range comes from the same object
+            part_blob = bucket.blob(blob.name, generation=blob.generation)
+            for attempt in range(TRANSFER_RETRIES + 1):
+                try:
+                    with open(destination_file_name, 'r+b') as f:
+                        f.seek(start)
+                        part_blob.download_to_file(f, start=start, end=end - 1)
+                        if finished is not None:
+                            f.flush()
+                            os.fsync(f.fileno())
+                    break
+                except _TRANSIENT_ERRORS as e:
+                    if attempt == TRANSFER_RETRIES:
+                        raise
+                    self._wait_to_retry(f"bytes {start}-{end - 1} of {blob.name}", e, attempt)
+            if finished is not None:
+                finished(start, end)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(download, ranges))
+
+    def _store_resumable(self, bucket, backup_path, full_gcs_path, config):
+        """
+        Upload a file through a resumable upload session, one chunk per
+        request. The session URI and the offset GCS confirmed are
+        checkpointed after every chunk, so a dropped connection (in this
+        run or a killed one) resumes from there instead of byte zero.
+        """
+        started = time.monotonic()
+        size = os.path.getsize(backup_path)
+        chunk_size = self._resumable_chunk_size(config)
+        transport = self._get_session(config)
+        checkpoint = Checkpoint("upload", self._file_identity(bucket, full_gcs_path, backup_path, chunk_size))
+
+        session = checkpoint.state.get("session")
+        offset = self._upload_status(transport, session, size) if session else None
+        if offset is None:
+            session = bucket.blob(full_gcs_path).create_resumable_upload_session(size=size)
+            offset = 0
+            checkpoint.save(session=session, offset=0)
+        else:
+            logger.info(f"Resuming upload of {full_gcs_path} at {offset / (1024 * 1024):.1f} of {size / (1024 * 1024):.1f} MB")
+        resumed_at = offset
+
+        attempt = 0
+        with open(backup_path, 'rb') as f:
+            while offset < size:
+                f.seek(offset)
+                data = f.read(chunk_size)
+                try:
+                    response = transport.put(
+                        session, data=data, timeout=TRANSFER_TIMEOUT,
+                        headers={"Content-Range": f"bytes {offset}-{offset + len(data) - 1}/{size}"},
+                    )
+                    offset = self._confirmed_offset(response, size)
+                except _TRANSIENT_ERRORS as e:
+                    if attempt == TRANSFER_RETRIES:
+                        raise
+                    self._wait_to_retry(f"upload of {full_gcs_path}", e, attempt)
+                    attempt += 1
+                    # Only GCS knows how much of the failed chunk arrived
+                    offset = self._upload_status(transport, session, size)
+                    if offset is None:
+                        checkpoint.clear()
+                        raise ValueError(f"The upload session of {full_gcs_path} expired")
+                    continue
+                attempt = 0
+                checkpoint.save(offset=offset)
+        checkpoint.clear()
+        self._log_transfer("Uploaded", size - resumed_at, -(-size // chunk_size), 1, started)
+
+    def _upload_status(self, transport, session, size):
+        """Bytes GCS has of a resumable upload, None if the session is gone"""
+        try:
+            response = transport.put(
+                session, timeout=TRANSFER_TIMEOUT, headers={"Content-Range": f"bytes */{size}"}
+            )
+        except _TRANSIENT_ERRORS as e:
+            logger.debug(f"Upload status query failed: {e}")
+            return None
+        if response.status_code in (404, 410):
+            return None
+        return self._confirmed_offset(response, size)
+
+    def _confirmed_offset(self, response, size):
+        if response.status_code in (200, 201):
+            return size
+        if response.status_code == 308:
+            # Range: bytes=0-<last byte received>, absent if none were
+            received = response.headers.get("Range")
+            return int(received.rsplit("-", 1)[1]) + 1 if received else 0
+        raise from_http_response(response)
+
+    def _download_resumable(self, bucket, blob, destination_file_name, checkpoint, config):
+        """
+        Download an object into a file, checkpointing the offset written
+        to disk every part_size bytes; resumes from there after a dropped
+        connection or a killed run.
+        """
+        offset = checkpoint.state.get("offset", 0)
+        if offset and not (os.path.exists(destination_file_name) and os.path.getsize(destination_file_name) >= offset):
+            offset = 0
+        if offset:
+            logger.info(f"Resuming download of {blob.name} at {offset / (1024 * 1024):.1f} of {blob.size / (1024 * 1024):.1f} MB")
+            checkpoint.save(resumed=True)
+        # Pin the generation so a resumed download reads the same object
+        pinned = bucket.blob(blob.name, generation=blob.generation)
+
+        attempt = 0
+        while True:
+            with open(destination_file_name, 'r+b' if offset else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+                writer = _CheckpointedWriter(f, offset, checkpoint, self._part_size(config))
+                try:
+                    if offset < blob.size:
+                        # No range on a fresh download, so the client checks the whole object
+                        pinned.download_to_file(writer, start=offset or None)
+                    return
+                except _TRANSIENT_ERRORS as e:
+                    if attempt == TRANSFER_RETRIES:
+                        raise
+                    self._wait_to_retry(f"download of {blob.name}", e, attempt)
+                    attempt += 1
+                finally:
+                    writer.sync()
+            offset = writer.offset
+            checkpoint.save(resumed=True)
+
+    def _check_download(self, blob, destination_file_name, checkpoint):
+        """Compare a resumed download with the CRC32C GCS keeps for the object"""
+        expected = base64.b64decode(blob.crc32c).hex() if blob.crc32c else None
+        actual = hash_file(destination_file_name)["crc32c"] if expected else None
+        if actual is not None and actual != expected:
+            checkpoint.clear()
+            os.remove(destination_file_name)
+            raise ValueError(f"Resumed download of {blob.name} doesn't match its CRC32C, it will start over next time")
+
+    def _download_path(self, checkpoint, backup_name):
+        """Where to download: the partial file of an interrupted attempt, if any"""
+        path = checkpoint.state.get("path")
+        if path and os.path.exists(path):
+            return path
+        path = os.path.join(tempfile.mkdtemp(), backup_name)
+        checkpoint.save(path=path, offset=0, ranges=[])
+        return path
+
+    def _file_identity(self, bucket, full_gcs_path, backup_path, piece_size):
+        stat = os.stat(backup_path)
+        return {
+            "bucket": bucket.name, "object": full_gcs_path, "file": os.path.abspath(backup_path),
+            "size": stat.st_size, "mtime": stat.st_mtime_ns, "piece_size": piece_size,
+        }
+
+    def _wait_to_retry(self, what, error, attempt):
+        delay = min(2 ** attempt, 30)
+        logger.warning(f"{what} interrupted ({error}), resuming in {delay}s")
+        time.sleep(delay)
+
+    def _range_fetcher(self, bucket, blob):
+        def fetch(start, end):
+            part_blob = bucket.blob(blob.name, generation=blob.generation)
+            return part_blob.download_as_bytes(start=start, end=end - 1)
+        return fetch
+
+    def _delete_quietly(self, bucket, names, workers):
+        def delete(name):
+            try:
+                bucket.blob(name).delete()
+            except NotFound:
+                pass
+            except GoogleAPIError as e:
+                logger.warning(f"Failed to delete temporary object {name}: {e}")
+
+        if names:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(delete, names))
+
+    def _part_name(self, full_gcs_path, index):
+        return f"{full_gcs_path}.parts/{index:05d}"
+
+    def _log_transfer(self, action, nbytes, parts, workers, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        mb = nbytes / (1024 * 1024)
+        logger.info(
+            f"{action} {mb:.1f} MB in {parts} part(s) with {workers} worker(s): "
+            f"{elapsed:.1f}s, {mb / elapsed:.1f} MB/s"
+        )
+
+    def _store_directory(self, bucket, local_dir, gcs_prefix, config):
+        """Upload every file of a directory-format dump in parallel"""
+        uploads = []
+        for root, _, files in os.walk(local_dir):
+            for name in files:
+                local_file = os.path.join(root, name)
+                relative = os.path.relpath(local_file, local_dir).replace(os.sep, '/')
+                uploads.append((local_file, f"{gcs_prefix}/{relative}"))
+
+        def upload(item):
+            local_file, blob_name = item
+            bucket.blob(blob_name).upload_from_filename(local_file)
+
+        workers = self._workers(config)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # list() re-raises the first failed upload
+            list(pool.map(upload, uploads))
+        logger.info(f"Uploaded {len(uploads)} files with {workers} workers")
+
+    def _retrieve_directory(self, client, gcs_prefix, local_dir, config):
+        """Download every object under a directory-format dump in parallel"""
+        blobs = list(client.list_blobs(config.get('bucket'), prefix=f"{gcs_prefix}/"))
+        if not blobs:
+            raise NotFound(f"No objects found under gs://{config.get('bucket')}/{gcs_prefix}/")
+
+        def download(blob):
+            relative = blob.name[len(gcs_prefix) + 1:]
+            local_file = os.path.join(local_dir, *relative.split('/'))
+            os.makedirs(os.path.dirname(local_file), exist_ok=True)
+            blob.download_to_filename(local_file)
+
+        workers = self._workers(config)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(download, blobs))
+        logger.info(f"Downloaded {len(blobs)} files with {workers} workers")
+
+    def _workers(self, config):
+        return int(config.get('workers') or DEFAULT_WORKERS)
+
+    def _part_size(self, config):
+        return int(float(config.get('part_size_mb') or DEFAULT_PART_SIZE_MB) * 1024 * 1024)
+
+    def _resumable_chunk_size(self, config):
+        return self._chunk_size(config) or RESUMABLE_CHUNK_SIZE
+
+    def _chunk_size(self, config):
+        """Resumable upload chunk size from config, None for the client default"""
+        chunk_size_mb = config.get('chunk_size_mb')
+        if not chunk_size_mb:
+            return None
+        # Chunks must be a multiple of 256 KiB
+        return max(1, round(float(chunk_size_mb) * 4)) * 256 * 1024
+
+    def _check_credentials(self, config):
+        cred_path = config.get('credentials')
+        if cred_path and not os.path.exists(cred_path):
+            raise FileNotFoundError(f"Credentials file not found at {cred_path}")
+
+    def _blob_path(self, backup_name, config):
+        path = config.get('path') or ''
+        if path:
+            return f"{path.strip('/')}/{backup_name}"
+        return backup_name
+
+    def _client_key(self, config):
+        return (os.getenv("STORAGE_EMULATOR_HOST"), config.get('project'), config.get('credentials'))
+
+    def _get_session(self, config):
+        """
+        Authorized HTTP session for the chunk and status requests of
+        resumable uploads, which the client library has no public call
+        for. It gets its own credentials the way the client does (the
+        emulator needs none), rather than borrowing the client's private
+        transport, and is shared the same way.
+        """
+        key = self._client_key(config)
+        emulator_host, _, cred_path = key
+        with _CLIENTS_LOCK:
+            session = _SESSIONS.get(key)
+            if session is None:
+                if emulator_host:
+                    credentials = AnonymousCredentials()
+                elif cred_path:
+                    credentials = service_account.Credentials.from_service_account_file(
+                        cred_path, scopes=[UPLOAD_SCOPE])
+                else:
+                    credentials, _ = google.auth.default(scopes=[UPLOAD_SCOPE])
+                session = _SESSIONS[key] = AuthorizedSession(credentials)
+        return session
+
+    def _get_client(self, config):
+        """
+        Shared client for this project and credentials.
+
+        Building a client loads credentials and opens a new HTTP session,
+        so it is done once per process: the daemon, run-jobs and chunked
+        backups all reuse warm clients instead of paying for it per call.
+        The credentials file is read per job, never through the process
+        environment, so jobs on other threads keep their own.
+        """
+        key = self._client_key(config)
+        emulator_host, _, cred_path = key
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+            if client is not None:
+                return client
+
+            if emulator_host:
+                logger.info(f"Using GCS emulator at {emulator_host}")
+                client = storage.Client(
+                    credentials=AnonymousCredentials(),
+                    project="test-project-id",
+                    client_options={"api_endpoint": emulator_host}
+                )
+            elif cred_path:
+                # Without a project, the one in the key file is used
+                project = {'project': config['project']} if config.get('project') else {}
+                client = storage.Client.from_service_account_json(cred_path, **project)
+            else:
+                # Use default authentication for production
+                client = storage.Client(project=config.get('project'))
+            _CLIENTS[key] = client
         return client
@@ -1,40 +1,311 @@
-from .base import StorageStrategy
+from .base import ObjectChanged, StorageStrategy
+import errno
 import os
-import subprocess
-import sys
-import tempfile
+import shutil
 import logging
+import time
+from contextlib import contextmanager
+from ..streams import STREAM_CHUNK_SIZE
+from ..utils import remove_local_copy
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger('afterchive')
 
+# Linux ioctl that makes dst share src's extents (reflink) on btrfs/XFS
+FICLONE = 0x40049409
+# Errors that mean "this copy mechanism isn't available here, try the next one"
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF}
+# Conditional writes hold a lock file next to the object for a moment;
+# one older than this was left by a process that died holding it
+OBJECT_LOCK_MAX_AGE = 60
+
+
+def _copy_with(copy_call, src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        count = copy_call(src_fd, dst_fd, copied, min(size - copied, 1 << 30))
+        if count == 0:
+            break
+        copied += count
+    return copied
+
+
+def _copy_file(src, dst):
+    """
+    Copy a file without pulling its data through Python.
+
+    Tries, in order: a reflink (no data is written at all),
+    copy_file_range (in-kernel copy, server-side on NFS 4.2), sendfile,
+    and finally a plain buffered copy. Returns the mechanism used.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(src_fd).st_size
+
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                return "reflink"
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+
+        candidates = []
+        if hasattr(os, 'copy_file_range'):
+            candidates.append(("copy_file_range", lambda i, o, off, n: os.copy_file_range(i, o, n, off, off)))
+        if hasattr(os, 'sendfile'):
+            candidates.append(("sendfile", lambda i, o, off, n: os.sendfile(o, i, off, n)))
+
+        for method, copy_call in candidates:
+            try:
+                # Explicit offsets, so a failed attempt leaves nothing to rewind
+                if _copy_with(copy_call, src_fd, dst_fd, size) == size:
+                    return method
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+            os.ftruncate(dst_fd, 0)
+
+        fsrc.seek(0)
+        fdst.seek(0)
+        shutil.copyfileobj(fsrc, fdst, STREAM_CHUNK_SIZE)
+        return "buffered"
+
+
+def _copy_tree(src, dst):
+    methods = set()
+
+    def copy_function(s, d):
+        methods.add(_copy_file(s, d))
+
+    shutil.copytree(src, dst, copy_function=copy_function)
+    return ", ".join(sorted(methods)) or "empty"
+
+
 class LocalStorage(StorageStrategy):
+    def __init__(self):
+        # Stored backups handed out by retrieve() to be read in place
+        self._in_place = set()
+
     def store(self, backup_path, config):
         # /local/path/
         destination = config.get('path', None)
         try:
             os.makedirs(destination, exist_ok=True)
             dest_file = os.path.join(destination, os.path.basename(backup_path))
-            subprocess.run(['cp', backup_path, dest_file], check=True)
-            logger.info(f"Backup stored at {dest_file}")
+            partial_file = f"{dest_file}.partial"
+
+            # Copy in-process under a temporary name, then rename into place
+            try:
+                if os.path.isdir(backup_path):
+                    method = _copy_tree(backup_path, partial_file)
+                else:
+                    method = _copy_file(backup_path, partial_file)
+                os.replace(partial_file, dest_file)
+            except Exception:
+                remove_local_copy(partial_file)
+                raise
+
+            logger.info(f"Backup stored at {dest_file} ({method})")
             
         except Exception as e:
-            logger.info(f"Failed to store backup: {e}")
-            sys.exit(1)
+            logger.error(f"Failed to store backup: {e}")
+            raise
 
     def retrieve(self, backup_name, config):
+        """
+        Return the stored backup's own path.
+
+        psql and pg_restore only read the file, so there is no need to copy
+        it first; release() knows not to delete it afterwards.
+        """
         directory = config.get('path', None)
         backup_path = os.path.join(directory, os.path.basename(backup_name))
 
         if os.path.exists(backup_path):
-            logger.info(f"'{backup_name}' exists.")
-            temp_dir = tempfile.mkdtemp()
-
-            subprocess.run(['cp', backup_path, temp_dir], check=True)
-            temp_backup_path = os.path.join(temp_dir, os.path.basename(backup_name))
-            logger.info(f"Backup copied to temporary location: {temp_backup_path}")
-            return temp_backup_path
+            logger.info(f"'{backup_name}' exists, restoring from it in place.")
+            self._in_place.add(backup_path)
+            return backup_path
         else:
             raise FileNotFoundError(f"Backup file '{backup_name}' does not exist.")
 
-        
\ No newline at end of file
+    def release(self, path):
+        if path in self._in_place:
+            self._in_place.discard(path)
+            return
+        super().release(path)
+
+    def store_stream(self, stream, backup_name, config):
+        """
+        Write a backup from a readable stream, chunk by chunk.
+
+        Data lands in a '.partial' file that is only renamed into place
+        once the stream reaches EOF cleanly, so a failed dump never leaves
+        something that looks like a complete backup.
+        """
+        destination = config.get('path', None)
+        if not destination:
+            raise ValueError("Local storage requires a 'path'")
+
+        os.makedirs(destination, exist_ok=True)
+        dest_file = os.path.join(destination, os.path.basename(backup_name))
+        partial_file = f"{dest_file}.partial"
+
+        try:
+            with open(partial_file, 'wb') as out:
+                shutil.copyfileobj(stream, out, STREAM_CHUNK_SIZE)
+            os.replace(partial_file, dest_file)
+        except Exception:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            raise
+
+        logger.info(f"Backup streamed to {dest_file}")
+
+    @contextmanager
+    def retrieve_stream(self, backup_name, config):
+        """Open the stored backup for reading in place, no temp copy"""
+        directory = config.get('path', None)
+        backup_path = os.path.join(directory, os.path.basename(backup_name))
+
+        if not os.path.exists(backup_path):
+            raise FileNotFoundError(f"Backup file '{backup_name}' does not exist.")
+
+        logger.info(f"Streaming backup from {backup_path}")
+        with open(backup_path, 'rb') as stream:
+            yield stream
+
+    def put_object(self, name, data, config):
+        object_path = self._object_path(name, config)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        partial_file = f"{object_path}.partial"
+        try:
+            with open(partial_file, 'wb') as out:
+                out.write(data)
+            os.replace(partial_file, object_path)
+        except Exception:
+            remove_local_copy(partial_file)
+            raise
+
+    def get_object(self, name, config):
+        object_path = self._object_path(name, config)
+        if not os.path.exists(object_path):
+            raise FileNotFoundError(f"Object '{name}' does not exist.")
+        with open(object_path, 'rb') as f:
+            return f.read()
+
+    def get_object_version(self, name, config):
+        try:
+            with open(self._object_path(name, config), 'rb') as f:
+                return f.read(), self._version(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            return None, None
+
+    def put_object_if(self, name, data, version, config):
+        object_path = self._object_path(name, config)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        with self._object_lock(object_path):
+            try:
+                current = self._version(os.stat(object_path))
+            except FileNotFoundError:
+                current = None
+            if current != version:
+                raise ObjectChanged(f"Object '{name}' changed since it was read.")
+            self.put_object(name, data, config)
+
+    def _version(self, stat):
+        # put_object() replaces the file, so every write is a new inode
+        return f"{stat.st_ino}-{stat.st_mtime_ns}"
+
+    @contextmanager
+    def _object_lock(self, object_path):
+        """Lock file shared with other processes, created with O_EXCL"""
+        lock_file = f"{object_path}.lock"
+        while True:
+            try:
+                os.close(os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(lock_file)
+                except FileNotFoundError:
+                    continue
+                if age > OBJECT_LOCK_MAX_AGE:
+                    logger.warning(f"Removing the stale lock file {lock_file}")
+                    try:
+                        os.remove(lock_file)
+                    except FileNotFoundError:
+                        pass
+                else:
+                    time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.remove(lock_file)
+
+    def list_objects(self, prefix, config):
+        root = config.get('path', None)
+        names = []
+        for directory, _, files in os.walk(self._object_path(prefix, config)):
+            for filename in files:
+                if filename.endswith(('.partial', '.lock')):
+                    continue
+                relative = os.path.relpath(os.path.join(directory, filename), root)
+                names.append(relative.replace(os.sep, '/'))
+        return names
+
+    def retrieve_ranges(self, name, ranges, path, config):
+        source = self._object_path(name, config)
+        if not os.path.isfile(source):
+            raise FileNotFoundError(f"Object '{name}' does not exist.")
+        with open(source, 'rb') as src, open(path, 'r+b') as dst:
+            for start, end in ranges:
+                src.seek(start)
+                dst.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    data = src.read(min(remaining, STREAM_CHUNK_SIZE))
+                    if not data:
+                        break
+                    dst.write(data)
+                    remaining -= len(data)
+
+    def stat_object(self, name, config):
+        path = self._object_path(name, config)
+        if os.path.isdir(path):
+            size = sum(
+                os.path.getsize(os.path.join(root, filename))
+                for root, _, files in os.walk(path)
+                for filename in files
+            )
+        elif os.path.exists(path):
+            size = os.path.getsize(path)
+        else:
+            raise FileNotFoundError(f"Object '{name}' does not exist.")
+        return {"size": size, "crc32c": None}
+
+    def delete_objects(self, names, config):
+        failed = []
+        for name in names:
+            path = self._object_path(name, config)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to delete {path}: {e}")
+                failed.append(name)
+        return failed
+
+    def _object_path(self, name, config):
+        directory = config.get('path', None)
+        if not directory:
+            raise ValueError("Local storage requires a 'path'")
+        return os.path.join(directory, *name.strip('/').split('/'))
@@ -0,0 +1,618 @@
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
+from botocore.exceptions import ConnectionError as BotoConnectionError, IncompleteReadError, ReadTimeoutError
+from .base import ObjectChanged, StorageStrategy
+from ..checkpoints import Checkpoint
+from ..streams import FileSlice, PrefetchReader, parallel_range_reader, read_full, STREAM_CHUNK_SIZE
+import os
+import tempfile
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+logger = logging.getLogger('afterchive')
+
+# Concurrent transfers for multi-file backups and multipart (part) transfers
+DEFAULT_WORKERS = 8
+# Part size for multipart uploads and ranged downloads
+DEFAULT_PART_SIZE_MB = 64
+# S3 limits: every part but the last is at least 5 MiB, at most 10000 parts
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+# A stream's size isn't known up front, so its part size doubles every
+# this many parts to stay under MAX_PARTS
+PARTS_PER_SIZE = 1000
+# Keys per DeleteObjects request, the S3 maximum
+DELETE_BATCH_SIZE = 1000
+# Times a ranged download resumes after a dropped connection; the client
+# retries failed requests on its own as well
+TRANSFER_RETRIES = 5
+
+# Failures worth resuming after, anything else is final
+_TRANSIENT_ERRORS = (ConnectionError, BotoConnectionError, IncompleteReadError, ReadTimeoutError)
+
+# Clients by (endpoint, region, profile, credentials file, pool size), see _get_client()
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+class S3Storage(StorageStrategy):
+    """
+    Amazon S3 and S3-compatible object stores (MinIO, Ceph, R2...).
+
+    Uploads larger than a part are multipart uploads sending part_size_mb
+    parts on `workers` threads; downloads fetch byte ranges the same way.
+    All threads share one client, so parts reuse its pooled connections.
+    """
+
+    def store(self, backup_path, config):
+        client = self._get_client(config)
+        bucket = config.get('bucket')
+        key = self._key(os.path.basename(backup_path), config)
+        with self._api_errors(os.path.basename(backup_path), config):
+            if os.path.isdir(backup_path):
+                # Directory-format dump: one object per file, uploaded concurrently
+                self._store_directory(client, backup_path, key, config)
+            elif os.path.getsize(backup_path) > self._part_size(config):
+                self._store_multipart(client, backup_path, key, config)
+            else:
+                started = time.monotonic()
+                with open(backup_path, 'rb') as f:
+                    client.put_object(Bucket=bucket, Key=key, Body=f)
+                self._log_transfer("Uploaded", os.path.getsize(backup_path), 1, 1, started)
+        logger.info(f"Backup uploaded to s3://{bucket}/{key}")
+
+    def retrieve(self, backup_name, config):
+        client = self._get_client(config)
+        key = self._key(backup_name, config)
+        with self._api_errors(backup_name, config):
+            if backup_name.endswith('.dir'):
+                destination_file_name = os.path.join(tempfile.mkdtemp(), backup_name)
+                self._retrieve_directory(client, key, destination_file_name, config)
+            else:
+                head = client.head_object(Bucket=config.get('bucket'), Key=key)
+                checkpoint = Checkpoint("download", {
+                    "bucket": config.get('bucket'), "object": key,
+                    "etag": head["ETag"], "size": head["ContentLength"],
+                })
+                destination_file_name = self._download_path(checkpoint, backup_name)
+                self._retrieve_ranges(client, key, head, destination_file_name, config, checkpoint)
+                checkpoint.clear()
+        logger.info(f"Backup '{backup_name}' downloaded to temporary location: {destination_file_name}")
+        return destination_file_name
+
+    def store_stream(self, stream, backup_name, config):
+        """
+        Upload a backup from a readable stream as it is produced.
+
+        The stream is cut into parts that are uploaded concurrently while
+        the dump goes on. At most `workers` parts are held in memory, so a
+        slow upload slows down reading from the stream instead of growing
+        memory. If anything fails the multipart upload is aborted and no
+        object is created.
+        """
+        client = self._get_client(config)
+        bucket = config.get('bucket')
+        key = self._key(backup_name, config)
+        started = time.monotonic()
+        part_size = self._part_size(config)
+        workers = self._workers(config)
+
+        with self._api_errors(backup_name, config):
+            data = read_full(stream, part_size)
+            if len(data) < part_size:
+                # Small enough for a single request
+                client.put_object(Bucket=bucket, Key=key, Body=data)
+                self._log_transfer("Uploaded", len(data), 1, 1, started)
+                logger.info(f"Backup streamed to s3://{bucket}/{key}")
+                return
+
+            upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+            parts = []
+            total = 0
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    pending = deque()
+                    while data:
+                        number = len(pending) + len(parts) + 1
+                        pending.append(pool.submit(self._upload_part, client, bucket, key, upload_id, number, data))
+                        total += len(data)
+                        while len(pending) >= workers:
+                            parts.append(pending.popleft().result())
+                        if number % PARTS_PER_SIZE == 0:
+                            part_size *= 2
+                        data = read_full(stream, part_size)
+                    while pending:
+                        parts.append(pending.popleft().result())
+                client.complete_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+                )
+            except BaseException:
+                self._abort_quietly(client, bucket, key, upload_id)
+                raise
+
+        self._log_transfer("Uploaded", total, len(parts), workers, started)
+        logger.info(f"Backup streamed to s3://{bucket}/{key}")
+
+    @contextmanager
+    def retrieve_stream(self, backup_name, config):
+        """
+        Open a backup object as a readable stream.
+
+        Objects larger than a part are fetched as concurrent byte ranges
+        (`parallel: false` turns that off), read ahead of the consumer.
+        Nothing is written to local disk.
+        """
+        client = self._get_client(config)
+        bucket = config.get('bucket')
+        key = self._key(backup_name, config)
+        with self._api_errors(backup_name, config):
+            # Fail fast on a missing object instead of halfway into psql
+            head = client.head_object(Bucket=bucket, Key=key)
+            size = head["ContentLength"]
+            part_size = self._part_size(config)
+            if config.get('parallel', True) and size > part_size:
+                workers = self._workers(config)
+                reader = parallel_range_reader(self._range_fetcher(client, key, head, config), size, part_size, workers)
+                logger.info(
+                    f"Downloading {-(-size // part_size)} ranges of "
+                    f"{part_size // (1024 * 1024)} MB with {workers} workers"
+                )
+            else:
+                reader = client.get_object(Bucket=bucket, Key=key, IfMatch=head["ETag"])["Body"]
+
+        logger.info(f"Streaming backup from s3://{bucket}/{key} ({size} bytes)")
+        stream = PrefetchReader(reader, STREAM_CHUNK_SIZE)
+        try:
+            yield stream
+        finally:
+            stream.close()
+            reader.close()
+
+    def put_object(self, name, data, config):
+        with self._api_errors(name, config):
+            self._get_client(config).put_object(Bucket=config.get('bucket'), Key=self._key(name, config), Body=data)
+
+    def get_object(self, name, config):
+        with self._api_errors(name, config):
+            try:
+                response = self._get_client(config).get_object(Bucket=config.get('bucket'), Key=self._key(name, config))
+            except ClientError as e:
+                if self._error_code(e) in ("NoSuchKey", "404"):
+                    # Same as local storage, callers check for missing objects
+                    raise FileNotFoundError(f"Object '{name}' does not exist.")
+                raise
+            with response["Body"] as body:
+                return body.read()
+
+    def get_object_version(self, name, config):
+        with self._api_errors(name, config):
+            try:
+                response = self._get_client(config).get_object(Bucket=config.get('bucket'), Key=self._key(name, config))
+            except ClientError as e:
+                if self._error_code(e) in ("NoSuchKey", "404"):
+                    return None, None
+                raise
+            with response["Body"] as body:
+                return body.read(), response["ETag"]
+
+    def put_object_if(self, name, data, version, config):
+        condition = {"IfMatch": version} if version else {"IfNoneMatch": "*"}
+        with self._api_errors(name, config):
+            try:
+                self._get_client(config).put_object(
+                    Bucket=config.get('bucket'), Key=self._key(name, config), Body=data, **condition)
+            except ClientError as e:
+                # 409: a concurrent conditional write to the same key
+                if self._error_code(e) in ("PreconditionFailed", "412", "ConditionalRequestConflict", "409"):
+                    raise ObjectChanged(f"Object '{name}' changed since it was read.")
+                raise
+
+    def list_objects(self, prefix, config):
+        root = self._key('', config)
+        with self._api_errors(prefix, config):
+            return [key[len(root):] for key in self._list_keys(self._get_client(config), self._key(prefix, config), config)]
+
+    def retrieve_ranges(self, name, ranges, path, config):
+        """Fetch byte ranges as part_size requests, `workers` at a time"""
+        started = time.monotonic()
+        part_size = self._part_size(config)
+        workers = self._workers(config)
+        pieces = [
+            (piece, min(piece + part_size, end))
+            for start, end in ranges
+            for piece in range(start, end, part_size)
+        ]
+        client = self._get_client(config)
+        key = self._key(name, config)
+        with self._api_errors(name, config):
+            head = client.head_object(Bucket=config.get('bucket'), Key=key)
+            self._download_ranges(client, key, head, pieces, path, config)
+        self._log_transfer("Downloaded", sum(end - start for start, end in pieces), len(pieces), workers, started)
+
+    def stat_object(self, name, config):
+        """Size of the object, one HEAD request (S3 keeps no CRC32C of it by default)"""
+        with self._api_errors(name, config):
+            try:
+                head = self._get_client(config).head_object(Bucket=config.get('bucket'), Key=self._key(name, config))
+            except ClientError as e:
+                if self._error_code(e) in ("NoSuchKey", "404"):
+                    raise FileNotFoundError(f"Object '{name}' does not exist.")
+                raise
+        return {"size": head["ContentLength"], "crc32c": None}
+
+    def delete_objects(self, names, config):
+        """Delete objects in DeleteObjects requests, `workers` batches at a time"""
+        started = time.monotonic()
+        client = self._get_client(config)
+        bucket = config.get('bucket')
+        keys = []
+        with self._api_errors('', config):
+            for name in names:
+                if name.endswith('/'):
+                    keys.extend(self._list_keys(client, self._key(name, config), config))
+                else:
+                    keys.append(self._key(name, config))
+
+        def delete_batch(batch):
+            try:
+                response = client.delete_objects(
+                    Bucket=bucket, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+                )
+            except (BotoCoreError, ClientError) as e:
+                logger.warning(f"Failed to delete {len(batch)} objects from s3://{bucket}: {e}")
+                return batch
+            errors = response.get("Errors") or []
+            for error in errors:
+                logger.warning(f"Failed to delete s3://{bucket}/{error.get('Key')}: {error.get('Message')}")
+            return [error.get("Key") for error in errors]
+
+        batches = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+        workers = self._workers(config)
+        failed = []
+        if batches:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for batch_failed in pool.map(delete_batch, batches):
+                    failed.extend(batch_failed)
+        logger.info(
+            f"Deleted {len(keys) - len(failed)} objects in {len(batches)} batch(es) "
+            f"with {workers} worker(s): {time.monotonic() - started:.1f}s"
+        )
+        root = self._key('', config)
+        return [key[len(root):] for key in failed]
+
+    def discard_upload(self, backup_path, config):
+        """Abort the multipart upload failed uploads of a file left open for resuming"""
+        if os.path.isdir(backup_path):
+            return
+        client = self._get_client(config)
+        bucket = config.get('bucket')
+        key = self._key(os.path.basename(backup_path), config)
+        part_size = self._part_size(config, os.path.getsize(backup_path))
+        checkpoint = Checkpoint("s3-upload", self._file_identity(bucket, key, backup_path, part_size))
+        upload_id = checkpoint.state.get("upload_id") or checkpoint.stale.get("upload_id")
+        if upload_id:
+            self._abort_quietly(client, bucket, key, upload_id)
+            logger.info(f"Discarded the interrupted upload of s3://{bucket}/{key}")
+        checkpoint.clear()
+
+    def _store_multipart(self, client, backup_path, key, config):
+        """
+        Upload a file as a multipart upload, parts sent concurrently.
+
+        The upload id is checkpointed and the upload is left open if the
+        run fails, so the next attempt asks S3 which parts it already has
+        and only sends the missing ones.
+        """
+        started = time.monotonic()
+        bucket = config.get('bucket')
+        size = os.path.getsize(backup_path)
+        part_size = self._part_size(config, size)
+        workers = self._workers(config)
+        ranges = [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+
+        checkpoint = Checkpoint("s3-upload", self._file_identity(bucket, key, backup_path, part_size))
+        if checkpoint.stale.get("upload_id"):
+            self._abort_quietly(client, bucket, key, checkpoint.stale["upload_id"])
+        upload_id = checkpoint.state.get("upload_id")
+        stored = self._stored_parts(client, bucket, key, upload_id, ranges) if upload_id else None
+        if stored is None:
+            upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+            checkpoint.save(upload_id=upload_id)
+            stored = {}
+        elif stored:
+            logger.info(f"Resuming upload of {key}: {len(stored)} of {len(ranges)} parts already stored")
+        uploaded = size - sum(ranges[number - 1][1] - ranges[number - 1][0] for number in stored)
+
+        def upload(number):
+            if number in stored:
+                return stored[number]
+            start, end = ranges[number - 1]
+            with FileSlice(backup_path, start, end) as part:
+                return self._upload_part(client, bucket, key, upload_id, number, part, end - start)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(upload, range(1, len(ranges) + 1)))
+        try:
+            client.complete_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except ClientError as e:
+            if self._error_code(e) == "NoSuchUpload":
+                # The upload was aborted meanwhile, start over next time
+                checkpoint.clear()
+            raise
+        checkpoint.clear()
+
+        self._log_transfer("Uploaded", uploaded, len(ranges), workers, started)
+
+    def _upload_part(self, client, bucket, key, upload_id, number, body, length=None):
+        """Upload one part, returning its entry for CompleteMultipartUpload"""
+        extra = {"ContentLength": length} if length is not None else {}
+        response = client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body, **extra
+        )
+        return self._part_entry(number, response)
+
+    def _part_entry(self, number, response):
+        # Checksums the client added to the part must be repeated when completing
+        entry = {name: value for name, value in response.items() if name.startswith("Checksum") and name != "ChecksumType"}
+        entry.update(PartNumber=number, ETag=response["ETag"])
+        return entry
+
+    def _stored_parts(self, client, bucket, key, upload_id, ranges):
+        """Parts S3 has of an open upload, by number; None if the upload is gone"""
+        stored = {}
+        try:
+            for page in client.get_paginator('list_parts').paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+                for part in page.get("Parts") or []:
+                    number = part["PartNumber"]
+                    # A part cut differently is uploaded again
+                    if number <= len(ranges) and part["Size"] == ranges[number - 1][1] - ranges[number - 1][0]:
+                        stored[number] = self._part_entry(number, part)
+        except ClientError as e:
+            if self._error_code(e) == "NoSuchUpload":
+                return None
+            raise
+        return stored
+
+    def _abort_quietly(self, client, bucket, key, upload_id):
+        try:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except (BotoCoreError, ClientError) as e:
+            logger.warning(f"Failed to abort the multipart upload of s3://{bucket}/{key}: {e}")
+
+    def _retrieve_ranges(self, client, key, head, destination_file_name, config, checkpoint):
+        """
+        Download an object as concurrent byte ranges into a preallocated
+        file. Finished ranges are checkpointed and skipped when an
+        interrupted download is resumed.
+        """
+        started = time.monotonic()
+        size = head["ContentLength"]
+        part_size = self._part_size(config)
+        workers = self._workers(config) if config.get('parallel', True) else 1
+        ranges = [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+
+        done = set()
+        if checkpoint.state.get("part_size") == part_size:
+            done = set(checkpoint.state.get("ranges") or [])
+        if done and os.path.exists(destination_file_name):
+            logger.info(f"Resuming download of {key}: {len(done)} of {len(ranges)} ranges already downloaded")
+        else:
+            done = set()
+            with open(destination_file_name, 'wb') as f:
+                f.truncate(size)
+            checkpoint.save(part_size=part_size, ranges=[])
+
+        lock = threading.Lock()
+
+        def finished(start, end):
+            with lock:
+                done.add(start)
+                checkpoint.save(ranges=sorted(done))
+
+        pending = [(start, end) for start, end in ranges if start not in done]
+        self._download_ranges(client, key, head, pending, destination_file_name, {**config, "workers": workers}, finished)
+        self._log_transfer("Downloaded", sum(end - start for start, end in pending), len(ranges), workers, started)
+
+    def _download_ranges(self, client, key, head, ranges, destination_file_name, config, finished=None):
+        """Download byte ranges concurrently into the same offsets of a local file"""
+        fetch = self._range_fetcher(client, key, head, config)
+
+        def download(item):
+            start, end = item
+            for attempt in range(TRANSFER_RETRIES + 1):
+                try:
+                    data = fetch(start, end)
+                    break
+                except _TRANSIENT_ERRORS as e:
+                    if attempt == TRANSFER_RETRIES:
+                        raise
+                    self._wait_to_retry(f"bytes {start}-{end - 1} of {key}", e, attempt)
+            with open(destination_file_name, 'r+b') as f:
+                f.seek(start)
+                f.write(data)
+                if finished is not None:
+                    f.flush()
+                    os.fsync(f.fileno())
+            if finished is not None:
+                finished(start, end)
+
+        with ThreadPoolExecutor(max_workers=self._workers(config)) as pool:
+            list(pool.map(download, ranges))
+
+    def _range_fetcher(self, client, key, head, config):
+        def fetch(start, end):
+            # IfMatch pins the ETag, so every range comes from the same object
+            response = client.get_object(
+                Bucket=config.get('bucket'), Key=key, Range=f"bytes={start}-{end - 1}", IfMatch=head["ETag"]
+            )
+            with response["Body"] as body:
+                return body.read()
+        return fetch
+
+    def _download_path(self, checkpoint, backup_name):
+        """Where to download: the partial file of an interrupted attempt, if any"""
+        path = checkpoint.state.get("path")
+        if path and os.path.exists(path):
+            return path
+        path = os.path.join(tempfile.mkdtemp(), backup_name)
+        checkpoint.save(path=path, ranges=[])
+        return path
+
+    def _file_identity(self, bucket, key, backup_path, part_size):
+        stat = os.stat(backup_path)
+        return {
+            "bucket": bucket, "object": key, "file": os.path.abspath(backup_path),
+            "size": stat.st_size, "mtime": stat.st_mtime_ns, "piece_size": part_size,
+        }
+
+    def _wait_to_retry(self, what, error, attempt):
+        delay = min(2 ** attempt, 30)
+        logger.warning(f"{what} interrupted ({error}), resuming in {delay}s")
+        time.sleep(delay)
+
+    def _log_transfer(self, action, nbytes, parts, workers, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        mb = nbytes / (1024 * 1024)
+        logger.info(
+            f"{action} {mb:.1f} MB in {parts} part(s) with {workers} worker(s): "
+            f"{elapsed:.1f}s, {mb / elapsed:.1f} MB/s"
+        )
+
+    def _list_keys(self, client, prefix, config):
+        keys = []
+        for page in client.get_paginator('list_objects_v2').paginate(Bucket=config.get('bucket'), Prefix=prefix):
+            keys.extend(item["Key"] for item in page.get("Contents") or [])
+        return keys
+
+    def _transfer_config(self, config):
+        # Files go `workers` at a time, each one over a single connection
+        part_size = self._part_size(config)
+        return TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size, max_concurrency=1, use_threads=False)
+
+    def _store_directory(self, client, local_dir, prefix, config):
+        """Upload every file of a directory-format dump in parallel"""
+        uploads = []
+        for root, _, files in os.walk(local_dir):
+            for name in files:
+                local_file = os.path.join(root, name)
+                relative = os.path.relpath(local_file, local_dir).replace(os.sep, '/')
+                uploads.append((local_file, f"{prefix}/{relative}"))
+
+        transfer_config = self._transfer_config(config)
+
+        def upload(item):
+            local_file, key = item
+            client.upload_file(local_file, config.get('bucket'), key, Config=transfer_config)
+
+        workers = self._workers(config)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # list() re-raises the first failed upload
+            list(pool.map(upload, uploads))
+        logger.info(f"Uploaded {len(uploads)} files with {workers} workers")
+
+    def _retrieve_directory(self, client, prefix, local_dir, config):
+        """Download every object under a directory-format dump in parallel"""
+        keys = self._list_keys(client, f"{prefix}/", config)
+        if not keys:
+            raise ValueError(f"No objects found under s3://{config.get('bucket')}/{prefix}/")
+
+        transfer_config = self._transfer_config(config)
+
+        def download(key):
+            local_file = os.path.join(local_dir, *key[len(prefix) + 1:].split('/'))
+            os.makedirs(os.path.dirname(local_file), exist_ok=True)
+            client.download_file(config.get('bucket'), key, local_file, Config=transfer_config)
+
+        workers = self._workers(config)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(download, keys))
+        logger.info(f"Downloaded {len(keys)} files with {workers} workers")
+
+    def _workers(self, config):
+        return int(config.get('workers') or DEFAULT_WORKERS)
+
+    def _part_size(self, config, size=None):
+        """Configured part size, raised to S3's minimum and to fit `size` in MAX_PARTS parts"""
+        part_size = max(int(float(config.get('part_size_mb') or DEFAULT_PART_SIZE_MB) * 1024 * 1024), MIN_PART_SIZE)
+        if size is not None and -(-size // part_size) > MAX_PARTS:
+            # Rounded up to whole MiB, like the configured sizes
+            mib = 1024 * 1024
+            part_size = -(-size // (MAX_PARTS * mib)) * mib
+        return part_size
+
+    def _key(self, backup_name, config):
+        path = config.get('path') or ''
+        if path:
+            return f"{path.strip('/')}/{backup_name}"
+        return backup_name
+
+    def _error_code(self, error):
+        return error.response.get("Error", {}).get("Code")
+
+    @contextmanager
+    def _api_errors(self, name, config):
+        try:
+            yield
+        except NoCredentialsError as e:
+            logger.error(f"No AWS credentials: {e}")
+            raise ValueError(
+                "No AWS credentials found. Set AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY, "
+                "a profile, or a shared credentials file (credentials)."
+            )
+        except ClientError as e:
+            code = self._error_code(e)
+            if code in ("AccessDenied", "403", "InvalidAccessKeyId", "SignatureDoesNotMatch"):
+                logger.error(f"Permission denied when accessing bucket '{config.get('bucket')}': {e}")
+                raise ValueError("S3 permission denied. Check your credentials and bucket permissions.")
+            if code == "NoSuchBucket":
+                logger.error(f"Bucket not found: {e}")
+                raise ValueError(f"S3 bucket '{config.get('bucket')}' does not exist.")
+            if code in ("NoSuchKey", "404"):
+                raise ValueError(f"Object 's3://{config.get('bucket')}/{self._key(name, config)}' does not exist.")
+            logger.error(f"S3 API error: {e}")
+            raise ValueError(f"S3 request failed for {name}: {e}")
+        except BotoCoreError as e:
+            logger.error(f"S3 client error: {e}")
+            raise ValueError(f"S3 request failed for {name}: {e}")
+
+    def _get_client(self, config):
+        """
+        Shared client for this endpoint, region and credentials.
+
+        boto3 clients are thread-safe and pool their connections, so all
+        part transfers of a run (and every run of the daemon) reuse warm
+        connections; the pool is sized for `workers` parallel requests.
+        """
+        if config.get('credentials'):
+            cred_path = config.get('credentials')
+            if not os.path.exists(cred_path):
+                raise FileNotFoundError(f"Credentials file not found at {cred_path}")
+            os.environ["AWS_SHARED_CREDENTIALS_FILE"] = cred_path
+
+        endpoint_url = config.get('endpoint_url') or os.getenv("S3_ENDPOINT_URL")
+        pool_size = max(self._workers(config), 10)
+        key = (endpoint_url, config.get('region'), config.get('profile'), os.getenv("AWS_SHARED_CREDENTIALS_FILE"), pool_size)
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+            if client is not None:
+                return client
+
+            options = {"max_pool_connections": pool_size, "retries": {"max_attempts": TRANSFER_RETRIES, "mode": "standard"}}
+            if endpoint_url:
+                # MinIO and most S3-compatible servers don't do bucket subdomains
+                logger.info(f"Using S3 endpoint {endpoint_url}")
+                options["s3"] = {"addressing_style": "path"}
+            session = boto3.session.Session(profile_name=config.get('profile'))
+            client = session.client(
+                's3', endpoint_url=endpoint_url, region_name=config.get('region'), config=Config(**options)
+            )
+            _CLIENTS[key] = client
+        return client
@@ -0,0 +1,419 @@
+import hashlib
+import logging
+import queue
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+logger = logging.getLogger('afterchive')
+
+# Default read/write size for streaming pipelines (8 MiB). Also a multiple
+# of 256 KiB, which GCS requires for resumable upload chunks.
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class ProcessOutputStream:
+    """
+    File-like reader over a child process's stdout.
+
+    Reaching EOF waits for the process and raises if it exited with a
+    non-zero status, so a consumer never mistakes a truncated dump for a
+    complete one.
+    """
+
+    def __init__(self, process, name, stderr_file=None):
+        self.process = process
+        self.name = name
+        self._stderr_file = stderr_file
+        self._position = 0
+        self._finished = False
+        self._error = None
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        if self._finished:
+            if self._error:
+                raise self._error
+            return b''
+
+        data = self.process.stdout.read(size)
+        self._position += len(data)
+
+        # A short read from a buffered pipe only happens at EOF
+        if size is None or size < 0 or len(data) < size:
+            self._finish()
+        return data
+
+    def _finish(self):
+        self._finished = True
+        returncode = self.process.wait()
+        if returncode != 0:
+            self._error = ValueError(f"{self.name} failed: {self._error_output(returncode)}")
+            raise self._error
+
+    def _error_output(self, returncode):
+        if self._stderr_file is None:
+            return f"exit status {returncode}"
+        self._stderr_file.seek(0)
+        output = self._stderr_file.read().decode(errors='replace').strip()
+        return output or f"exit status {returncode}"
+
+    def close(self):
+        """Stop the process if the consumer gave up early and release pipes"""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        if self.process.stdout:
+            self.process.stdout.close()
+        if self._stderr_file:
+            self._stderr_file.close()
+
+
+class QueueReader:
+    """
+    Readable stream fed chunk by chunk through a bounded queue.
+
+    A producer calls put() with data chunks, b'' for EOF, or an exception
+    to fail the reader. Because the queue is bounded, a slow reader blocks
+    its producer (backpressure) instead of buffering without limit.
+    read(n) only returns fewer than n bytes at EOF.
+    """
+
+    def __init__(self, depth=4):
+        self._queue = queue.Queue(maxsize=depth)
+        self._buffer = bytearray()
+        self._eof = False
+        self._closed = threading.Event()
+
+    def readable(self):
+        return True
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def put(self, item):
+        """Queue an item, giving up quietly once the reader is closed"""
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+            else:
+                self._buffer += item
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def close(self):
+        self._closed.set()
+        # Unblock the producer if it is waiting on a full queue
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+
+class PrefetchReader(QueueReader):
+    """
+    Reads ahead from a source stream on a background thread.
+
+    Up to `depth` chunks are buffered, so a slow producer (a download)
+    and a slow consumer (psql) run at the same time instead of taking
+    turns.
+    """
+
+    def __init__(self, source, chunk_size=STREAM_CHUNK_SIZE, depth=4):
+        super().__init__(depth)
+        self._source = source
+        self._chunk_size = chunk_size
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        try:
+            while not self.closed:
+                data = self._source.read(self._chunk_size)
+                self.put(data)
+                if not data:
+                    return
+        except Exception as e:
+            self.put(e)
+
+    def close(self):
+        super().close()
+        self._thread.join(timeout=5)
+
+
+def tee_stream(source, consumers, chunk_size=STREAM_CHUNK_SIZE, depth=4):
+    """
+    Feed one source stream to several consumers in parallel.
+
+    Each consumer is a callable that takes a readable stream and runs on
+    its own thread. The source is read once; every chunk is handed to
+    each consumer through a bounded queue, so the slowest consumer sets
+    the pace. A consumer that fails is dropped without affecting the
+    others. If the source itself fails, every consumer sees the error.
+
+    Returns a list with None (success) or the exception for each consumer.
+    """
+    readers = [QueueReader(depth) for _ in consumers]
+    results = [None] * len(consumers)
+
+    def run(index):
+        try:
+            consumers[index](readers[index])
+        except Exception as e:
+            results[index] = e
+        finally:
+            # Closing also stops the producer from blocking on this reader
+            readers[index].close()
+
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(len(consumers))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            data = source.read(chunk_size)
+            live = [reader for reader in readers if not reader.closed]
+            if not live:
+                break
+            for reader in live:
+                reader.put(data)
+            if not data:
+                break
+    except Exception as e:
+        for reader in readers:
+            reader.put(e)
+
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def parallel_fetch_reader(fetches, workers):
+    """
+    Readable stream over the results of zero-argument fetch callables.
+
+    Up to `workers` fetches run at once and their results are handed to
+    the reader in order, so memory stays around 2 * workers * fetch size.
+    """
+    reader = QueueReader(depth=workers)
+
+    def produce():
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                next_fetch = 0
+                while next_fetch < len(fetches) or pending:
+                    while next_fetch < len(fetches) and len(pending) < workers:
+                        pending.append(pool.submit(fetches[next_fetch]))
+                        next_fetch += 1
+                    if not reader.put(pending.popleft().result()):
+                        # Reader was closed early, stop fetching
+                        for future in pending:
+                            future.cancel()
+                        return
+            reader.put(b'')
+        except Exception as e:
+            reader.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    return reader
+
+
+def parallel_range_reader(fetch_range, size, part_size, workers):
+    """
+    Readable stream over an object fetched as concurrent byte ranges.
+
+    fetch_range(start, end) must return the bytes in [start, end).
+    """
+    fetches = [
+        partial(fetch_range, start, min(start + part_size, size))
+        for start in range(0, size, part_size)
+    ]
+    return parallel_fetch_reader(fetches, workers)
+
+
+def read_full(stream, size):
+    """Read exactly `size` bytes unless the stream ends first"""
+    data = stream.read(size)
+    if len(data) < size and data:
+        parts = [data]
+        received = len(data)
+        while received < size:
+            more = stream.read(size - received)
+            if not more:
+                break
+            parts.append(more)
+            received += len(more)
+        data = b''.join(parts)
+    return data
+
+
+def parallel_chunk_reader(source, chunk_size, transform, workers, header=b''):
+    """
+    Readable stream over transform(index, chunk, last) of consecutive
+    `chunk_size` chunks of a source stream, `workers` chunks at a time
+    and in order. `last` is True for the final chunk (an empty one if
+    the source is empty). `header` is returned before the first chunk.
+    """
+    reader = QueueReader(depth=workers)
+
+    def produce():
+        try:
+            if header and not reader.put(header):
+                return
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                index = 0
+                data = read_full(source, chunk_size)
+                while True:
+                    # Reading one chunk ahead tells whether this one is the last
+                    following = read_full(source, chunk_size) if len(data) == chunk_size else b''
+                    last = not following
+                    pending.append(pool.submit(transform, index, data, last))
+                    index += 1
+                    while pending and (len(pending) >= workers or last):
+                        result = pending.popleft().result()
+                        # b'' would end the reader early
+                        if result and not reader.put(result):
+                            for future in pending:
+                                future.cancel()
+                            return
+                    if last:
+                        break
+                    data = following
+            reader.put(b'')
+        except Exception as e:
+            reader.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    return reader
+
+
+class FileSlice:
+    """Read-only view of a byte range of a file, seekable within the range"""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, 'rb')
+        self._start = start
+        self._end = end
+        self._file.seek(start)
+
+    def read(self, size=-1):
+        remaining = self._end - self._file.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self._file.read(size)
+
+    def tell(self):
+        return self._file.tell() - self._start
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = self._start + offset
+        elif whence == os.SEEK_CUR:
+            position = self._file.tell() + offset
+        else:
+            position = self._end + offset
+        self._file.seek(min(max(position, self._start), self._end))
+        return self.tell()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CountingReader:
+    """Pass-through reader that counts the bytes read from it"""
+
+    def __init__(self, source):
+        self._source = source
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_read
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def _crc32c():
+    """A CRC32C checksum object, or None without google-crc32c (gcs extra)"""
+    try:
+        import google_crc32c
+    except ImportError:
+        return None
+    return google_crc32c.Checksum()
+
+
+class HashingReader(CountingReader):
+    """
+    Pass-through reader that also computes the SHA-256 and CRC32C (the
+    checksum GCS keeps for every object) of what is read.
+    """
+
+    def __init__(self, source):
+        super().__init__(source)
+        self._sha256 = hashlib.sha256()
+        self._crc32c = _crc32c()
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self._sha256.update(data)
+        if self._crc32c is not None:
+            self._crc32c.update(data)
+        return data
+
+    def checksums(self):
+        return {
+            "sha256": self._sha256.hexdigest(),
+            "crc32c": self._crc32c.digest().hex() if self._crc32c is not None else None,
+        }
+
+
+def hash_stream(stream, chunk_size=STREAM_CHUNK_SIZE):
+    """Read a stream to the end, returning (size, checksums)"""
+    reader = HashingReader(stream)
+    while reader.read(chunk_size):
+        pass
+    return reader.bytes_read, reader.checksums()
+
+
+def hash_file(path):
+    with open(path, 'rb') as f:
+        return hash_stream(f)[1]
@@ -0,0 +1,222 @@
+"""
+Load-aware pacing of backups.
+
+While a backup runs, a monitor thread samples the database server's
+load every few seconds. When a sample goes over one of the configured
+targets, the dump's read rate and the upload bandwidth are halved.
+While the load stays under the targets they grow back step by step
+(AIMD, as TCP does). Reading the dump more slowly makes pg_dump block
+on its pipe, so the server does less backup work.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger('afterchive')
+
+# Load targets: a sample over any of them slows the backup down
+TARGET_KEYS = ("max_active_sessions", "max_io_waits", "max_replication_lag")
+# Used when `throttle: true` sets none
+DEFAULT_TARGETS = {"max_active_sessions": 20, "max_io_waits": 8, "max_replication_lag": 60}
+RATE_KEYS = ("dump_rate_mb", "upload_rate_mb")
+OTHER_KEYS = ("min_speed", "interval")
+
+DEFAULT_INTERVAL = 5
+# Slowest pace, as a fraction of full speed
+DEFAULT_MIN_SPEED = 0.05
+# Speed regained per sample under the targets
+SPEED_STEP = 0.1
+
+LABELS = {
+    "max_active_sessions": "active sessions",
+    "max_io_waits": "sessions waiting on I/O",
+    "max_replication_lag": "replication lag (s)",
+}
+
+
+def check_throttle(settings):
+    """Validated throttle settings from options.throttle (a dict, or true for the defaults)"""
+    if settings is True:
+        settings = {}
+    if not isinstance(settings, dict):
+        raise ValueError(f"throttle must be true or a mapping of settings, got {settings!r}")
+    settings = {key: value for key, value in settings.items() if value is not None}
+    unknown = set(settings) - set(TARGET_KEYS + RATE_KEYS + OTHER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown throttle setting(s): {', '.join(sorted(unknown))}")
+    for key, value in settings.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"throttle.{key} must be a positive number, got {value!r}")
+    if settings.get("min_speed", DEFAULT_MIN_SPEED) > 1:
+        raise ValueError("throttle.min_speed is a fraction of full speed, between 0 and 1")
+    if not any(key in settings for key in TARGET_KEYS):
+        settings = {**DEFAULT_TARGETS, **settings}
+    return settings
+
+
+class TokenBucket:
+    """
+    Byte rate limit shared by the threads reading through it. A rate of
+    None means unlimited.
+    """
+
+    def __init__(self, rate=None):
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        # Bytes through the bucket, to measure the unthrottled speed
+        self.total = 0
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self._rate = rate
+            self._tokens = min(self._tokens, rate or 0.0)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._rate:
+            # At most a second's worth of burst
+            self._tokens = min(self._tokens + (now - self._updated) * self._rate, self._rate)
+        self._updated = now
+
+    def consume(self, nbytes):
+        """Take nbytes, sleeping until the rate allows them"""
+        with self._lock:
+            self.total += nbytes
+            if not self._rate:
+                return
+            self._refill()
+            # Going into debt lets a big read through at once, the wait pays it back
+            self._tokens -= nbytes
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class ThrottledReader:
+    """Pass-through reader that paces reads with a TokenBucket"""
+
+    def __init__(self, source, bucket):
+        self._source = source
+        self._bucket = bucket
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        if data:
+            self._bucket.consume(len(data))
+        return data
+
+    def __getattr__(self, name):
+        # bytes_read, checksums() etc. of the wrapped reader
+        return getattr(self._source, name)
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close:
+            close()
+
+
+class Throttle:
+    """
+    Paces the dump and upload streams of one backup by server load.
+
+    `sample()` returns the current load ({"active_sessions", "io_waits",
+    "replication_lag"}); it is called every `interval` seconds on a
+    monitor thread while the throttle is entered.
+    """
+
+    def __init__(self, settings, sample):
+        self.settings = settings
+        self._sample = sample
+        self.speed = 1.0
+        self._min_speed = settings.get("min_speed", DEFAULT_MIN_SPEED)
+        self._interval = settings.get("interval", DEFAULT_INTERVAL)
+        self.buckets = {
+            name: TokenBucket(settings[f"{name}_rate_mb"] * 1024 * 1024 if settings.get(f"{name}_rate_mb") else None)
+            for name in ("dump", "upload")
+        }
+        # Rate each bucket runs at full speed: the configured cap, or the
+        # fastest rate measured while unthrottled
+        self._full = {name: bucket.rate for name, bucket in self.buckets.items()}
+        self._measured = {name: 0.0 for name in self.buckets}
+        self._last = {name: (time.monotonic(), 0) for name in self.buckets}
+        self._stop = threading.Event()
+        self._thread = None
+        self._sample_failed = False
+        self.decisions = 0
+
+    def reader(self, stream, name):
+        return ThrottledReader(stream, self.buckets[name])
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="afterchive-throttle", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        if self.decisions:
+            logger.info(f"Throttle changed the pace {self.decisions} time(s), ending at {self.speed:.0%} speed")
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                load = self._sample()
+            except Exception as e:
+                # Pace stays as it is, the backup itself carries on
+                if not self._sample_failed:
+                    logger.warning(f"Throttle can't sample the server load, keeping the current pace: {e}")
+                self._sample_failed = True
+                continue
+            self._sample_failed = False
+            self.adjust(load)
+
+    def _measure(self):
+        now = time.monotonic()
+        for name, bucket in self.buckets.items():
+            started, total = self._last[name]
+            if now > started and self.speed >= 1.0:
+                self._measured[name] = max(self._measured[name], (bucket.total - total) / (now - started))
+            self._last[name] = (now, bucket.total)
+
+    def adjust(self, load):
+        """Apply one load sample: halve the speed over a target, else step it back up"""
+        self._measure()
+        over = [
+            f"{LABELS[key]} {load[key[len('max_'):]]:g} > {self.settings[key]:g}"
+            for key in TARGET_KEYS
+            if key in self.settings and load.get(key[len('max_'):]) is not None
+            and load[key[len('max_'):]] > self.settings[key]
+        ]
+        if over:
+            speed = max(self.speed / 2, self._min_speed)
+        else:
+            speed = min(self.speed + SPEED_STEP, 1.0)
+        if speed == self.speed:
+            return
+
+        self.speed = speed
+        self.decisions += 1
+        paces = []
+        for name, bucket in self.buckets.items():
+            full = self._full[name] or self._measured[name]
+            if speed >= 1.0 or not full:
+                bucket.set_rate(self._full[name])
+                if self._full[name]:
+                    paces.append(f"{name} {self._full[name] / (1024 * 1024):.1f} MB/s")
+                continue
+            bucket.set_rate(full * speed)
+            paces.append(f"{name} {full * speed / (1024 * 1024):.1f} MB/s")
+        pace = f" ({', '.join(paces)})" if paces else ""
+        reason = ", ".join(over) if over else "load under the targets"
+        logger.info(f"Throttle: {reason}, {'slowing' if over else 'speeding'} to {speed:.0%}{pace}")
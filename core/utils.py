@@ -1,4 +1,6 @@
-
+import os
+import shutil
+import tempfile
 
 def get_cleaned_conf_cli(args):
     storage_config = {
@@ -7,7 +9,8 @@ def get_cleaned_conf_cli(args):
         "region": args.region,
         "type": args.storage,
         "credentials": args.credentials,
-        "project": args.project
+        "project": args.project,
+        "endpoint_url": args.endpoint_url
     }
 
     db_config = {
@@ -19,10 +22,44 @@ def get_cleaned_conf_cli(args):
         "type": args.db_type
     }
 
+    options = {
+        "stream": args.stream,
+        "format": args.format,
+        "jobs": args.jobs,
+        "engine": args.engine,
+        "compress": args.compress,
+        "compression_level": args.compression_level,
+        "dedup": args.dedup,
+        "report": args.report,
+        "prometheus_file": args.prometheus_file
+    }
+
     clean_config = {
         "storage": [storage_config], 
-        "databases": [db_config]
+        "databases": [db_config],
+        "options": options
     }
 
 
-    return clean_config
\ No newline at end of file
+    return clean_config
+
+
+def remove_local_copy(path):
+    """
+    Remove a temporary backup file or dump directory.
+
+    If it was the only thing in its own temp directory (as handed out by
+    tempfile.mkdtemp) that directory is removed too.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    temp_root = os.path.abspath(tempfile.gettempdir())
+    if parent != temp_root and parent.startswith(temp_root + os.sep):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            pass
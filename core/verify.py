@@ -0,0 +1,127 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .dedup import CHUNK_PREFIX, ChunkStore, chunk_name, is_chunked
+from .streams import hash_stream
+
+logger = logging.getLogger('afterchive')
+
+DEFAULT_WORKERS = 8
+
+
+class _ChunkListing:
+    """Names under chunks/, listed once per run and only if needed"""
+
+    def __init__(self, storage, config):
+        self._storage = storage
+        self._config = config
+        self._names = None
+        self._lock = threading.Lock()
+
+    def names(self):
+        with self._lock:
+            if self._names is None:
+                self._names = set(self._storage.list_objects(CHUNK_PREFIX, self._config))
+            return self._names
+
+
+def _compare(expected, actual, what):
+    """Problems found comparing the recorded size/checksums with actual ones"""
+    problems = []
+    if expected.get("size") is not None and actual.get("size") != expected["size"]:
+        problems.append(f"{what} is {actual.get('size')} bytes, {expected['size']} recorded")
+    checksums = expected.get("checksums") or {}
+    for algorithm in ("sha256", "crc32c"):
+        if checksums.get(algorithm) and actual.get(algorithm) and actual[algorithm] != checksums[algorithm]:
+            problems.append(f"{algorithm} mismatch")
+    return problems
+
+
+def _verify_object(storage, config, entry, deep):
+    name = entry["backup"]
+    checksums = entry.get("checksums") or {}
+    if deep:
+        # Parallel ranged download (GCS) hashed as it streams in
+        with storage.retrieve_stream(name, {**config, "parallel": True}) as stream:
+            size, actual = hash_stream(stream)
+        return _compare(entry, {"size": size, **actual}, "object"), "sha256" if checksums.get("sha256") else "size"
+
+    stat = storage.stat_object(name, config)
+    problems = _compare(entry, {"size": stat["size"], "crc32c": stat["crc32c"]}, "object")
+    if checksums.get("crc32c") and stat["crc32c"]:
+        return problems, "crc32c"
+    return problems, "size"
+
+
+def _verify_chunked(storage, config, entry, deep, chunks):
+    name = entry["backup"]
+    if deep:
+        # Every chunk is checked against its own hash on the way
+        with ChunkStore(storage).retrieve_stream(name, config) as stream:
+            size, actual = hash_stream(stream)
+        return _compare(entry, {"size": size, "sha256": actual["sha256"]}, "dump"), "chunks, sha256"
+
+    index = json.loads(storage.get_object(name, config))
+    present = chunks.names()
+    missing = [digest for digest, _ in index["chunks"] if chunk_name(digest, index.get("codec")) not in present]
+    problems = [f"{len(missing)} of {len(index['chunks'])} chunks missing"] if missing else []
+    problems += _compare(entry, {"size": sum(length for _, length in index["chunks"])}, "dump")
+    return problems, "chunks present"
+
+
+def _verify_directory(storage, config, entry):
+    if not storage.list_objects(f"{entry['backup']}/", config):
+        return ["no files"], "files"
+    # Directory dumps have no single checksum
+    return [], "files present"
+
+
+def verify_backup(storage, config, entry, deep=False, chunks=None):
+    """
+    Check one catalog entry against storage: by metadata (size and the
+    CRC32C the backend keeps), or with deep by hashing a download.
+    Returns (problems, what was checked).
+    """
+    name = entry["backup"]
+    try:
+        if name.endswith(".dir"):
+            return _verify_directory(storage, config, entry)
+        if is_chunked(name):
+            return _verify_chunked(storage, config, entry, deep, chunks or _ChunkListing(storage, config))
+        return _verify_object(storage, config, entry, deep)
+    except FileNotFoundError as e:
+        # The backup itself, or with deep a chunk of it
+        return [str(e) or "missing"], "existence"
+    except ValueError as e:
+        return [str(e)], "existence"
+
+
+def verify_backups(storage, config, entries, deep=False):
+    """
+    Verify catalog entries, `workers` at a time by metadata, or one at a
+    time with deep (each download is parallel already). Returns a list
+    of (entry, problems).
+    """
+    started = time.monotonic()
+    chunks = _ChunkListing(storage, config)
+    workers = 1 if deep else int(config.get('workers') or DEFAULT_WORKERS)
+
+    def check(entry):
+        problems, checked = verify_backup(storage, config, entry, deep, chunks)
+        if problems:
+            logger.error(f"✗ {entry['backup']}: {', '.join(problems)}")
+        else:
+            logger.info(f"✓ {entry['backup']} ({checked})")
+        return entry, problems
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(check, entries))
+
+    failed = sum(1 for _, problems in results if problems)
+    logger.info(
+        f"Verified {len(results)} backups{' (deep)' if deep else ''}, {failed} failed, "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return results
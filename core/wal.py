@@ -0,0 +1,231 @@
+"""
+WAL archiving for point-in-time recovery.
+
+`afterchive wal-push %p` is an archive_command and `afterchive wal-fetch
+%f %p` a restore_command. Segments are stored under wal/ in any storage
+backend, compressed and encrypted like backups when the options say so.
+
+PostgreSQL archives one segment per command, which leaves the archive
+behind a busy server when every upload is a round trip. wal-push
+uploads the other segments that are ready along with the one it was
+asked for and marks them done, and wal-fetch downloads the segments
+after the requested one into pg_wal/.afterchive-prefetch so replay
+finds them there.
+"""
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from .compression import CODECS, codec_from_name, compress_bytes, decompress_bytes, get_codec
+from .encryption import (
+    ENCRYPTED_SUFFIX, decrypt_bytes, encrypt_bytes, encryption_keys, is_encrypted, strip_encryption_suffix
+)
+from .utils import remove_local_copy
+
+logger = logging.getLogger('afterchive')
+
+WAL_PREFIX = "wal/"
+PREFETCH_DIR = ".afterchive-prefetch"
+
+# Segments uploaded or prefetched at once
+DEFAULT_WORKERS = 4
+
+# Timeline, log and segment number, e.g. 000000010000000A000000FF
+SEGMENT_NAME = re.compile(r"^[0-9A-F]{24}$")
+# Segments per log number with the default 16 MB wal_segment_size; with
+# other sizes prefetching misses a few segments at each log boundary
+SEGMENTS_PER_LOG = 0x100
+
+
+def is_segment(name):
+    return bool(SEGMENT_NAME.match(name))
+
+
+def next_segments(name, count):
+    """The `count` segment names after `name` on its timeline"""
+    timeline, log, segment = name[:8], int(name[8:16], 16), int(name[16:24], 16)
+    names = []
+    for _ in range(count):
+        segment += 1
+        if segment >= SEGMENTS_PER_LOG:
+            log, segment = log + 1, 0
+        names.append(f"{timeline}{log:08X}{segment:08X}")
+    return names
+
+
+def _workers(options):
+    return max(int(options.get('wal_workers') or DEFAULT_WORKERS), 1)
+
+
+def _encoder(options):
+    """(suffix, encode) for WAL files as configured, e.g. ('.zst.enc', ...)"""
+    codec = get_codec(options)
+    level = options.get('compression_level')
+    key = None
+    if options.get('encrypt'):
+        keys = encryption_keys(options)
+        if not keys:
+            raise ValueError("encrypt needs a key: set encryption_key_file or AFTERCHIVE_ENCRYPTION_KEY")
+        key = keys[0]
+    suffix = (CODECS[codec] if codec else "") + (ENCRYPTED_SUFFIX if key else "")
+
+    def encode(data):
+        if codec:
+            data = compress_bytes(data, codec, level)
+        if key:
+            data = encrypt_bytes(data, key)
+        return data
+
+    return suffix, encode
+
+
+def _ready_files(wal_path, count):
+    """Other files of pg_wal that wait for the archiver, oldest first"""
+    if count <= 0:
+        return []
+    wal_dir = os.path.dirname(wal_path)
+    status_dir = os.path.join(wal_dir, "archive_status")
+    try:
+        statuses = os.listdir(status_dir)
+    except OSError:
+        return []
+    name = os.path.basename(wal_path)
+    ready = sorted(
+        status[:-len(".ready")] for status in statuses
+        if status.endswith(".ready") and status[:-len(".ready")] != name
+    )
+    return [os.path.join(wal_dir, ready_name) for ready_name in ready[:count]
+            if os.path.isfile(os.path.join(wal_dir, ready_name))]
+
+
+def push_wal(targets, wal_path, options):
+    """
+    Upload a WAL file (archive_command's %p) to every (storage, config)
+    target, along with up to wal_workers - 1 other files that are ready.
+    Those are marked .done so the archiver skips them. Raises if the
+    requested file could not be stored.
+    """
+    if not os.path.isfile(wal_path):
+        raise ValueError(f"WAL file {wal_path} does not exist")
+    workers = _workers(options)
+    suffix, encode = _encoder(options)
+    batch = [wal_path] + _ready_files(wal_path, workers - 1)
+
+    def push(path):
+        with open(path, 'rb') as f:
+            data = encode(f.read())
+        object_name = f"{WAL_PREFIX}{os.path.basename(path)}{suffix}"
+        for storage, config in targets:
+            storage.put_object(object_name, data, config)
+
+    def run(path):
+        try:
+            push(path)
+        except Exception as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=len(batch)) as pool:
+        errors = list(pool.map(run, batch))
+
+    for path, error in zip(batch[1:], errors[1:]):
+        if error is not None:
+            # Left .ready, the archiver asks for it again
+            logger.warning(f"Failed to archive {os.path.basename(path)} ahead of time: {error}")
+            continue
+        status = os.path.join(os.path.dirname(path), "archive_status", os.path.basename(path))
+        try:
+            os.replace(f"{status}.ready", f"{status}.done")
+        except OSError as e:
+            logger.warning(f"Archived {os.path.basename(path)} but could not mark it done: {e}")
+
+    if errors[0] is not None:
+        raise errors[0]
+    pushed = len(batch) - sum(error is not None for error in errors[1:])
+    logger.info(f"Archived {os.path.basename(wal_path)}" + (f" and {pushed - 1} more WAL file(s)" if pushed > 1 else ""))
+
+
+def _object_names(name, options):
+    """Stored names a WAL file may have, the configured suffixes first"""
+    codec = get_codec(options)
+    suffixes = [CODECS[codec]] if codec else [""]
+    suffixes += [suffix for suffix in [""] + list(CODECS.values()) if suffix not in suffixes]
+    encrypted = [ENCRYPTED_SUFFIX, ""] if options.get('encrypt') else ["", ENCRYPTED_SUFFIX]
+    return [f"{WAL_PREFIX}{name}{suffix}{end}" for end in encrypted for suffix in suffixes]
+
+
+def _download(storage, config, name, options):
+    """A WAL file's contents, or None if it isn't archived"""
+    for object_name in _object_names(name, options):
+        try:
+            data = storage.get_object(object_name, config)
+        except FileNotFoundError:
+            continue
+        if is_encrypted(object_name):
+            data = decrypt_bytes(data, encryption_keys(options), object_name)
+        codec = codec_from_name(strip_encryption_suffix(object_name))
+        if codec:
+            data = decompress_bytes(data, codec)
+        return data
+    return None
+
+
+def _write(path, data):
+    partial = f"{path}.partial"
+    try:
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+    except Exception:
+        remove_local_copy(partial)
+        raise
+
+
+def fetch_wal(storage, config, name, destination, options):
+    """
+    Copy an archived WAL file (restore_command's %f) to `destination`
+    (%p). Returns False if it isn't archived, which ends recovery.
+
+    The next wal_workers - 1 segments are downloaded at the same time
+    into the prefetch directory next to `destination`.
+    """
+    prefetch_dir = os.path.join(os.path.dirname(destination) or ".", PREFETCH_DIR)
+    prefetched = os.path.join(prefetch_dir, name)
+    upcoming = []
+    if is_segment(name):
+        upcoming = [
+            segment for segment in next_segments(name, _workers(options) - 1)
+            if not os.path.exists(os.path.join(prefetch_dir, segment))
+        ]
+
+    def prefetch(segment):
+        try:
+            data = _download(storage, config, segment, options)
+        except Exception as e:
+            logger.debug(f"Prefetching {segment} failed: {e}")
+            return
+        if data is not None:
+            os.makedirs(prefetch_dir, exist_ok=True)
+            _write(os.path.join(prefetch_dir, segment), data)
+
+    with ThreadPoolExecutor(max_workers=len(upcoming) + 1) as pool:
+        for segment in upcoming:
+            pool.submit(prefetch, segment)
+        if os.path.exists(prefetched):
+            os.replace(prefetched, destination)
+            found = True
+        else:
+            data = _download(storage, config, name, options)
+            found = data is not None
+            if found:
+                _write(destination, data)
+
+    if os.path.isdir(prefetch_dir) and is_segment(name):
+        # Replay has moved past these
+        for leftover in os.listdir(prefetch_dir):
+            if is_segment(leftover) and leftover[:8] == name[:8] and leftover < name:
+                remove_local_copy(os.path.join(prefetch_dir, leftover))
+
+    if found:
+        logger.info(f"Restored {name} from the WAL archive")
+    return found
@@ -36,11 +36,15 @@ setup(
         "mysql": ["mysql-connector-python>=8.0.0"],
         "gcs": ["google-cloud-storage>=2.0.0"],
         "s3": ["boto3>=1.26.0"],
+        "zstd": ["zstandard>=0.21.0"],
+        "encryption": ["cryptography>=41.0.0"],
         "all": [
             "psycopg2-binary>=2.9.0",
             "mysql-connector-python>=8.0.0",
             "google-cloud-storage>=2.0.0",
             "boto3>=1.26.0",
+            "zstandard>=0.21.0",
+            "cryptography>=41.0.0",
         ],
     },
     entry_points={
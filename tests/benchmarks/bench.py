@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+End-to-end backup/restore throughput benchmark.
+
+Runs run_backup/restore_command against synthetic databases and reports
+throughput, peak RSS and peak temp-disk use as JSON, so releases can be
+compared run to run.
+
+  # fake pg_dump/psql serving generated dumps, no database needed
+  python tests/benchmarks/bench.py --size-mb 256 --output results.json
+
+  # a real server (synthetic databases are created on it)
+  python tests/benchmarks/bench.py --mode postgres --db-host localhost --db-user postgres
+
+  # GCS against a local emulator as well
+  STORAGE_EMULATOR_HOST=http://localhost:9023 python tests/benchmarks/bench.py --storage local,gcs
+
+  # S3 against MinIO or moto_server (credentials from the AWS_* variables)
+  S3_ENDPOINT_URL=http://localhost:9000 python tests/benchmarks/bench.py --storage s3
+
+Every measurement runs in a fresh worker process with its own TMPDIR, so
+peak RSS and temp-disk use belong to that run alone.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(HERE))
+SHIMS = os.path.join(HERE, "shims")
+
+MB = 1024 * 1024
+
+# Database shapes: (tables, row kind). Sizes are split evenly over tables.
+SHAPES = {
+    "small-tables": (2000, "text"),
+    "huge": (3, "text"),
+    "bytea": (4, "bytea"),
+}
+
+# Backup options per variant, see core/cli.py for their meaning
+VARIANTS = {
+    "file": {},
+    "stream": {"stream": True},
+    "stream-gzip": {"stream": True, "compress": "gzip"},
+    "stream-zstd": {"stream": True, "compress": "zstd"},
+    "custom": {"format": "custom", "stream": True},
+    "directory": {"format": "directory", "jobs": 4},
+    "dedup": {"stream": True, "dedup": True},
+}
+
+WORDS = [
+    "alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel",
+    "india", "juliet", "kilo", "lima", "mike", "november", "oscar", "papa",
+    "quebec", "romeo", "sierra", "tango", "uniform", "victor", "whiskey",
+    "xray", "yankee", "zulu", "order", "invoice", "customer", "shipped",
+]
+
+
+# ---------------------------------------------------------------------------
+# Synthetic fixtures for the fake pg_dump
+# ---------------------------------------------------------------------------
+
+def _text_rows(rng, table, size):
+    """COPY text rows of an orders-like table, about `size` bytes"""
+    written = 0
+    row_id = 0
+    lines = []
+    while written < size:
+        row_id += 1
+        line = (
+            f"{row_id}\t{table}-{rng.randrange(10 ** 6)}\t"
+            f"{' '.join(rng.choices(WORDS, k=6))}\t{rng.randrange(10 ** 7) / 100:.2f}\t"
+            f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d} 12:00:00+00\n"
+        )
+        lines.append(line)
+        written += len(line)
+        if len(lines) >= 10000:
+            yield "".join(lines).encode()
+            lines = []
+    if lines:
+        yield "".join(lines).encode()
+
+
+def _bytea_rows(rng, size):
+    """COPY text rows with 64 KiB of random bytea each, hex encoded"""
+    written = 0
+    row_id = 0
+    while written < size:
+        row_id += 1
+        line = b"%d\t\\\\x%s\n" % (row_id, os.urandom(64 * 1024).hex().encode())
+        written += len(line)
+        yield line
+
+
+def _table_sql(shape, index, size, rng):
+    tables, kind = SHAPES[shape]
+    name = f"{shape.replace('-', '_')}_{index}"
+    if kind == "bytea":
+        columns = "id bigint PRIMARY KEY, payload bytea"
+        rows = _bytea_rows(rng, size)
+    else:
+        columns = "id bigint PRIMARY KEY, ref text, note text, amount numeric, created timestamptz"
+        rows = _text_rows(rng, name, size)
+    column_names = ", ".join(column.split()[0] for column in columns.split(", "))
+    header = f"\nCREATE TABLE public.{name} ({columns});\n\nCOPY public.{name} ({column_names}) FROM stdin;\n"
+    return name, header.encode(), rows, b"\\.\n"
+
+
+def _hash_path(path):
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                with open(os.path.join(root, name), 'rb') as f:
+                    for block in iter(lambda: f.read(MB), b''):
+                        digest.update(block)
+    else:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(MB), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def build_fixture(work_dir, shape, size_mb):
+    """
+    Generate fake dumps of a shape once and cache them in work_dir.
+
+    fixture.sql is a plain dump, fixture.dump the same data behind a
+    custom-format header and fixture.dir/ one data file per table.
+    """
+    fixture = os.path.join(work_dir, "fixtures", f"{shape}-{size_mb}mb")
+    info_path = os.path.join(fixture, "fixture.json")
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            return fixture, json.load(f)
+
+    shutil.rmtree(fixture, ignore_errors=True)
+    os.makedirs(os.path.join(fixture, "fixture.dir"))
+    rng = random.Random(f"{shape}-{size_mb}")
+    tables, _ = SHAPES[shape]
+    per_table = max(1, size_mb * MB // tables)
+
+    started = time.monotonic()
+    with open(os.path.join(fixture, "fixture.sql"), 'wb') as plain, \
+            open(os.path.join(fixture, "fixture.dir", "toc.dat"), 'wb') as toc:
+        plain.write(b"--\n-- PostgreSQL database dump (afterchive benchmark fixture)\n--\n")
+        toc.write(b"PGDMP")
+        for index in range(tables):
+            name, header, rows, footer = _table_sql(shape, index, per_table, rng)
+            plain.write(header)
+            toc.write(header)
+            with open(os.path.join(fixture, "fixture.dir", f"{3000 + index}.dat"), 'wb') as data_file:
+                for block in rows:
+                    plain.write(block)
+                    data_file.write(block)
+            plain.write(footer)
+
+    with open(os.path.join(fixture, "fixture.sql"), 'rb') as plain, \
+            open(os.path.join(fixture, "fixture.dump"), 'wb') as custom:
+        custom.write(b"PGDMP")
+        shutil.copyfileobj(plain, custom, 8 * MB)
+
+    info = {
+        "bytes": os.path.getsize(os.path.join(fixture, "fixture.sql")),
+        "tables": tables,
+        "sha256": {
+            "plain": _hash_path(os.path.join(fixture, "fixture.sql")),
+            "custom": _hash_path(os.path.join(fixture, "fixture.dump")),
+            "directory": _hash_path(os.path.join(fixture, "fixture.dir")),
+        },
+    }
+    with open(info_path, 'w') as f:
+        json.dump(info, f)
+    print(f"Generated {shape} fixture ({info['bytes'] / MB:.0f} MB) in {time.monotonic() - started:.1f}s", file=sys.stderr)
+    return fixture, info
+
+
+# ---------------------------------------------------------------------------
+# Synthetic databases on a real server
+# ---------------------------------------------------------------------------
+
+def build_database(db_conf, shape, size_mb):
+    """Create (or reuse) a synthetic database of the given shape on the server"""
+    import psycopg2
+
+    dbname = db_conf["name"]
+    admin = psycopg2.connect(
+        dbname="postgres", user=db_conf["user"], password=db_conf["password"],
+        host=db_conf["host"], port=db_conf["port"]
+    )
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+        exists = cursor.fetchone() is not None
+        if not exists:
+            cursor.execute(f'CREATE DATABASE "{dbname}"')
+    admin.close()
+    if exists:
+        return
+
+    started = time.monotonic()
+    tables, kind = SHAPES[shape]
+    per_table = max(1, size_mb * MB // tables)
+    conn = psycopg2.connect(
+        dbname=dbname, user=db_conf["user"], password=db_conf["password"],
+        host=db_conf["host"], port=db_conf["port"]
+    )
+    with conn, conn.cursor() as cursor:
+        for index in range(tables):
+            name = f"{shape.replace('-', '_')}_{index}"
+            if kind == "bytea":
+                # 64 KiB of random bytes per row (hex of md5s), incompressible
+                rows = max(1, per_table // (64 * 1024))
+                cursor.execute(f"CREATE TABLE {name} (id bigint PRIMARY KEY, payload bytea)")
+                cursor.execute(
+                    f"INSERT INTO {name} SELECT g, decode((SELECT string_agg(md5(random()::text || g || s), '') "
+                    f"FROM generate_series(1, 4096) s), 'hex') FROM generate_series(1, %s) g",
+                    (rows,)
+                )
+            else:
+                rows = max(1, per_table // 90)
+                cursor.execute(
+                    f"CREATE TABLE {name} (id bigint PRIMARY KEY, ref text, note text, "
+                    f"amount numeric, created timestamptz)"
+                )
+                cursor.execute(
+                    f"INSERT INTO {name} SELECT g, '{name}-' || (random() * 1000000)::int, "
+                    f"md5(g::text) || ' ' || md5((g * 7)::text), round((random() * 100000)::numeric, 2), "
+                    f"now() - (random() * interval '365 days') FROM generate_series(1, %s) g",
+                    (rows,)
+                )
+    conn.close()
+    print(f"Created database {dbname} in {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+
+# ---------------------------------------------------------------------------
+# Worker: one measured backup or restore in its own process
+# ---------------------------------------------------------------------------
+
+class _DiskSampler(threading.Thread):
+    """Tracks the peak size of a directory tree (the worker's TMPDIR)"""
+
+    def __init__(self, path, interval=0.05):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def _size(self):
+        total = 0
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def run(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, self._size())
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, self._size())
+
+
+def _fake_preflight(self, host, port, dbname, user, password, tool=None, create=False):
+    # The fake tools have no server to check
+    return {"server_version": 99, "exists": True, "size": None, "superuser": True}
+
+
+def run_worker(spec):
+    import logging
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    sys.path.insert(0, REPO_ROOT)
+    from core.commands import run_backup, restore_command
+
+    if spec["mode"] == "fake":
+        from core.databases.postgres import PostgresBackup
+        PostgresBackup.preflight = _fake_preflight
+
+    sampler = _DiskSampler(tempfile.gettempdir())
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        if spec["action"] == "backup":
+            backup = run_backup(spec["database"], spec["storage"], spec["options"])
+            result = {"backup": backup["backup"], "stored_bytes": backup["size"]}
+        else:
+            restore_command(spec["database"], spec["storage"], spec["backup"], spec["options"])
+            result = {}
+    finally:
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+
+    # ru_maxrss is in KiB on Linux (bytes on macOS)
+    scale = 1 if sys.platform == "darwin" else 1024
+    result.update({
+        "seconds": round(elapsed, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / MB, 1),
+        "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / MB, 1),
+        "peak_temp_mb": round(sampler.peak / MB, 1),
+    })
+    print(json.dumps(result))
+
+
+def _measure(spec, env):
+    """Run one worker in a fresh process with its own TMPDIR"""
+    temp_dir = tempfile.mkdtemp(prefix="afterchive-bench-")
+    try:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "_worker", json.dumps(spec)],
+            env={**env, "TMPDIR": temp_dir},
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "worker failed")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+def _storage_conf(kind, work_dir, scenario):
+    if kind == "local":
+        path = os.path.join(work_dir, "storage", scenario)
+        shutil.rmtree(path, ignore_errors=True)
+        return {"type": "local", "path": path, "workers": 8}
+    if kind == "s3":
+        return {
+            "type": "s3", "bucket": os.environ.get("BENCH_S3_BUCKET", "afterchive-bench"),
+            "path": f"bench/{scenario}-{int(time.time())}", "workers": 8,
+        }
+    return {
+        "type": "gcs", "bucket": os.environ.get("BENCH_GCS_BUCKET", "afterchive-bench"),
+        "path": f"bench/{scenario}-{int(time.time())}", "workers": 8, "parallel": True,
+    }
+
+
+def _ensure_bucket(bucket_name):
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import storage
+    from google.api_core.exceptions import Conflict
+
+    client = storage.Client(
+        credentials=AnonymousCredentials(), project="test-project-id",
+        client_options={"api_endpoint": os.environ["STORAGE_EMULATOR_HOST"]}
+    )
+    try:
+        client.create_bucket(bucket_name)
+    except Conflict:
+        pass
+
+
+def _ensure_s3_bucket(bucket_name):
+    import boto3
+
+    client = boto3.client("s3", endpoint_url=os.environ["S3_ENDPOINT_URL"])
+    try:
+        client.create_bucket(Bucket=bucket_name)
+    except (client.exceptions.BucketAlreadyOwnedByYou, client.exceptions.BucketAlreadyExists):
+        pass
+
+
+def _throughput(nbytes, seconds):
+    return round(nbytes / MB / max(seconds, 1e-6), 1)
+
+
+def run_scenario(args, shape, variant, storage_kind, env):
+    scenario = f"{shape}-{variant}-{storage_kind}"
+    options = VARIANTS[variant]
+    dump_format = options.get("format", "plain")
+    storage = _storage_conf(storage_kind, args.work_dir, scenario)
+    record = {"scenario": scenario, "shape": shape, "variant": variant, "storage": storage_kind, "options": options}
+
+    if args.mode == "fake":
+        fixture, info = build_fixture(args.work_dir, shape, args.size_mb)
+        env = {**env, "BENCH_FIXTURE": fixture}
+        dump_bytes = info["bytes"]
+        database = {"type": "postgres", "host": "fake", "port": 5432, "user": "bench", "password": "bench", "name": "bench"}
+    else:
+        database = {
+            "type": "postgres", "host": args.db_host, "port": args.db_port, "user": args.db_user,
+            "password": args.db_pass or os.environ.get("PGPASSWORD"), "name": f"afterchive_bench_{shape.replace('-', '_')}",
+        }
+        build_database(database, shape, args.size_mb)
+        dump_bytes = None
+
+    backup = _measure({"mode": args.mode, "action": "backup", "database": database, "storage": storage, "options": options}, env)
+    if dump_bytes is None:
+        # Real dumps: count what pg_dump produced, the stored size if uncompressed
+        dump_bytes = backup["stored_bytes"]
+    backup["dump_bytes"] = dump_bytes
+    backup["mb_per_s"] = _throughput(dump_bytes, backup["seconds"])
+    record["backup"] = backup
+
+    restore_database = {**database, "name": f"{database['name']}_restored"}
+    if args.mode == "postgres":
+        _drop_database(restore_database)
+    report_path = os.path.join(args.work_dir, f"{scenario}.restore.json")
+    restore = _measure(
+        {"mode": args.mode, "action": "restore", "database": restore_database, "storage": storage,
+         "backup": backup["backup"], "options": {k: v for k, v in options.items() if k in ("stream", "jobs")}},
+        {**env, "BENCH_RESTORE_REPORT": report_path}
+    )
+    restore["mb_per_s"] = _throughput(dump_bytes, restore["seconds"])
+    if args.mode == "fake":
+        with open(report_path) as f:
+            restored = json.load(f)
+        restore["verified"] = restored["sha256"] == info["sha256"][dump_format]
+    record["restore"] = restore
+    return record
+
+
+def _drop_database(db_conf):
+    import psycopg2
+    conn = psycopg2.connect(
+        dbname="postgres", user=db_conf["user"], password=db_conf["password"],
+        host=db_conf["host"], port=db_conf["port"]
+    )
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{db_conf["name"]}"')
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="afterchive throughput benchmark")
+    parser.add_argument('--mode', choices=['fake', 'postgres'], default='fake',
+                        help='fake: shim pg_dump/psql serving generated dumps; postgres: a real server')
+    parser.add_argument('--shapes', default=','.join(SHAPES), help=f"Comma-separated shapes ({', '.join(SHAPES)})")
+    parser.add_argument('--variants', default='file,stream,stream-zstd', help=f"Comma-separated variants ({', '.join(VARIANTS)})")
+    parser.add_argument('--storage', default='local', help='Comma-separated storage backends (local, gcs, s3)')
+    parser.add_argument('--size-mb', type=int, default=64, help='Approximate size of each synthetic database')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'afterchive-bench'),
+                        help='Fixtures and local storage (fixtures are reused between runs)')
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=5432)
+    parser.add_argument('--db-user', default='postgres')
+    parser.add_argument('--db-pass')
+    args = parser.parse_args()
+
+    shapes = [shape for shape in args.shapes.split(',') if shape]
+    variants = [variant for variant in args.variants.split(',') if variant]
+    storages = [kind for kind in args.storage.split(',') if kind]
+    for name, known in (("shape", SHAPES), ("variant", VARIANTS), ("storage", ("local", "gcs", "s3"))):
+        unknown = [value for value in {"shape": shapes, "variant": variants, "storage": storages}[name] if value not in known]
+        if unknown:
+            parser.error(f"unknown {name}(s): {', '.join(unknown)}")
+
+    env = dict(os.environ)
+    if args.mode == "fake":
+        env["PATH"] = SHIMS + os.pathsep + env["PATH"]
+    if "gcs" in storages:
+        if not os.environ.get("STORAGE_EMULATOR_HOST"):
+            parser.error("--storage gcs needs STORAGE_EMULATOR_HOST pointing at a GCS emulator")
+        _ensure_bucket(os.environ.get("BENCH_GCS_BUCKET", "afterchive-bench"))
+    if "s3" in storages:
+        if not os.environ.get("S3_ENDPOINT_URL"):
+            parser.error("--storage s3 needs S3_ENDPOINT_URL pointing at MinIO or moto_server")
+        _ensure_s3_bucket(os.environ.get("BENCH_S3_BUCKET", "afterchive-bench"))
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    sys.path.insert(0, REPO_ROOT)
+    from core import __version__
+
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    results = []
+    failed = 0
+    for shape in shapes:
+        for variant in variants:
+            for storage_kind in storages:
+                try:
+                    record = run_scenario(args, shape, variant, storage_kind, env)
+                    print(
+                        f"{record['scenario']}: backup {record['backup']['mb_per_s']} MB/s, "
+                        f"restore {record['restore']['mb_per_s']} MB/s, "
+                        f"peak rss {record['backup']['peak_rss_mb']} MB, "
+                        f"peak temp {record['backup']['peak_temp_mb']} MB",
+                        file=sys.stderr
+                    )
+                    if record["restore"].get("verified") is False:
+                        failed += 1
+                        record["error"] = "restored dump differs from the original"
+                except Exception as e:
+                    failed += 1
+                    record = {"scenario": f"{shape}-{variant}-{storage_kind}", "error": str(e)}
+                    print(f"{record['scenario']}: FAILED {e}", file=sys.stderr)
+                results.append(record)
+
+    report = {
+        "afterchive_version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "started_at": started_at,
+        "mode": args.mode,
+        "size_mb": args.size_mb,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == "_worker":
+        run_worker(json.loads(sys.argv[2]))
+    else:
+        main()
@@ -223,6 +223,508 @@ echo "✓ Restore successful ($RESTORED_COUNT users)"
 echo "✓ Test 2 PASSED"
 echo ""
 
+# ===========================================
+# TEST 3: Fan-out with a failing destination
+# ===========================================
+
+echo "======================================"
+echo "Test 3: Fan-out with a failing destination"
+echo "======================================"
+
+docker-compose exec -T -e DB_PASSWORD=11 afterchive-host \
+    afterchive backup --config /app/tests/fixtures/postgres-fanout.yaml > /tmp/afterchive_fanout.log 2>&1
+FANOUT_STATUS=$?
+
+if [ "$FANOUT_STATUS" -eq 0 ]; then
+    echo "✗ FAILED: Backup exited 0 with a failing destination"
+    cat /tmp/afterchive_fanout.log
+    docker-compose down -v
+    exit 1
+fi
+
+if ! grep -q "✗ gcs:afterchive-missing-bucket/fanout" /tmp/afterchive_fanout.log; then
+    echo "✗ FAILED: The failing destination wasn't reported"
+    cat /tmp/afterchive_fanout.log
+    docker-compose down -v
+    exit 1
+fi
+
+# Catalogued where the upload worked
+LOCAL_CATALOG=$(docker-compose exec -T afterchive-host sh -c "cat /tmp/fanout-backups/catalog.json 2>/dev/null" | grep -c "testdb")
+GCS_CATALOG=$(docker-compose exec -T afterchive-host sh -c "
+curl -s 'http://afterchive-gcs:4443/storage/v1/b/afterchive-test-bucket/o/fanout%2Fcatalog.json?alt=media'
+" | grep -c "testdb")
+
+if [ "$LOCAL_CATALOG" -eq 0 ] || [ "$GCS_CATALOG" -eq 0 ]; then
+    echo "✗ FAILED: Backup missing from the catalogs (local: $LOCAL_CATALOG, gcs: $GCS_CATALOG)"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Failing destination reported, exit status $FANOUT_STATUS"
+echo "✓ Test 3 PASSED"
+echo ""
+
+# ===========================================
+# TEST 4: Interrupted upload is kept and resumed
+# ===========================================
+
+echo "======================================"
+echo "Test 4: Interrupted upload is kept and resumed"
+echo "======================================"
+
+# A few MB of rows, so the dump takes a dozen 256 KiB resumable chunks
+docker-compose exec -T postgres psql -U testuser -d testdb -c "
+CREATE TABLE resume_data AS SELECT g AS id, md5(g::text) AS payload FROM generate_series(1, 60000) g;
+" > /dev/null
+
+# Shared by every run: the spool and checkpoints only match the same backup
+RESUME_SETUP="
+import logging
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+DB = {'type': 'postgres', 'host': 'some-pg', 'port': 5432, 'user': 'testuser', 'password': '11', 'name': 'testdb'}
+STORAGE = {'type': 'gcs', 'bucket': 'afterchive-test-bucket', 'path': 'resume-tests', 'project': 'test-project', 'chunk_size_mb': 0.25}
+"
+
+# A backup whose connection drops for good after three chunks
+INTERRUPTED_BACKUP="
+import requests
+from google.auth.transport.requests import AuthorizedSession
+from core.commands import backup_command
+from core.storage import gcp
+
+gcp.TRANSFER_RETRIES = 0
+request = AuthorizedSession.request
+chunks = []
+
+def dropping(self, method, url, *args, **kwargs):
+    content_range = (kwargs.get('headers') or {}).get('Content-Range', '')
+    if method == 'PUT' and content_range and not content_range.startswith('bytes */'):
+        chunks.append(content_range)
+        if len(chunks) > 3:
+            raise requests.exceptions.ConnectionError('connection dropped by the test')
+    return request(self, method, url, *args, **kwargs)
+
+AuthorizedSession.request = dropping
+backup_command(DB, STORAGE, {})
+"
+
+# First run: the upload fails and the dump is kept
+docker-compose exec -T afterchive-host python3 -c "$RESUME_SETUP$INTERRUPTED_BACKUP" > /tmp/afterchive_resume.log 2>&1
+INTERRUPTED_STATUS=$?
+
+if [ "$INTERRUPTED_STATUS" -eq 0 ] || ! grep -q "for the next attempt to upload" /tmp/afterchive_resume.log; then
+    echo "✗ FAILED: Interrupted upload wasn't reported as failed with the dump kept (exit $INTERRUPTED_STATUS)"
+    cat /tmp/afterchive_resume.log
+    docker-compose down -v
+    exit 1
+fi
+
+CATALOGUED=$(docker-compose exec -T afterchive-host sh -c "
+curl -s -o /dev/null -w '%{http_code}' 'http://afterchive-gcs:4443/storage/v1/b/afterchive-test-bucket/o/resume-tests%2Fcatalog.json'
+")
+if [ "$CATALOGUED" = "200" ]; then
+    echo "✗ FAILED: The failed upload was catalogued"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Upload failed partway, dump kept, nothing catalogued"
+
+# Second run, with --resume: uploads the kept dump from the confirmed offset
+docker-compose exec -T afterchive-host python3 -c "$RESUME_SETUP
+from core.commands import backup_command
+backup_command(DB, STORAGE, {'resume': True})
+" > /tmp/afterchive_resume.log 2>&1
+RESUMED_STATUS=$?
+
+if [ "$RESUMED_STATUS" -ne 0 ] \
+    || ! grep -q "left by an interrupted backup" /tmp/afterchive_resume.log \
+    || ! grep -q "Resuming upload of" /tmp/afterchive_resume.log; then
+    echo "✗ FAILED: The next run didn't resume the kept dump (exit $RESUMED_STATUS)"
+    cat /tmp/afterchive_resume.log
+    docker-compose down -v
+    exit 1
+fi
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_resumed;" > /dev/null 2>&1
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_resumed \
+    --storage gcs \
+    --bucket afterchive-test-bucket \
+    --path resume-tests \
+    --project test-project \
+    --latest \
+    --source-db testdb > /dev/null 2>&1
+
+ORIGINAL_ROWS=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*), md5(string_agg(payload, '' ORDER BY id)) FROM resume_data;")
+RESUMED_ROWS=$(docker-compose exec -T postgres psql -U testuser -d testdb_resumed -tAc "SELECT COUNT(*), md5(string_agg(payload, '' ORDER BY id)) FROM resume_data;")
+
+if [ "$ORIGINAL_ROWS" != "$RESUMED_ROWS" ]; then
+    echo "✗ FAILED: Resumed backup restored '$RESUMED_ROWS', expected '$ORIGINAL_ROWS'"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Resumed upload restored ($RESUMED_ROWS)"
+
+# A run without --resume, like the next scheduled one, dumps again
+docker-compose exec -T afterchive-host python3 -c "$RESUME_SETUP$INTERRUPTED_BACKUP" > /dev/null 2>&1
+docker-compose exec -T afterchive-host python3 -c "$RESUME_SETUP
+from core.commands import backup_command
+backup_command(DB, STORAGE, {})
+" > /tmp/afterchive_resume.log 2>&1
+FRESH_STATUS=$?
+
+if [ "$FRESH_STATUS" -ne 0 ] \
+    || ! grep -q "Discarding .*use --resume to upload it instead" /tmp/afterchive_resume.log \
+    || grep -q "left by an interrupted backup" /tmp/afterchive_resume.log \
+    || ! grep -q "Backup created" /tmp/afterchive_resume.log; then
+    echo "✗ FAILED: A run without --resume didn't discard the kept dump and dump again (exit $FRESH_STATUS)"
+    cat /tmp/afterchive_resume.log
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Run without --resume took a new dump"
+echo "✓ Test 4 PASSED"
+echo ""
+
+# ===========================================
+# TEST 5: Interrupted ranged download resumes
+# ===========================================
+
+echo "======================================"
+echo "Test 5: Interrupted ranged download resumes"
+echo "======================================"
+
+if ! docker-compose exec -T afterchive-host python3 -c "$RESUME_SETUP
+from google.cloud.storage import Blob
+from core.storage import gcp
+from core.storage.gcp import GoogleCloudStorage
+
+gcp.TRANSFER_RETRIES = 0
+storage = GoogleCloudStorage()
+config = {**STORAGE, 'parallel': True, 'part_size_mb': 0.25, 'workers': 2}
+name = next(name for name in storage.list_objects('', config) if name.endswith('.sql'))
+expected = storage._bucket(config).blob(storage._blob_path(name, config)).download_as_bytes()
+
+download = Blob.download_to_file
+ranges = []
+
+def dropping(self, *args, **kwargs):
+    ranges.append(kwargs.get('start'))
+    if len(ranges) > 3:
+        raise ConnectionError('connection dropped by the test')
+    return download(self, *args, **kwargs)
+
+Blob.download_to_file = dropping
+try:
+    storage.retrieve(name, config)
+    raise SystemExit('the download should have failed')
+except ConnectionError:
+    pass
+Blob.download_to_file = download
+
+path = storage.retrieve(name, config)
+with open(path, 'rb') as f:
+    assert f.read() == expected, 'resumed download differs from the object'
+" > /tmp/afterchive_resume.log 2>&1 || ! grep -q "Resuming download of" /tmp/afterchive_resume.log; then
+    echo "✗ FAILED: Ranged download didn't resume from its checkpoint"
+    cat /tmp/afterchive_resume.log
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 5 PASSED"
+echo ""
+
+
+# ===========================================
+# TEST 6: Directory-format parallel backup & restore
+# ===========================================
+
+echo "======================================"
+echo "Test 6: Directory-format parallel backup & restore"
+echo "======================================"
+
+docker-compose exec afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage gcs \
+    --bucket afterchive-test-bucket \
+    --path dir-tests \
+    --project test-project \
+    --format directory \
+    --jobs 2 > /dev/null 2>&1
+
+# Every file of the dump directory is an object under <backup>.dir/
+DIR_BACKUP=$(docker-compose exec afterchive-host sh -c "
+curl -s 'http://afterchive-gcs:4443/storage/v1/b/afterchive-test-bucket/o?prefix=dir-tests/'
+" | python3 -c "
+import sys, json
+names = [item['name'] for item in json.load(sys.stdin).get('items', [])]
+print(next((name.split('/')[1] for name in names if name.endswith('.dir/toc.dat')), ''))
+" | tr -d '\r\n')
+
+if [ -z "$DIR_BACKUP" ]; then
+    echo "✗ FAILED: No directory-format backup with a toc.dat in GCS"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "Backup directory: $DIR_BACKUP"
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_dir;" > /dev/null 2>&1
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_dir \
+    --storage gcs \
+    --bucket afterchive-test-bucket \
+    --path dir-tests \
+    --project test-project \
+    --backup-file "$DIR_BACKUP" \
+    --jobs 2 > /dev/null 2>&1
+
+for TABLE in users posts comments; do
+    ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM $TABLE;")
+    RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_dir -tAc "SELECT COUNT(*) FROM $TABLE;")
+
+    if [ "$ORIGINAL_COUNT" != "$RESTORED_COUNT" ]; then
+        echo "✗ FAILED: $TABLE has $RESTORED_COUNT rows after the directory restore, expected $ORIGINAL_COUNT"
+        docker-compose down -v
+        exit 1
+    fi
+done
+
+echo "✓ Test 6 PASSED"
+echo ""
+
+# ===========================================
+# TEST 7: Composite upload of more than 32 parts
+# ===========================================
+
+echo "======================================"
+echo "Test 7: Composite upload of more than 32 parts"
+echo "======================================"
+
+# 41 parts of 64 KiB: GCS composes at most 32 sources, so this takes two rounds
+if ! docker-compose exec -T afterchive-host python3 -c "$RESUME_SETUP
+import os
+from core.storage.gcp import GoogleCloudStorage
+
+storage = GoogleCloudStorage()
+config = {**STORAGE, 'path': 'composite-tests', 'parallel': True, 'part_size_mb': 0.0625, 'workers': 4}
+path = '/tmp/composite.bin'
+with open(path, 'wb') as f:
+    f.write(os.urandom(40 * 65536 + 1234))
+with open(path, 'rb') as f:
+    expected = f.read()
+
+storage.store(path, config)
+blob = storage._bucket(config).blob(storage._blob_path('composite.bin', config))
+assert blob.download_as_bytes() == expected, 'composed object differs from the file'
+with open(storage.retrieve('composite.bin', config), 'rb') as f:
+    assert f.read() == expected, 'ranged download differs from the file'
+leftovers = [name for name in storage.list_objects('', config) if '.parts/' in name]
+assert not leftovers, f'parts left behind: {leftovers}'
+" > /tmp/afterchive_composite.log 2>&1 || ! grep -q "in 41 part(s)" /tmp/afterchive_composite.log; then
+    echo "✗ FAILED: 41-part composite upload didn't round-trip byte for byte"
+    cat /tmp/afterchive_composite.log
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ 41 parts composed into an identical object"
+
+# A backup that needs more than 32 parts restores to the same rows
+if ! docker-compose exec -T afterchive-host python3 -c "$RESUME_SETUP
+from core.commands import backup_command
+backup_command(DB, {**STORAGE, 'path': 'composite-tests', 'parallel': True, 'part_size_mb': 0.0625}, {})
+" > /tmp/afterchive_composite.log 2>&1; then
+    echo "✗ FAILED: Composite backup failed"
+    cat /tmp/afterchive_composite.log
+    docker-compose down -v
+    exit 1
+fi
+
+PARTS=$(sed -n 's/.*Uploaded .* in \([0-9]*\) part(s).*/\1/p' /tmp/afterchive_composite.log | head -n1)
+if [ -z "$PARTS" ] || [ "$PARTS" -le 32 ]; then
+    echo "✗ FAILED: Expected a backup of more than 32 parts, got '$PARTS'"
+    cat /tmp/afterchive_composite.log
+    docker-compose down -v
+    exit 1
+fi
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_composite;" > /dev/null 2>&1
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_composite \
+    --storage gcs \
+    --bucket afterchive-test-bucket \
+    --path composite-tests \
+    --project test-project \
+    --latest \
+    --source-db testdb > /dev/null 2>&1
+
+ORIGINAL_ROWS=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*), md5(string_agg(payload, '' ORDER BY id)) FROM resume_data;")
+COMPOSITE_ROWS=$(docker-compose exec -T postgres psql -U testuser -d testdb_composite -tAc "SELECT COUNT(*), md5(string_agg(payload, '' ORDER BY id)) FROM resume_data;")
+
+if [ "$ORIGINAL_ROWS" != "$COMPOSITE_ROWS" ]; then
+    echo "✗ FAILED: $PARTS-part backup restored '$COMPOSITE_ROWS', expected '$ORIGINAL_ROWS'"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ $PARTS-part backup restored ($COMPOSITE_ROWS)"
+echo "✓ Test 7 PASSED"
+echo ""
+
+# ===========================================
+# TEST 8: Preflight failures stop before any storage work
+# ===========================================
+
+echo "======================================"
+echo "Test 8: Preflight failures stop before any storage work"
+echo "======================================"
+
+# A pg_dump older than the server, first on PATH for the third case
+docker-compose exec -T afterchive-host sh -c '
+mkdir -p /tmp/old-pg
+printf "#!/bin/sh\necho \"pg_dump (PostgreSQL) 12.0\"\n" > /tmp/old-pg/pg_dump
+chmod +x /tmp/old-pg/pg_dump
+'
+
+for CASE in "wrong-password|WRONGPASSWORD|testdb|Authentication failed" \
+            "missing-database|11|does_not_exist|Cannot connect to database 'does_not_exist'" \
+            "old-pg_dump|11|testdb|is too old for this database"; do
+    IFS='|' read -r NAME PASSWORD DATABASE EXPECTED <<< "$CASE"
+    if [ "$NAME" = "old-pg_dump" ]; then EXTRA_PATH=/tmp/old-pg:; else EXTRA_PATH=; fi
+
+    docker-compose exec -T afterchive-host sh -c "PATH=$EXTRA_PATH\$PATH afterchive backup \
+        --db-type postgres \
+        --db-host some-pg \
+        --db-port 5432 \
+        --db-pass $PASSWORD \
+        --db-user testuser \
+        --db-name $DATABASE \
+        --storage gcs \
+        --bucket afterchive-test-bucket \
+        --path preflight-tests \
+        --project test-project \
+        --stream" > /tmp/afterchive_preflight.log 2>&1
+    STATUS=$?
+
+    # The GCS client is only created once something is uploaded
+    if [ "$STATUS" -eq 0 ] \
+        || ! grep -q "$EXPECTED" /tmp/afterchive_preflight.log \
+        || grep -q "Using GCS emulator" /tmp/afterchive_preflight.log; then
+        echo "✗ FAILED ($NAME): expected exit 1 with '$EXPECTED' before touching storage (exit $STATUS)"
+        cat /tmp/afterchive_preflight.log
+        docker-compose down -v
+        exit 1
+    fi
+    echo "✓ $NAME rejected before any upload"
+done
+
+PREFLIGHT_OBJECTS=$(docker-compose exec -T afterchive-host sh -c "
+curl -s 'http://afterchive-gcs:4443/storage/v1/b/afterchive-test-bucket/o?prefix=preflight-tests/'
+" | python3 -c "import sys, json; print(len(json.load(sys.stdin).get('items', [])))")
+
+if [ "$PREFLIGHT_OBJECTS" != "0" ]; then
+    echo "✗ FAILED: $PREFLIGHT_OBJECTS objects stored by backups that failed their preflight"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 8 PASSED"
+echo ""
+
+# ===========================================
+# TEST 9: Parts of an abandoned composite upload are deleted
+# ===========================================
+
+echo "======================================"
+echo "Test 9: Parts of an abandoned composite upload are deleted"
+echo "======================================"
+
+PARTS_SETUP="$RESUME_SETUP
+STORAGE = {**STORAGE, 'path': 'parts-tests', 'parallel': True, 'part_size_mb': 0.25, 'workers': 1}
+"
+
+# The fifth part fails, the four before it stay in the bucket for a --resume
+docker-compose exec -T afterchive-host python3 -c "$PARTS_SETUP
+from google.cloud.storage import Blob
+from core.commands import backup_command
+
+upload = Blob.upload_from_file
+parts = []
+
+def dropping(self, *args, **kwargs):
+    parts.append(self.name)
+    if len(parts) > 4:
+        raise ConnectionError('connection dropped by the test')
+    return upload(self, *args, **kwargs)
+
+Blob.upload_from_file = dropping
+backup_command(DB, STORAGE, {})
+" > /tmp/afterchive_parts.log 2>&1
+
+count_parts() {
+    docker-compose exec -T afterchive-host sh -c "
+    curl -s 'http://afterchive-gcs:4443/storage/v1/b/afterchive-test-bucket/o?prefix=parts-tests/'
+    " | python3 -c "import sys, json; print(sum('.parts/' in item['name'] for item in json.load(sys.stdin).get('items', [])))"
+}
+
+LEFT_PARTS=$(count_parts)
+if [ "$LEFT_PARTS" -eq 0 ]; then
+    echo "✗ FAILED: The interrupted composite upload left no parts to resume from"
+    cat /tmp/afterchive_parts.log
+    docker-compose down -v
+    exit 1
+fi
+
+# The next scheduled run doesn't resume: it drops the dump and its parts
+docker-compose exec -T afterchive-host python3 -c "$PARTS_SETUP
+from core.commands import backup_command
+backup_command(DB, STORAGE, {})
+" > /tmp/afterchive_parts.log 2>&1
+PARTS_STATUS=$?
+
+if [ "$PARTS_STATUS" -ne 0 ] || [ "$(count_parts)" -ne 0 ] \
+    || ! grep -q "Discarded the interrupted upload" /tmp/afterchive_parts.log; then
+    echo "✗ FAILED: $LEFT_PARTS parts of the abandoned upload weren't deleted (exit $PARTS_STATUS)"
+    cat /tmp/afterchive_parts.log
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ $LEFT_PARTS abandoned parts deleted"
+echo "✓ Test 9 PASSED"
+echo ""
 
 echo ""
 echo "======================================"
@@ -259,7 +259,892 @@ fi
 
 echo "✓ Test 5 PASSED"
 
+echo ""
+echo "======================================"
+echo "Test6: Streaming backup PG --> Local"
+echo "======================================"
+
+docker-compose exec afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/stream-backups \
+    --stream > /dev/null
+
+STREAM_FILE=$(docker-compose exec afterchive-host sh -c "ls -t /tmp/stream-backups/ | head -n1" | tr -d '\r')
+echo "Backup file: $STREAM_FILE"
+
+if echo "$STREAM_FILE" | grep -q ".partial"; then
+    echo "✗ Test 6 FAILED: partial stream file left behind"
+    docker-compose down -v
+    exit 1
+fi
+
+STREAM_SIZE=$(docker-compose exec afterchive-host sh -c "stat -c%s /tmp/stream-backups/$STREAM_FILE")
+
+if [ "$STREAM_SIZE" -lt 100 ]; then
+    echo "✗ Test 6 FAILED: Streamed backup file size too small"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "Restoring from streamed backup..."
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_restored_stream;" > /dev/null 2>&1
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_restored_stream \
+    --storage local \
+    --path /tmp/stream-backups \
+    --backup-file "$STREAM_FILE" \
+    --stream > /dev/null
+
+ORIGINAL_DATA=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT username FROM users ORDER BY id;")
+RESTORED_DATA=$(docker-compose exec -T postgres psql -U testuser -d testdb_restored_stream -tAc "SELECT username FROM users ORDER BY id;")
+
+if [ "$ORIGINAL_DATA" != "$RESTORED_DATA" ]; then
+    echo "✗ FAILED: Streamed restore data mismatch"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 6 PASSED"
+
+
+
+echo ""
+echo "======================================"
+echo "Test7: Deduplicated backups PG --> Local"
+echo "======================================"
+
+for RUN in 1 2; do
+    docker-compose exec afterchive-host afterchive backup \
+        --db-type postgres \
+        --db-host some-pg \
+        --db-port 5432 \
+        --db-pass 11 \
+        --db-user testuser \
+        --db-name testdb \
+        --storage local \
+        --path /tmp/dedup-backups \
+        --stream --dedup > /tmp/afterchive_dedup_$RUN.log 2>&1
+    sleep 1
+done
+
+# The second run knows every chunk from the first run's index, no lookups
+if ! grep -q "0 new, 0 looked up" /tmp/afterchive_dedup_2.log; then
+    echo "✗ Test 7 FAILED: the second backup didn't take its chunks from the previous index"
+    cat /tmp/afterchive_dedup_2.log
+    docker-compose down -v
+    exit 1
+fi
+
+INDEX_COUNT=$(docker-compose exec afterchive-host sh -c "ls /tmp/dedup-backups/*.chunks 2>/dev/null | wc -l" | tr -d '\r')
+CHUNK_COUNT=$(docker-compose exec afterchive-host sh -c "find /tmp/dedup-backups/chunks -type f | wc -l" | tr -d '\r')
+INDEX_CHUNKS=$(docker-compose exec afterchive-host sh -c "python3 -c \"import json,sys; print(len(json.load(open(sys.argv[1]))['chunks']))\" \$(ls /tmp/dedup-backups/*.chunks | head -n1)" | tr -d '\r')
+
+if [ "$INDEX_COUNT" -ne 2 ] || [ "$CHUNK_COUNT" -ne "$INDEX_CHUNKS" ]; then
+    echo "✗ Test 7 FAILED: expected 2 indexes sharing $INDEX_CHUNKS chunks, found $INDEX_COUNT indexes and $CHUNK_COUNT chunks"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Unchanged database stored no new chunks"
+
+DEDUP_FILE=$(docker-compose exec afterchive-host sh -c "ls -t /tmp/dedup-backups/ | grep '.chunks$' | head -n1" | tr -d '\r')
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_restored_dedup;" > /dev/null 2>&1
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_restored_dedup \
+    --storage local \
+    --path /tmp/dedup-backups \
+    --backup-file "$DEDUP_FILE" > /dev/null
+
+ORIGINAL_DATA=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT username FROM users ORDER BY id;")
+RESTORED_DATA=$(docker-compose exec -T postgres psql -U testuser -d testdb_restored_dedup -tAc "SELECT username FROM users ORDER BY id;")
+
+if [ "$ORIGINAL_DATA" != "$RESTORED_DATA" ]; then
+    echo "✗ FAILED: Deduplicated restore data mismatch"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 7 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test8: run-jobs with a failing job"
+echo "======================================"
+
+if docker-compose exec -e DB_PASSWORD=11 afterchive-host afterchive run-jobs \
+    --config tests/fixtures/postgres-jobs.yaml > /tmp/run-jobs.log 2>&1; then
+    echo "✗ Test 8 FAILED: run-jobs should exit non-zero when a job fails"
+    docker-compose down -v
+    exit 1
+fi
+
+PLAIN_COUNT=$(docker-compose exec afterchive-host sh -c "ls /tmp/job-backups/default/*.sql 2>/dev/null | wc -l" | tr -d '\r')
+CUSTOM_COUNT=$(docker-compose exec afterchive-host sh -c "ls /tmp/job-backups/custom/*.dump 2>/dev/null | wc -l" | tr -d '\r')
+
+if [ "$PLAIN_COUNT" -eq 0 ] || [ "$CUSTOM_COUNT" -eq 0 ]; then
+    echo "✗ Test 8 FAILED: the healthy jobs didn't store their backups"
+    docker-compose down -v
+    exit 1
+fi
+
+if ! grep -q "2 of 3 jobs succeeded" /tmp/run-jobs.log; then
+    echo "✗ Test 8 FAILED: summary missing"
+    cat /tmp/run-jobs.log
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 8 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test9: Run report and Prometheus metrics"
+echo "======================================"
+
+docker-compose exec afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/report-backups \
+    --stream --compress zstd \
+    --report /tmp/reports/run.json \
+    --prometheus-file /tmp/reports/afterchive.prom > /dev/null
+
+STAGES=$(docker-compose exec afterchive-host python3 -c \
+    "import json; r = json.load(open('/tmp/reports/run.json')); print(r['status'], ','.join(s['name'] for s in r['stages']))" | tr -d '\r')
+
+if [ "$STAGES" != "success preflight,dump,compress,upload,manifest" ]; then
+    echo "✗ Test 9 FAILED: unexpected report: $STAGES"
+    docker-compose down -v
+    exit 1
+fi
+
+if ! docker-compose exec afterchive-host grep -q 'afterchive_stage_seconds{command="backup",database="testdb",stage="dump"}' /tmp/reports/afterchive.prom; then
+    echo "✗ Test 9 FAILED: Prometheus file missing stage metrics"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 9 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test10: Native engine backup and restore PG --> Local"
+echo "======================================"
+
+docker-compose exec afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/native-backups \
+    --engine native --jobs 3 --stream > /dev/null
+
+NATIVE_FILE=$(docker-compose exec afterchive-host ls -t /tmp/native-backups/ | grep '\.sql$' | head -n1 | tr -d '\r\n')
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_native \
+    --storage local \
+    --path /tmp/native-backups \
+    --backup-file "$NATIVE_FILE" > /dev/null
+
+# Same dump through the parallel COPY restore
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_native_load \
+    --storage local \
+    --path /tmp/native-backups \
+    --backup-file "$NATIVE_FILE" \
+    --engine native --jobs 3 --load-setting synchronous_commit=off > /dev/null
+
+for TARGET in testdb_native testdb_native_load; do
+    for TABLE in users posts comments; do
+        ORIGINAL_DATA=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT md5(string_agg(t::text, ',' ORDER BY t::text)) FROM $TABLE t;")
+        RESTORED_DATA=$(docker-compose exec -T postgres psql -U testuser -d $TARGET -tAc "SELECT md5(string_agg(t::text, ',' ORDER BY t::text)) FROM $TABLE t;")
+        if [ "$ORIGINAL_DATA" != "$RESTORED_DATA" ]; then
+            echo "✗ Test 10 FAILED: $TABLE differs in $TARGET"
+            docker-compose down -v
+            exit 1
+        fi
+    done
+
+    # Foreign keys come back after the data
+    FK_COUNT=$(docker-compose exec -T postgres psql -U testuser -d $TARGET -tAc "SELECT count(*) FROM pg_constraint WHERE contype = 'f';" | tr -d '\r')
+    if [ "$FK_COUNT" -eq 0 ]; then
+        echo "✗ Test 10 FAILED: foreign keys missing in $TARGET"
+        docker-compose down -v
+        exit 1
+    fi
+done
+
+echo "✓ Test 10 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test11: Catalog list and restore --latest"
+echo "======================================"
+
+if ! docker-compose exec afterchive-host afterchive list --storage local --path /tmp/native-backups | grep -q "$NATIVE_FILE"; then
+    echo "✗ Test 11 FAILED: $NATIVE_FILE missing from afterchive list"
+    docker-compose down -v
+    exit 1
+fi
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_latest \
+    --storage local \
+    --path /tmp/native-backups \
+    --latest --source-db testdb > /dev/null
+
+ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM users;")
+RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_latest -tAc "SELECT COUNT(*) FROM users;")
+if [ "$ORIGINAL_COUNT" != "$RESTORED_COUNT" ]; then
+    echo "✗ Test 11 FAILED: restore --latest restored $RESTORED_COUNT of $ORIGINAL_COUNT users"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 11 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test12: Retention keeps the newest backup"
+echo "======================================"
+
+for RUN in 1 2; do
+    docker-compose exec afterchive-host afterchive backup \
+        --db-type postgres \
+        --db-host some-pg \
+        --db-port 5432 \
+        --db-pass 11 \
+        --db-user testuser \
+        --db-name testdb \
+        --storage local \
+        --path /tmp/retention-backups \
+        --stream > /dev/null
+    # Backup names have a one second resolution
+    sleep 1
+done
+
+docker-compose exec afterchive-host afterchive prune \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/retention-backups \
+    --keep-last 1 > /dev/null
+
+BACKUP_COUNT=$(docker-compose exec afterchive-host ls /tmp/retention-backups/ | grep -c '\.sql\r\?$')
+LISTED_COUNT=$(docker-compose exec afterchive-host afterchive list --storage local --path /tmp/retention-backups --json | grep -c '"backup"')
+if [ "$BACKUP_COUNT" -ne 1 ] || [ "$LISTED_COUNT" -ne 1 ]; then
+    echo "✗ Test 12 FAILED: expected 1 backup after pruning, found $BACKUP_COUNT files and $LISTED_COUNT catalog entries"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 12 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test13: Verify backups by metadata and by hashing"
+echo "======================================"
+
+for MODE in "" "--deep"; do
+    if ! docker-compose exec afterchive-host afterchive verify --storage local --path /tmp/native-backups $MODE > /dev/null; then
+        echo "✗ Test 13 FAILED: verify $MODE reported a problem"
+        docker-compose down -v
+        exit 1
+    fi
+done
+
+# Same size, different bytes: only the deep check can tell
+docker-compose exec afterchive-host sh -c "printf 'X' | dd of=/tmp/native-backups/$NATIVE_FILE bs=1 seek=10 conv=notrunc 2>/dev/null"
+if docker-compose exec afterchive-host afterchive verify --storage local --path /tmp/native-backups --backup-file "$NATIVE_FILE" --deep > /dev/null; then
+    echo "✗ Test 13 FAILED: verify --deep missed a corrupted backup"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 13 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test14: Restore a single table from a custom-format backup"
+echo "======================================"
+
+docker-compose exec afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/selective-backups \
+    --format custom \
+    --stream > /dev/null
+
+SELECTIVE_FILE=$(docker-compose exec afterchive-host sh -c "ls /tmp/selective-backups | grep '\.dump$'" | tr -d '\r')
+
+# Streamed archives get their data blocks indexed in the manifest
+if ! docker-compose exec afterchive-host grep -q '"blocks"' "/tmp/selective-backups/$SELECTIVE_FILE.manifest.json"; then
+    echo "✗ Test 14 FAILED: no block index in the manifest of $SELECTIVE_FILE"
+    docker-compose down -v
+    exit 1
+fi
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_restored_table;" > /dev/null 2>&1
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_restored_table \
+    --storage local \
+    --path /tmp/selective-backups \
+    --backup-file "$SELECTIVE_FILE" \
+    --table users > /dev/null
+
+ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM users;")
+RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_restored_table -tAc "SELECT COUNT(*) FROM users;")
+OTHER_TABLES=$(docker-compose exec -T postgres psql -U testuser -d testdb_restored_table -tAc "SELECT COUNT(*) FROM pg_tables WHERE tablename = 'posts';")
+
+if [ "$ORIGINAL_COUNT" != "$RESTORED_COUNT" ] || [ "$(echo "$OTHER_TABLES" | tr -d '[:space:]')" != "0" ]; then
+    echo "✗ Test 14 FAILED: expected only users ($ORIGINAL_COUNT rows), got $RESTORED_COUNT rows and posts=$OTHER_TABLES"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 14 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test15: Encrypted backup and restore"
+echo "======================================"
+
+ENCRYPTION_KEY=$(openssl rand -base64 32)
+
+docker-compose exec -e AFTERCHIVE_ENCRYPTION_KEY="$ENCRYPTION_KEY" afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/encrypted-backups \
+    --compress zstd \
+    --encrypt \
+    --stream > /dev/null
+
+ENCRYPTED_FILE=$(docker-compose exec afterchive-host sh -c "ls /tmp/encrypted-backups | grep '\.enc$'" | tr -d '\r')
+
+if [ -z "$ENCRYPTED_FILE" ]; then
+    echo "✗ Test 15 FAILED: no .enc backup in /tmp/encrypted-backups"
+    docker-compose down -v
+    exit 1
+fi
+
+# Without the key the backup must not restore
+if docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_encrypted \
+    --storage local \
+    --path /tmp/encrypted-backups \
+    --backup-file "$ENCRYPTED_FILE" > /dev/null 2>&1; then
+    echo "✗ Test 15 FAILED: $ENCRYPTED_FILE restored without a key"
+    docker-compose down -v
+    exit 1
+fi
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_encrypted;" > /dev/null 2>&1
+
+docker-compose exec -e AFTERCHIVE_ENCRYPTION_KEY="$ENCRYPTION_KEY" afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_encrypted \
+    --storage local \
+    --path /tmp/encrypted-backups \
+    --backup-file "$ENCRYPTED_FILE" \
+    --stream > /dev/null
+
+ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM users;")
+RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_encrypted -tAc "SELECT COUNT(*) FROM users;")
+
+if [ "$ORIGINAL_COUNT" != "$RESTORED_COUNT" ]; then
+    echo "✗ Test 15 FAILED: expected $ORIGINAL_COUNT users, got $RESTORED_COUNT"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 15 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test16: Physical base backup and WAL archive"
+echo "======================================"
+
+# pg_basebackup connects for replication, which "host all" doesn't cover
+docker-compose exec -T postgres sh -c 'echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"'
+docker-compose exec -T postgres psql -U testuser -d postgres -c "SELECT pg_reload_conf();" > /dev/null
+
+docker-compose exec afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/physical-backups \
+    --engine pg_basebackup \
+    --compress zstd \
+    --stream > /dev/null
+
+BASE_FILE=$(docker-compose exec afterchive-host sh -c "ls /tmp/physical-backups | grep '\.base\.tar\.zst$'" | tr -d '\r')
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/physical-backups \
+    --backup-file "$BASE_FILE" \
+    --data-dir /tmp/restored-pgdata \
+    --stream > /dev/null
+
+if ! docker-compose exec afterchive-host test -f /tmp/restored-pgdata/PG_VERSION \
+    || ! docker-compose exec afterchive-host test -f /tmp/restored-pgdata/recovery.signal \
+    || ! docker-compose exec afterchive-host grep -q "wal-fetch" /tmp/restored-pgdata/postgresql.auto.conf; then
+    echo "✗ Test 16 FAILED: $BASE_FILE did not restore into a data directory set up for recovery"
+    docker-compose down -v
+    exit 1
+fi
+
+# archive_command / restore_command round trip of a WAL segment
+docker-compose exec afterchive-host sh -c "mkdir -p /tmp/wal-test/pg_wal/archive_status && head -c 16777216 /dev/urandom > /tmp/wal-test/pg_wal/000000010000000000000001"
+docker-compose exec afterchive-host afterchive wal-push \
+    --storage local \
+    --path /tmp/physical-backups \
+    --compress zstd \
+    /tmp/wal-test/pg_wal/000000010000000000000001 > /dev/null
+docker-compose exec afterchive-host afterchive wal-fetch \
+    --storage local \
+    --path /tmp/physical-backups \
+    000000010000000000000001 /tmp/wal-test/RECOVERYXLOG > /dev/null
+
+if ! docker-compose exec afterchive-host cmp -s /tmp/wal-test/pg_wal/000000010000000000000001 /tmp/wal-test/RECOVERYXLOG; then
+    echo "✗ Test 16 FAILED: the fetched WAL segment differs from the archived one"
+    docker-compose down -v
+    exit 1
+fi
+
+# A segment that was never archived ends recovery with a non-zero exit
+if docker-compose exec afterchive-host afterchive wal-fetch \
+    --storage local \
+    --path /tmp/physical-backups \
+    000000010000000000000002 /tmp/wal-test/RECOVERYXLOG > /dev/null 2>&1; then
+    echo "✗ Test 16 FAILED: wal-fetch succeeded for a segment that isn't archived"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 16 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test17: Throttled backup and restore"
+echo "======================================"
+
+docker-compose exec afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/throttled-backups \
+    --throttle \
+    --stream > /dev/null
+
+THROTTLED_FILE=$(docker-compose exec afterchive-host sh -c "ls /tmp/throttled-backups | grep '\.sql$'" | tr -d '\r')
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_throttled;" > /dev/null 2>&1
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_throttled \
+    --storage local \
+    --path /tmp/throttled-backups \
+    --backup-file "$THROTTLED_FILE" \
+    --stream > /dev/null
+
+ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM users;")
+RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_throttled -tAc "SELECT COUNT(*) FROM users;")
+
+if [ -z "$THROTTLED_FILE" ] || [ "$ORIGINAL_COUNT" != "$RESTORED_COUNT" ]; then
+    echo "✗ Test 17 FAILED: expected $ORIGINAL_COUNT users from the throttled backup, got $RESTORED_COUNT"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 17 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test18: Throttling paces a compressed stream backup"
+echo "======================================"
+
+# About 4 MB of dump, at most 1 MB/s, slower while the server is busy
+docker-compose exec -T postgres psql -U testuser -d testdb -c "
+CREATE TABLE throttle_data AS SELECT g AS id, md5(g::text) AS payload FROM generate_series(1, 100000) g;
+" > /dev/null
+
+# Three busy sessions put the load over max_active_sessions
+for i in 1 2 3; do
+    docker-compose exec -T postgres psql -U testuser -d testdb -c "SELECT pg_sleep(20);" > /dev/null 2>&1 &
+done
+sleep 2
+
+THROTTLE_START=$(date +%s)
+if ! docker-compose exec -T -e DB_PASSWORD=11 afterchive-host \
+    afterchive backup --config tests/fixtures/postgres-throttle.yaml > /tmp/afterchive_throttle.log 2>&1; then
+    echo "✗ Test 18 FAILED: Backup command failed"
+    cat /tmp/afterchive_throttle.log
+    docker-compose down -v
+    exit 1
+fi
+THROTTLE_SECONDS=$(( $(date +%s) - THROTTLE_START ))
+wait
+
+# Unpaced, the dump takes well under a second; the slowed dump rate is logged
+if [ "$THROTTLE_SECONDS" -lt 3 ] || ! grep -q "slowing to 50% (dump" /tmp/afterchive_throttle.log; then
+    echo "✗ Test 18 FAILED: the gzip-compressed dump wasn't paced (${THROTTLE_SECONDS}s)"
+    cat /tmp/afterchive_throttle.log
+    docker-compose down -v
+    exit 1
+fi
+
+if ! docker-compose exec -T afterchive-host sh -c "ls /tmp/throttled-gzip-backups" | grep -q "\.gz$"; then
+    echo "✗ Test 18 FAILED: no .gz backup in /tmp/throttled-gzip-backups"
+    docker-compose down -v
+    exit 1
+fi
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_throttled_gzip;" > /dev/null 2>&1
+
+docker-compose exec -T -e DB_PASSWORD=11 afterchive-host \
+    afterchive restore --config tests/fixtures/postgres-throttle.yaml --latest --source-db testdb > /dev/null
+
+ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM throttle_data;")
+RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_throttled_gzip -tAc "SELECT COUNT(*) FROM throttle_data;")
+
+if [ "$ORIGINAL_COUNT" != "$RESTORED_COUNT" ]; then
+    echo "✗ Test 18 FAILED: expected $ORIGINAL_COUNT rows from the throttled gzip backup, got $RESTORED_COUNT"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Dump paced to ${THROTTLE_SECONDS}s with gzip on"
+echo "✓ Test 18 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test19: Compressed backup and restore with gzip and zstd"
+echo "======================================"
+
+for CODEC in gzip zstd; do
+    if [ "$CODEC" = "gzip" ]; then SUFFIX="gz"; else SUFFIX="zst"; fi
+
+    docker-compose exec afterchive-host afterchive backup \
+        --db-type postgres \
+        --db-host some-pg \
+        --db-port 5432 \
+        --db-pass 11 \
+        --db-user testuser \
+        --db-name testdb \
+        --storage local \
+        --path /tmp/$CODEC-backups \
+        --compress $CODEC > /dev/null
+
+    COMPRESSED_FILE=$(docker-compose exec afterchive-host sh -c "ls /tmp/$CODEC-backups | grep '\.sql\.$SUFFIX$'" | tr -d '\r')
+
+    if [ -z "$COMPRESSED_FILE" ]; then
+        echo "✗ Test 19 FAILED: no .sql.$SUFFIX backup in /tmp/$CODEC-backups"
+        docker-compose down -v
+        exit 1
+    fi
+
+    docker-compose exec -T postgres psql -U testuser -d postgres \
+        -c "DROP DATABASE IF EXISTS testdb_$CODEC;" > /dev/null 2>&1
+
+    docker-compose exec afterchive-host afterchive restore \
+        --db-type postgres \
+        --db-host some-pg \
+        --db-port 5432 \
+        --db-pass 11 \
+        --db-user testuser \
+        --db-name testdb_$CODEC \
+        --storage local \
+        --path /tmp/$CODEC-backups \
+        --backup-file "$COMPRESSED_FILE" > /dev/null
+
+    for TABLE in users posts comments; do
+        ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM $TABLE;")
+        RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_$CODEC -tAc "SELECT COUNT(*) FROM $TABLE;")
+
+        if [ "$ORIGINAL_COUNT" != "$RESTORED_COUNT" ]; then
+            echo "✗ Test 19 FAILED: $TABLE has $RESTORED_COUNT rows after the $CODEC restore, expected $ORIGINAL_COUNT"
+            docker-compose down -v
+            exit 1
+        fi
+    done
+
+    echo "✓ $CODEC backup $COMPRESSED_FILE restored"
+done
+
+echo "✓ Test 19 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test20: Directory-format parallel backup and restore"
+echo "======================================"
+
+docker-compose exec afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage local \
+    --path /tmp/dir-backups \
+    --format directory \
+    --jobs 2 > /dev/null
+
+DIR_BACKUP=$(docker-compose exec afterchive-host sh -c "ls /tmp/dir-backups | grep '\.dir$'" | tr -d '\r')
+
+# pg_dump -Fd writes a table of contents next to one file per table
+if [ -z "$DIR_BACKUP" ] || ! docker-compose exec afterchive-host test -f "/tmp/dir-backups/$DIR_BACKUP/toc.dat"; then
+    echo "✗ Test 20 FAILED: no .dir backup with a toc.dat in /tmp/dir-backups"
+    docker-compose down -v
+    exit 1
+fi
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_dir;" > /dev/null 2>&1
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_dir \
+    --storage local \
+    --path /tmp/dir-backups \
+    --backup-file "$DIR_BACKUP" \
+    --jobs 2 > /dev/null
+
+for TABLE in users posts comments; do
+    ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM $TABLE;")
+    RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_dir -tAc "SELECT COUNT(*) FROM $TABLE;")
+
+    if [ "$ORIGINAL_COUNT" != "$RESTORED_COUNT" ]; then
+        echo "✗ Test 20 FAILED: $TABLE has $RESTORED_COUNT rows after pg_restore -j, expected $ORIGINAL_COUNT"
+        docker-compose down -v
+        exit 1
+    fi
+done
+
+echo "✓ Test 20 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test21: Restoring in place leaves the stored backup untouched"
+echo "======================================"
+
+# Local restores read the stored backup itself instead of a copy
+for FORMAT in plain custom directory; do
+    docker-compose exec afterchive-host afterchive backup \
+        --db-type postgres \
+        --db-host some-pg \
+        --db-port 5432 \
+        --db-pass 11 \
+        --db-user testuser \
+        --db-name testdb \
+        --storage local \
+        --path /tmp/inplace-$FORMAT \
+        --format $FORMAT > /dev/null
+
+    STORED=$(docker-compose exec afterchive-host sh -c "ls /tmp/inplace-$FORMAT | grep -E '\.(sql|dump|dir)$'" | tr -d '\r')
+    CHECKSUM="cd /tmp/inplace-$FORMAT && find $STORED -type f | sort | xargs sha256sum"
+    BEFORE=$(docker-compose exec -T afterchive-host sh -c "$CHECKSUM")
+
+    # Twice: the second restore needs the file the first one read
+    for ROUND in 1 2; do
+        docker-compose exec -T postgres psql -U testuser -d postgres \
+            -c "DROP DATABASE IF EXISTS testdb_inplace;" > /dev/null 2>&1
+
+        docker-compose exec afterchive-host afterchive restore \
+            --db-type postgres \
+            --db-host some-pg \
+            --db-port 5432 \
+            --db-pass 11 \
+            --db-user testuser \
+            --db-name testdb_inplace \
+            --storage local \
+            --path /tmp/inplace-$FORMAT \
+            --backup-file "$STORED" > /dev/null
+
+        ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM users;")
+        RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_inplace -tAc "SELECT COUNT(*) FROM users;")
+        AFTER=$(docker-compose exec -T afterchive-host sh -c "$CHECKSUM")
+
+        if [ -z "$STORED" ] || [ "$ORIGINAL_COUNT" != "$RESTORED_COUNT" ] || [ -z "$AFTER" ] || [ "$BEFORE" != "$AFTER" ]; then
+            echo "✗ Test 21 FAILED: $FORMAT restore $ROUND of $STORED restored $RESTORED_COUNT users (expected $ORIGINAL_COUNT) or changed the stored backup"
+            docker-compose exec afterchive-host ls -la /tmp/inplace-$FORMAT
+            docker-compose down -v
+            exit 1
+        fi
+    done
+
+    echo "✓ $STORED restored twice and still stored unchanged"
+done
+
+echo "✓ Test 21 PASSED"
+
+echo ""
+echo "======================================"
+echo "Test22: Pruning while a deduplicated backup is stored"
+echo "======================================"
+
+# About 3 MB of dump, stored at 1 MB/s
+docker-compose exec -T postgres psql -U testuser -d testdb -c "
+CREATE TABLE prune_data AS SELECT g AS id, md5(g::text) AS payload FROM generate_series(1, 60000) g;
+" > /dev/null
+
+for RUN in 1 2; do
+    docker-compose exec -T -e DB_PASSWORD=11 afterchive-host \
+        afterchive backup --config tests/fixtures/postgres-dedup-prune.yaml > /dev/null 2>&1
+    sleep 1
+done
+
+# Rows the next backup uploads as new chunks, which no stored index refers to yet
+docker-compose exec -T postgres psql -U testuser -d testdb -c "
+INSERT INTO prune_data SELECT g, md5((g * 7)::text) FROM generate_series(60001, 80000) g;
+" > /dev/null
+
+docker-compose exec -T -e DB_PASSWORD=11 afterchive-host \
+    afterchive backup --config tests/fixtures/postgres-dedup-prune.yaml > /tmp/afterchive_dedup_backup.log 2>&1 &
+BACKUP_PID=$!
+sleep 2
+
+# A separate process expires the oldest backup, which collects unreferenced chunks
+if ! docker-compose exec -T -e DB_PASSWORD=11 afterchive-host \
+    afterchive prune --config tests/fixtures/postgres-dedup-prune.yaml --keep-last 1 > /tmp/afterchive_dedup_prune.log 2>&1; then
+    echo "✗ Test 22 FAILED: prune failed"
+    cat /tmp/afterchive_dedup_prune.log
+    docker-compose down -v
+    exit 1
+fi
+
+if ! wait $BACKUP_PID; then
+    echo "✗ Test 22 FAILED: the backup running during the prune failed"
+    cat /tmp/afterchive_dedup_backup.log
+    docker-compose down -v
+    exit 1
+fi
+
+if ! grep -q "A deduplicated backup is being stored here, skipping chunk cleanup" /tmp/afterchive_dedup_prune.log; then
+    echo "✗ Test 22 FAILED: prune collected chunks while a backup was being stored"
+    cat /tmp/afterchive_dedup_prune.log
+    docker-compose down -v
+    exit 1
+fi
+
+# Once the backup is done, pruning again collects the chunks; the newest backup stays whole
+docker-compose exec -T -e DB_PASSWORD=11 afterchive-host \
+    afterchive prune --config tests/fixtures/postgres-dedup-prune.yaml --keep-last 1 > /tmp/afterchive_dedup_prune.log 2>&1
+
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_dedup_prune;" > /dev/null 2>&1
+
+docker-compose exec -T -e DB_PASSWORD=11 afterchive-host \
+    afterchive restore --config tests/fixtures/postgres-dedup-prune.yaml --latest --source-db testdb > /dev/null
+
+ORIGINAL_ROWS=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*), md5(string_agg(payload, '' ORDER BY id)) FROM prune_data;")
+RESTORED_ROWS=$(docker-compose exec -T postgres psql -U testuser -d testdb_dedup_prune -tAc "SELECT COUNT(*), md5(string_agg(payload, '' ORDER BY id)) FROM prune_data;")
+
+if [ "$ORIGINAL_ROWS" != "$RESTORED_ROWS" ]; then
+    echo "✗ Test 22 FAILED: the backup stored during the prune restored '$RESTORED_ROWS', expected '$ORIGINAL_ROWS'"
+    docker-compose down -v
+    exit 1
+fi
 
+echo "✓ Test 22 PASSED"
 
 echo ""
 echo "======================================"
@@ -0,0 +1,248 @@
+#!/bin/bash
+set +e
+
+echo "======================================"
+echo "Postgres --> S3 Test"
+echo "======================================"
+
+# Start containers
+echo "1. Starting containers..."
+
+if docker-compose up -d --build --quiet > /dev/null 2>&1; then
+    echo "✓ Containers started"
+else
+    echo "✗ FAILED to start containers"
+    exit 1
+fi
+
+# Wait for Postgres to be ready
+echo "Waiting for Postgres to be ready..."
+sleep 5
+
+# Load test database
+echo "2. Loading test database from pgtest.sql..."
+
+if docker-compose exec -T postgres psql -U testuser -d testdb < fixtures/pgtest.sql > /dev/null; then
+    echo "✓ Test database loaded"
+else
+    echo "✗ FAILED to load test database"
+    docker-compose down -v
+    exit 1
+fi
+
+
+# Verify test data
+echo ""
+echo "Database contents:"
+docker-compose exec -T postgres psql -U testuser -d testdb -c "
+SELECT 'Users: ' || COUNT(*) FROM users
+UNION ALL
+SELECT 'Posts: ' || COUNT(*) FROM posts
+UNION ALL
+SELECT 'Comments: ' || COUNT(*) FROM comments;
+"
+
+echo "Setting up MinIO..."
+
+# Create bucket (S3_ENDPOINT_URL and the credentials come from docker-compose.yml)
+if ! docker-compose exec -T afterchive-host python3 -c "
+import os, boto3
+s3 = boto3.client('s3', endpoint_url=os.environ['S3_ENDPOINT_URL'])
+s3.create_bucket(Bucket='afterchive-test-bucket')
+" > /dev/null 2>&1; then
+    echo "✗ FAILED: Could not create MinIO bucket"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ MinIO bucket created"
+
+# Backup objects under a path, oldest first (manifests and the catalog left out)
+list_backups() {
+    docker-compose exec -T afterchive-host python3 -c "
+import os, boto3
+s3 = boto3.client('s3', endpoint_url=os.environ['S3_ENDPOINT_URL'])
+items = s3.list_objects_v2(Bucket='afterchive-test-bucket', Prefix='$1/').get('Contents', [])
+for item in sorted(items, key=lambda item: item['LastModified']):
+    if item['Key'].endswith(('.sql', '.dump', '.gz', '.zst')):
+        print(item['Key'])
+"
+}
+
+
+echo "======================================"
+echo "Test 1: Backup & Restore (CLI)"
+echo "======================================"
+
+# Backup
+docker-compose exec afterchive-host afterchive backup \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb \
+    --storage s3 \
+    --bucket afterchive-test-bucket \
+    --path ci-tests > /dev/null 2>&1
+
+# Verify backup in S3
+BACKUP_FILE=$(list_backups ci-tests | head -1 | tr -d '\r\n')
+
+if [ -z "$BACKUP_FILE" ]; then
+    echo "✗ FAILED: No backup file in S3"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Backup uploaded to S3"
+
+BACKUP_FILENAME=$(basename "$BACKUP_FILE")
+echo "Backup file: $BACKUP_FILENAME"
+
+# Restore
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_restored;" > /dev/null 2>&1
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "CREATE DATABASE testdb_restored;" > /dev/null 2>&1
+
+docker-compose exec afterchive-host afterchive restore \
+    --db-type postgres \
+    --db-host some-pg \
+    --db-port 5432 \
+    --db-pass 11 \
+    --db-user testuser \
+    --db-name testdb_restored \
+    --storage s3 \
+    --bucket afterchive-test-bucket \
+    --path ci-tests \
+    --backup-file "$BACKUP_FILENAME" > /dev/null 2>&1
+
+# Verify data
+ORIGINAL_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT COUNT(*) FROM users;")
+RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_restored -tAc "SELECT COUNT(*) FROM users;")
+
+if [ "$RESTORED_COUNT" != "$ORIGINAL_COUNT" ]; then
+    echo "✗ FAILED: Data count mismatch (original: $ORIGINAL_COUNT, restored: $RESTORED_COUNT)"
+    docker-compose down -v
+    exit 1
+fi
+
+ORIGINAL_DATA=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT username FROM users ORDER BY id;")
+RESTORED_DATA=$(docker-compose exec -T postgres psql -U testuser -d testdb_restored -tAc "SELECT username FROM users ORDER BY id;")
+
+if [ "$ORIGINAL_DATA" != "$RESTORED_DATA" ]; then
+    echo "✗ FAILED: Data content mismatch"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Restore successful ($RESTORED_COUNT users)"
+echo "✓ Test 1 PASSED"
+echo ""
+
+# ===========================================
+# TEST 2: Backup & Restore with YAML
+# ===========================================
+
+echo "======================================"
+echo "Test 2: Backup & Restore (YAML)"
+echo "======================================"
+
+# Backup
+docker-compose exec -e DB_PASSWORD=11 afterchive-host \
+    afterchive backup --config /app/tests/fixtures/postgres-s3.yaml > /dev/null 2>&1
+
+# Get newest backup
+YAML_BACKUP_FILE=$(list_backups yaml-tests | tail -1 | tr -d '\r\n')
+
+YAML_BACKUP_FILENAME=$(basename "$YAML_BACKUP_FILE")
+echo "✓ Backup created: $YAML_BACKUP_FILENAME"
+
+# Restore
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "DROP DATABASE IF EXISTS testdb_restored_yaml;" > /dev/null 2>&1
+docker-compose exec -T postgres psql -U testuser -d postgres \
+    -c "CREATE DATABASE testdb_restored_yaml;" > /dev/null 2>&1
+
+
+
+
+if ! docker-compose exec -e DB_PASSWORD=11 afterchive-host \
+    afterchive restore \
+    --config /app/tests/fixtures/postgres-s3.yaml \
+    --backup-file "$YAML_BACKUP_FILENAME" > /dev/null 2>&1; then
+    echo "❌ FAILED: YAML restore command failed"
+    docker-compose down -v
+    exit 1
+fi
+
+# Verify
+RESTORED_COUNT=$(docker-compose exec -T postgres psql -U testuser -d testdb_restored_yaml -tAc "SELECT COUNT(*) FROM users;")
+
+if [ "$RESTORED_COUNT" != "$ORIGINAL_COUNT" ]; then
+    echo "✗ FAILED: YAML restore data mismatch"
+    docker-compose down -v
+    exit 1
+fi
+
+ORIGINAL_DATA=$(docker-compose exec -T postgres psql -U testuser -d testdb -tAc "SELECT username FROM users ORDER BY id;")
+RESTORED_DATA=$(docker-compose exec -T postgres psql -U testuser -d testdb_restored_yaml -tAc "SELECT username FROM users ORDER BY id;")
+
+if [ "$ORIGINAL_DATA" != "$RESTORED_DATA" ]; then
+    echo "✗ FAILED: YAML data content mismatch"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Restore successful ($RESTORED_COUNT users)"
+echo "✓ Test 2 PASSED"
+echo ""
+
+# ===========================================
+# TEST 3: Multipart transfers
+# ===========================================
+
+echo "======================================"
+echo "Test 3: Multipart upload & ranged download"
+echo "======================================"
+
+# 23 MB in 5 MB parts: a streamed and a file upload, read back as parallel ranges
+if ! docker-compose exec -T afterchive-host python3 -c "
+import io, os, tempfile
+from core.storage import get_storage_strategy
+storage = get_storage_strategy('s3')
+config = {'bucket': 'afterchive-test-bucket', 'path': 'multipart', 'part_size_mb': 5, 'workers': 4}
+data = os.urandom(23 * 1024 * 1024 + 1)
+storage.store_stream(io.BytesIO(data), 'streamed.bin', config)
+path = os.path.join(tempfile.mkdtemp(), 'file.bin')
+with open(path, 'wb') as f:
+    f.write(data)
+storage.store(path, config)
+for name in ('streamed.bin', 'file.bin'):
+    with storage.retrieve_stream(name, config) as stream:
+        assert stream.read() == data, name
+    with open(storage.retrieve(name, config), 'rb') as f:
+        assert f.read() == data, name
+" > /dev/null 2>&1; then
+    echo "✗ FAILED: Multipart round trip"
+    docker-compose down -v
+    exit 1
+fi
+
+echo "✓ Test 3 PASSED"
+echo ""
+
+
+echo ""
+echo "======================================"
+echo "✓ ALL TESTS PASSED!"
+echo "======================================"
+
+# Cleanup
+echo ""
+echo "Cleaning up..."
+docker-compose down -v
+
+echo "✓ Done"
+
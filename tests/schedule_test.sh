@@ -0,0 +1,156 @@
+#!/bin/bash
+set -e
+
+# Cron schedules and the daemon loop, no containers needed:
+#   sh schedule_test.sh
+
+cd "$(dirname "$0")/.."
+
+PYTHON=${PYTHON:-python3}
+
+echo "======================================"
+echo "Schedule and daemon test"
+echo "======================================"
+
+echo ""
+echo "Test1: CronSchedule.next_after"
+
+$PYTHON - <<'EOF'
+import sys
+from datetime import datetime
+from core.schedule import CronSchedule
+
+# 2026-01-01 is a Thursday
+CASES = [
+    # Steps, ranges and lists
+    ("*/15 * * * *", datetime(2026, 1, 1, 0, 7), datetime(2026, 1, 1, 0, 15)),
+    ("5/20 * * * *", datetime(2026, 1, 1, 0, 30), datetime(2026, 1, 1, 0, 45)),
+    ("0 9-17/4 * * *", datetime(2026, 1, 1, 10, 0), datetime(2026, 1, 1, 13, 0)),
+    ("0 9-17/4 * * *", datetime(2026, 1, 1, 17, 0), datetime(2026, 1, 2, 9, 0)),
+    ("30 2 1,15 * *", datetime(2026, 1, 1, 3, 0), datetime(2026, 1, 15, 2, 30)),
+    ("0 12 * jan,jul *", datetime(2026, 2, 1, 0, 0), datetime(2026, 7, 1, 12, 0)),
+    ("0 0 * * mon-fri", datetime(2026, 1, 2, 0, 0), datetime(2026, 1, 5, 0, 0)),
+    # Strictly after, seconds ignored
+    ("0 0 * * *", datetime(2026, 1, 1, 0, 0), datetime(2026, 1, 2, 0, 0)),
+    ("* * * * *", datetime(2026, 1, 1, 0, 0, 59, 999), datetime(2026, 1, 1, 0, 1)),
+    # 0 and 7 are both Sunday
+    ("0 0 * * 7", datetime(2026, 1, 1, 0, 0), datetime(2026, 1, 4, 0, 0)),
+    ("0 0 * * 0", datetime(2026, 1, 1, 0, 0), datetime(2026, 1, 4, 0, 0)),
+    # Both day fields restricted: either one matches
+    ("0 0 13 * 5", datetime(2026, 1, 1, 0, 0), datetime(2026, 1, 2, 0, 0)),
+    ("0 0 13 * 5", datetime(2026, 1, 9, 0, 0), datetime(2026, 1, 13, 0, 0)),
+    # Only one restricted: it alone decides
+    ("0 0 13 * *", datetime(2026, 1, 1, 0, 0), datetime(2026, 1, 13, 0, 0)),
+    ("0 0 * * 5", datetime(2026, 1, 9, 0, 0), datetime(2026, 1, 16, 0, 0)),
+    ("0 0 13 * fri", datetime(2026, 1, 14, 0, 0), datetime(2026, 1, 16, 0, 0)),
+    # Month and year boundaries
+    ("@monthly", datetime(2026, 12, 15, 8, 0), datetime(2027, 1, 1, 0, 0)),
+    ("59 23 31 * *", datetime(2026, 2, 1, 0, 0), datetime(2026, 3, 31, 23, 59)),
+    ("0 0 29 2 *", datetime(2026, 3, 1, 0, 0), datetime(2028, 2, 29, 0, 0)),
+]
+
+INVALID = ["0 0 30 2 *", "61 * * * *", "* * * *", "*/0 * * * *", "0 0 * * 8", "0 0 10-5 * *"]
+
+failed = False
+for expression, after, expected in CASES:
+    got = CronSchedule(expression).next_after(after)
+    if got != expected:
+        print(f"✗ '{expression}' after {after}: {got}, expected {expected}")
+        failed = True
+
+for expression in INVALID:
+    try:
+        CronSchedule(expression).next_after(datetime(2026, 1, 1))
+    except ValueError:
+        continue
+    print(f"✗ '{expression}' should be rejected")
+    failed = True
+
+if failed:
+    print("✗ Test 1 FAILED")
+    sys.exit(1)
+print(f"{len(CASES)} schedules, {len(INVALID)} rejected expressions")
+EOF
+
+echo "✓ Test 1 PASSED"
+
+echo ""
+echo "Test2: a short daemon run skips a job that is still running"
+
+DAEMON_CONFIG=$(mktemp --suffix .yaml)
+DAEMON_LOG=$(mktemp)
+trap 'rm -f "$DAEMON_CONFIG" "$DAEMON_LOG"' EXIT
+
+cat > "$DAEMON_CONFIG" <<'EOF'
+storage:
+  type: local
+  path: /tmp/afterchive-daemon-test
+
+schedule: "* * * * *"
+
+jobs:
+  - name: slow
+    database: {type: postgres, host: db-a, name: slow}
+  - name: quick
+    database: {type: postgres, host: db-b, name: quick}
+  - name: disabled
+    database: {type: postgres, host: db-b, name: disabled}
+    schedule:
+      enabled: false
+EOF
+
+# The clock runs 60x fast, so the every-minute schedule fires each second.
+# Backups are replaced by a sleep: "slow" takes 2.5s and is due again
+# twice while it runs. SIGTERM after 5s stops the loop.
+$PYTHON - "$DAEMON_CONFIG" > "$DAEMON_LOG" 2>&1 <<'EOF'
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from core import daemon, jobs
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+
+real_time = time.time
+started = real_time()
+daemon.time.time = lambda: started + (real_time() - started) * 60
+daemon.TICK_SECONDS = 0.05
+daemon.random.uniform = lambda low, high: low
+
+
+def backup(database, storage, options):
+    time.sleep(2.5 if database["name"] == "slow" else 0.1)
+    return {"backup": f"{database['name']}.sql", "size": 0}
+
+
+jobs.run_backup = backup
+threading.Timer(5, os.kill, (os.getpid(), signal.SIGTERM)).start()
+daemon.run_daemon(sys.argv[1])
+EOF
+
+count() {
+    grep -c "$1" "$DAEMON_LOG" || true
+}
+
+if ! grep -q "Daemon started with 2 jobs" "$DAEMON_LOG" \
+    || ! grep -q "Daemon stopped" "$DAEMON_LOG" \
+    || [ "$(count 'Starting job quick')" -lt 3 ] \
+    || [ "$(count 'Job quick finished')" -lt 3 ] \
+    || [ "$(count 'Starting job slow')" -lt 1 ] \
+    || [ "$(count 'Job slow is still running, skipping this run')" -lt 1 ] \
+    || [ "$(count 'Starting job slow')" -gt 2 ] \
+    || grep -q "Starting job disabled" "$DAEMON_LOG"; then
+    echo "✗ Test 2 FAILED"
+    cat "$DAEMON_LOG"
+    exit 1
+fi
+
+echo "quick ran $(count 'Starting job quick') times, slow ran $(count 'Starting job slow') and was skipped $(count 'Job slow is still running') times"
+echo "✓ Test 2 PASSED"
+
+echo ""
+echo "======================================"
+echo "✓ ALL TESTS PASSED!"
+echo "======================================"
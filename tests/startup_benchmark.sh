@@ -0,0 +1,94 @@
+#!/bin/bash
+set -e
+
+# CLI startup budget: `afterchive --help` / `--version` must not import any
+# backend and must stay within a fixed time over a bare interpreter.
+# Budgets can be raised on slow machines, e.g.:
+#   IMPORT_BUDGET_MS=80 CLI_BUDGET_MS=150 sh startup_benchmark.sh
+
+cd "$(dirname "$0")/.."
+
+PYTHON=${PYTHON:-python3}
+IMPORT_BUDGET_MS=${IMPORT_BUDGET_MS:-40}
+CLI_BUDGET_MS=${CLI_BUDGET_MS:-60}
+RUNS=${RUNS:-15}
+
+echo "======================================"
+echo "CLI startup benchmark"
+echo "======================================"
+
+echo ""
+echo "Test1: --help imports no backends"
+
+HEAVY=$($PYTHON -X importtime -m core.cli --help 2>&1 >/dev/null \
+    | grep -E "\| +(yaml|google|psycopg2|boto3|zstandard|core\.(commands|configs|storage|databases|jobs|daemon))$" || true)
+
+if [ -n "$HEAVY" ]; then
+    echo "✗ Test 1 FAILED: --help imported:"
+    echo "$HEAVY"
+    exit 1
+fi
+
+echo "✓ Test 1 PASSED"
+
+echo ""
+echo "Test2: import time of core.cli (budget ${IMPORT_BUDGET_MS} ms)"
+
+# Best of a few runs, -X importtime reports cumulative microseconds
+IMPORT_US=$(for i in 1 2 3 4 5; do
+    $PYTHON -X importtime -c "import core.cli" 2>&1 | awk -F'|' '$3 ~ / core\.cli$/ {print $2 + 0}'
+done | sort -n | head -n1)
+
+echo "core.cli: $((IMPORT_US / 1000)) ms"
+
+if [ "$IMPORT_US" -gt $((IMPORT_BUDGET_MS * 1000)) ]; then
+    echo "✗ Test 2 FAILED: core.cli import took $((IMPORT_US / 1000)) ms"
+    $PYTHON -X importtime -c "import core.cli" 2>&1 | sort -t'|' -k2 -n | tail -15
+    exit 1
+fi
+
+echo "✓ Test 2 PASSED"
+
+echo ""
+echo "Test3: wall clock of --help/--version (budget ${CLI_BUDGET_MS} ms over bare python)"
+
+# Median of $RUNS runs each, minus the median of a bare interpreter start
+$PYTHON - "$RUNS" "$CLI_BUDGET_MS" <<'EOF'
+import statistics
+import subprocess
+import sys
+import time
+
+runs, budget = int(sys.argv[1]), float(sys.argv[2])
+
+
+def median_ms(args):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+baseline = median_ms(["-c", "pass"])
+print(f"bare python: {baseline:.0f} ms")
+
+failed = False
+for flag in ("--help", "--version"):
+    elapsed = median_ms(["-m", "core.cli", flag])
+    overhead = elapsed - baseline
+    print(f"afterchive {flag}: {elapsed:.0f} ms (+{overhead:.0f} ms)")
+    if overhead > budget:
+        print(f"✗ Test 3 FAILED: afterchive {flag} is {overhead:.0f} ms over bare python")
+        failed = True
+
+sys.exit(1 if failed else 0)
+EOF
+
+echo "✓ Test 3 PASSED"
+
+echo ""
+echo "======================================"
+echo "✓ ALL TESTS PASSED!"
+echo "======================================"
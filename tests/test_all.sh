@@ -32,9 +32,12 @@ run_test() {
     fi
 }
 
-# Run all tests (each rebuilds containers)
+# Run all tests (each rebuilds containers, except the startup benchmark and schedule test)
+run_test "startup_benchmark.sh" "CLI startup budget"
+run_test "schedule_test.sh" "Schedules and daemon"
 run_test "postgres_local_test.sh" "Postgres --> Local"
 run_test "postgres_gcp_test.sh" "Postgres --> GCP"
+run_test "postgres_s3_test.sh" "Postgres --> S3"
 
 # Final summary
 echo ""